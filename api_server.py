@@ -1,17 +1,41 @@
 #!/usr/bin/env python3
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Header, Response, status
+from fastapi.responses import ORJSONResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from pydantic import BaseModel, ConfigDict, Field
-from typing import Optional, List, Dict, Any
-from datetime import timedelta, datetime
+from typing import Optional, List, Dict, Any, Callable, Tuple
+from contextlib import asynccontextmanager
+import anyio.to_thread
+import hashlib
+import logging
+import threading
 import uvicorn
+import sys
 import time
 
-from container_manager import DockerContainerManager, load_config
+from container_manager import DockerContainerManager, get_config
 from dynamic_tunnel_manager import DynamicTunnelManager
-from auth import authenticate_user, create_access_token, get_current_user, JWT_SETTINGS
+from auth import authenticate_user, create_access_token, get_current_user, ACCESS_TOKEN_EXPIRES
 
-app = FastAPI(title="GPU Container Management API")
+# 各模块通过 logging 输出日志，级别由 config.json 中的 logging.level 控制（生产环境可设为 WARNING）
+logging.basicConfig(
+    level=get_config().get('logging', {}).get('level', 'INFO'),
+    format="%(asctime)s [%(name)s] %(levelname)s: %(message)s"
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：放大线程池容量，退出时保存隧道状态"""
+    # 接口均为同步函数，由线程池执行以免 Docker/NPS 的阻塞调用卡住事件循环；
+    # 默认 40 个线程在并发容器操作时容易排队
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    limiter.total_tokens = get_config().get('uvicorn', {}).get('threadpool_size', 200)
+    yield
+    # 下次启动时可直接加载隧道映射缓存，不必等待 NPS 全量查询
+    if tunnel_manager:
+        tunnel_manager.cleanup()
+
+app = FastAPI(title="GPU Container Management API", default_response_class=ORJSONResponse, lifespan=lifespan)
 
 try:
     tunnel_manager = DynamicTunnelManager()
@@ -33,6 +57,8 @@ else:
     manager = None
 
 class Token(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     access_token: str
     token_type: str
 
@@ -43,17 +69,23 @@ class ContainerConfig(BaseModel):
     jupyter_dir: str = Field(default="/root", description="Notebook directory for Jupyter")
 
 class ContainerCreate(BaseModel):
+    # 去除名称/镜像首尾空白（仅作用于本模型的字段，不影响 config 中的密码等）
+    model_config = ConfigDict(str_strip_whitespace=True)
+
     image: str
     name: str
     config: Optional[ContainerConfig] = None
 
+# 以下为只用于输出的模型，冻结后不会在构造后被修改
 class PortInfo(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     ssh_port: Optional[int] = None
     jupyter_port: Optional[int] = None
     app_port: Optional[int] = None
 
 class ContainerInfo(BaseModel):
-    model_config = ConfigDict(arbitrary_types_allowed=True)
+    model_config = ConfigDict(arbitrary_types_allowed=True, frozen=True)
     
     name: str
     id: Optional[str] = None
@@ -67,6 +99,8 @@ class ContainerInfo(BaseModel):
     error: Optional[str] = None
 
 class ApiResponse(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     success: bool
     message: str
     data: Optional[Dict[str, Any]] = None
@@ -75,6 +109,8 @@ class SnapshotCreate(BaseModel):
     commit_message: Optional[str] = None
 
 class SnapshotInfo(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     tag: str
     index: int
     created: Optional[str] = None
@@ -84,11 +120,13 @@ class SnapshotInfo(BaseModel):
     found: bool
 
 class ContainerSnapshotList(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     container_name: str
     versions: List[SnapshotInfo]
     
 @app.post("/token", response_model=Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
+def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
     """获取访问令牌"""
     user = authenticate_user(form_data.username, form_data.password)
     if not user:
@@ -97,20 +135,62 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token_expires = timedelta(minutes=JWT_SETTINGS['access_token_expire_minutes'])
     access_token = create_access_token(
         data={"sub": user['username']}, 
-        expires_delta=access_token_expires
+        expires_delta=ACCESS_TOKEN_EXPIRES
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
+def _api_response(message: str, data: Optional[Dict[str, Any]] = None) -> ORJSONResponse:
+    """构造 ApiResponse 结构的成功响应，直接序列化而不经过模型校验"""
+    return ORJSONResponse({"success": True, "message": message, "data": data})
+
+# 所有请求共用同一个 DockerContainerManager（及其持有的 Docker 客户端连接池），
+# 并限制同时进行的容器操作数量，避免线程池放大后大量请求同时压到 Docker Daemon。
+# 信号量只包住实际的 Docker 调用：鉴权失败或命中列表缓存的请求不占用名额
+_docker_ops = threading.BoundedSemaphore(get_config().get('docker', {}).get('max_concurrent_ops', 8))
+
+# 列表接口响应缓存：{key: (etag, body, 生成时间)}
+# 面板类客户端会频繁轮询列表接口，1 秒内的重复请求直接复用上次的结果；
+# 任何变更容器状态的接口都会清空缓存并递增代数，
+# 构建期间发生过变更的结果不会写回缓存
+_LIST_CACHE_TTL = 1.0
+_list_cache: Dict[str, Tuple[str, bytes, float]] = {}
+_list_cache_lock = threading.Lock()
+_list_cache_generation = 0
+
+def _invalidate_list_cache():
+    global _list_cache_generation
+    with _list_cache_lock:
+        _list_cache.clear()
+        _list_cache_generation += 1
+
+def _cached_list_response(key: str, if_none_match: Optional[str], build: Callable[[], Any]) -> Response:
+    """返回带 ETag 的列表响应，客户端缓存仍然有效时返回 304"""
+    now = time.monotonic()
+    with _list_cache_lock:
+        cached = _list_cache.get(key)
+        generation = _list_cache_generation
+    if cached is None or now - cached[2] >= _LIST_CACHE_TTL:
+        body = ORJSONResponse(build()).body
+        etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+        cached = (etag, body, now)
+        with _list_cache_lock:
+            if generation == _list_cache_generation:
+                _list_cache[key] = cached
+
+    etag, body, _ = cached
+    if if_none_match and (if_none_match.strip() == '*' or etag in [t.strip() for t in if_none_match.split(',')]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
 def get_manager() -> DockerContainerManager:
     if manager is None:
         raise HTTPException(status_code=503, detail="Container Manager is not available")
     return manager
 
 @app.post("/containers", response_model=ApiResponse)
-async def api_create_container(
+def api_create_container(
     container: ContainerCreate,
     manager: DockerContainerManager = Depends(get_manager),
     current_user: dict = Depends(get_current_user)
@@ -120,7 +200,9 @@ async def api_create_container(
     if container.config:
         config_dict = container.config.model_dump()
     
-    ports_info = manager.create_container(container.image, container.name, config_dict)
+    with _docker_ops:
+        ports_info = manager.create_container(container.image, container.name, config_dict)
+    _invalidate_list_cache()
     
     if ports_info is None:
         raise HTTPException(status_code=400, detail=f"Failed to create container '{container.name}'. Check logs for details.")
@@ -128,9 +210,8 @@ async def api_create_container(
     ssh_password = (config_dict or {}).get('root_password', "password")
     jupyter_token = (config_dict or {}).get('jupyter_token', "")
     
-    return ApiResponse(
-        success=True,
-        message=f"Container '{container.name}' created successfully",
+    return _api_response(
+        f"Container '{container.name}' created successfully",
         data={
             "name": container.name,
             "public_ports": ports_info,
@@ -142,147 +223,161 @@ async def api_create_container(
     )
 
 @app.post("/containers/{name}/stop", response_model=ApiResponse)
-async def api_stop_container(
+def api_stop_container(
     name: str,
     manager: DockerContainerManager = Depends(get_manager),
     current_user: dict = Depends(get_current_user)
 ):
     """停止容器 (不创建快照)"""
-    success = manager.stop_container(name)
+    with _docker_ops:
+        success = manager.stop_container(name)
+    _invalidate_list_cache()
     if not success:
         raise HTTPException(status_code=400, detail=f"Failed to stop container '{name}'")
-    return ApiResponse(
-        success=True,
-        message=f"Container '{name}' stopped successfully"
-    )
+    return _api_response(f"Container '{name}' stopped successfully")
 
 @app.post("/containers/{name}/start", response_model=ApiResponse)
-async def api_start_container(
+def api_start_container(
     name: str,
     manager: DockerContainerManager = Depends(get_manager),
     current_user: dict = Depends(get_current_user)
 ):
     """启动已停止的容器 (不通过快照启动)"""
-    ports_info = manager.start_container(name)
+    with _docker_ops:
+        ports_info = manager.start_container(name)
+    _invalidate_list_cache()
     if ports_info is None:
         raise HTTPException(status_code=400, detail=f"Failed to start container '{name}'")
-    return ApiResponse(
-        success=True,
-        message=f"Container '{name}' started successfully",
+    return _api_response(
+        f"Container '{name}' started successfully",
         data={"name": name, "public_ports": ports_info}
     )
 
 @app.delete("/containers/{name}", response_model=ApiResponse)
-async def api_remove_container(
+def api_remove_container(
     name: str,
     remove_snapshots: bool = False,
     manager: DockerContainerManager = Depends(get_manager),
     current_user: dict = Depends(get_current_user)
 ):
     """删除容器 (可选删除快照)"""
-    success = manager.remove_container(name, remove_snapshots)
+    with _docker_ops:
+        success = manager.remove_container(name, remove_snapshots)
+    _invalidate_list_cache()
     if not success:
         raise HTTPException(status_code=400, detail=f"Failed to remove container '{name}' or operation partially failed. Check logs.")
-    return ApiResponse(
-        success=True,
-        message=f"Container '{name}' removed successfully" + (" along with its snapshots" if remove_snapshots else "")
-    )
+    return _api_response(f"Container '{name}' removed successfully" + (" along with its snapshots" if remove_snapshots else ""))
+
+def _container_info(status_dict: Dict[str, Any]) -> Dict[str, Any]:
+    """将管理器返回的状态字典转换为 ContainerInfo 结构（不修改原字典）"""
+    # 管理器输出的数据可信，使用 model_construct 跳过字段校验
+    public_ports_data = status_dict.get('public_ports')
+    ports_model = PortInfo.model_construct(**public_ports_data) if public_ports_data else None
+    fields = {key: value for key, value in status_dict.items() if key != 'public_ports'}
+    return ContainerInfo.model_construct(**fields, public_ports=ports_model).model_dump()
 
 @app.get("/containers/{name}", response_model=ContainerInfo)
-async def api_get_container_status(
+def api_get_container_status(
     name: str,
     manager: DockerContainerManager = Depends(get_manager),
     current_user: dict = Depends(get_current_user)
 ):
     """获取单个容器的详细状态"""
-    status_dict = manager.container_status(name)
+    with _docker_ops:
+        status_dict = manager.container_status(name)
     if status_dict is None:
         raise HTTPException(status_code=404, detail=f"Container '{name}' not found or failed to get status")
         
-    public_ports_data = status_dict.get('public_ports')
-    ports_model = PortInfo(**public_ports_data) if public_ports_data else None
-    
-    status_dict.pop('public_ports', None)
-        
-    return ContainerInfo(**status_dict, public_ports=ports_model)
+    # 直接返回 ORJSONResponse，跳过 response_model 的二次校验与 jsonable_encoder
+    return ORJSONResponse(_container_info(status_dict))
 
 @app.get("/containers", response_model=List[ContainerInfo])
-async def api_list_containers(
+def api_list_containers(
     all_containers: bool = True,
+    if_none_match: Optional[str] = Header(None),
     manager: DockerContainerManager = Depends(get_manager),
     current_user: dict = Depends(get_current_user)
 ):
     """列出所有管理的容器"""
-    containers_data = manager.list_containers(all_containers)
-    result_list = []
-    for status_dict in containers_data:
-        public_ports_data = status_dict.get('public_ports')
-        ports_model = PortInfo(**public_ports_data) if public_ports_data else None
-        status_dict.pop('public_ports', None)
-        result_list.append(ContainerInfo(**status_dict, public_ports=ports_model))
-    return result_list
+    def build():
+        with _docker_ops:
+            containers = manager.list_containers(all_containers)
+        return [_container_info(status_dict) for status_dict in containers]
+    return _cached_list_response(f"containers:{all_containers}", if_none_match, build)
 
 @app.post("/containers/{name}/snapshots", response_model=ApiResponse)
-async def api_create_snapshot(
+def api_create_snapshot(
     name: str,
     snapshot_config: SnapshotCreate,
     manager: DockerContainerManager = Depends(get_manager),
     current_user: dict = Depends(get_current_user)
 ):
     """为正在运行的容器创建快照 (会先停止容器)"""
-    snapshot_tag = manager.stop_and_commit(name, snapshot_config.commit_message)
+    with _docker_ops:
+        snapshot_tag = manager.stop_and_commit(name, snapshot_config.commit_message)
+    _invalidate_list_cache()
     if snapshot_tag is None:
         raise HTTPException(status_code=400, detail=f"Failed to create snapshot for container '{name}'")
-    return ApiResponse(
-        success=True,
-        message=f"Snapshot '{snapshot_tag}' created successfully for container '{name}'",
+    return _api_response(
+        f"Snapshot '{snapshot_tag}' created successfully for container '{name}'",
         data={"snapshot_tag": snapshot_tag}
     )
 
 @app.post("/containers/{name}/start_from_snapshot", response_model=ApiResponse)
-async def api_start_from_snapshot(
+def api_start_from_snapshot(
     name: str,
     version_tag: Optional[str] = None,
     manager: DockerContainerManager = Depends(get_manager),
     current_user: dict = Depends(get_current_user)
 ):
     """从指定快照启动容器 (会替换现有同名容器)"""
-    ports_info = manager.start_from_snapshot(name, version_tag)
+    with _docker_ops:
+        ports_info = manager.start_from_snapshot(name, version_tag)
+    _invalidate_list_cache()
     if ports_info is None:
         raise HTTPException(status_code=400, detail=f"Failed to start container '{name}' from snapshot" + (f" '{version_tag}'" if version_tag else " (latest)"))
-    return ApiResponse(
-        success=True,
-        message=f"Container '{name}' started successfully from snapshot"+ (f" '{version_tag}'" if version_tag else " (latest)"),
+    return _api_response(
+        f"Container '{name}' started successfully from snapshot"+ (f" '{version_tag}'" if version_tag else " (latest)"),
         data={"name": name, "public_ports": ports_info}
     )
 
 @app.get("/containers/{name}/snapshots", response_model=List[ContainerSnapshotList])
-async def api_list_container_snapshots(
+def api_list_container_snapshots(
     name: str,
     manager: DockerContainerManager = Depends(get_manager),
     current_user: dict = Depends(get_current_user)
 ):
     """列出指定容器的所有快照"""
-    snapshots_data = manager.list_snapshots(name)
+    with _docker_ops:
+        snapshots_data = manager.list_snapshots(name)
     if not snapshots_data:
-        return []
-    return snapshots_data
+        return ORJSONResponse([])
+    return ORJSONResponse(snapshots_data)
 
 @app.get("/snapshots", response_model=List[ContainerSnapshotList])
-async def api_list_all_snapshots(
+def api_list_all_snapshots(
+    if_none_match: Optional[str] = Header(None),
     manager: DockerContainerManager = Depends(get_manager),
     current_user: dict = Depends(get_current_user)
 ):
     """列出所有容器的所有快照"""
-    return manager.list_snapshots()
+    def build():
+        with _docker_ops:
+            return manager.list_snapshots()
+    return _cached_list_response("snapshots", if_none_match, build)
 
 if __name__ == "__main__":
-    config = load_config()
+    config = get_config()
     uvicorn_config = config.get('uvicorn', {})
     host = uvicorn_config.get('host', "0.0.0.0")
     port = uvicorn_config.get('port', 8000)
     """自动重载"""
     reload = uvicorn_config.get('reload', False)
+    # 每个 worker 进程各自持有容器/隧道/端口状态并写同一组状态文件，默认单进程
+    workers = uvicorn_config.get('workers', 1)
+    
+    # uvloop 不支持 Windows，其余平台使用 uvloop + httptools（均随 uvicorn[standard] 安装）
+    loop = "asyncio" if sys.platform == "win32" else "uvloop"
     
-    print(f"Starting API server on {host}:{port}...")
-    uvicorn.run("api_server:app", host=host, port=port, reload=reload)
\ No newline at end of file
+    print(f"Starting API server on {host}:{port} (workers: {workers})...")
+    uvicorn.run("api_server:app", host=host, port=port, reload=reload, workers=workers, loop=loop, http="httptools")
\ No newline at end of file
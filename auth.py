@@ -1,65 +1,128 @@
-from datetime import datetime, timedelta
+from datetime import timedelta
 from typing import Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from jose import JWTError, jwt
+from cachetools import TLRUCache, TTLCache
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerifyMismatchError
 import hashlib
-import json
+import hmac
+import jwt
+import orjson
 import os
+import threading
+import time
 
 # 加载用户配置
 def load_users_config():
     config_path = os.path.join(os.path.dirname(__file__), 'users.json')
-    with open(config_path, 'r') as f:
-        return json.load(f)
+    with open(config_path, 'rb') as f:
+        return orjson.loads(f.read())
 
 # 获取配置
 USERS_CONFIG = load_users_config()
 JWT_SETTINGS = USERS_CONFIG['jwt_settings']
-USERS = {user['username']: user for user in USERS_CONFIG['users']}
+
+# 令牌签发参数在启动时确定，避免每次请求重复查字典/构造 timedelta
+ACCESS_TOKEN_EXPIRES = timedelta(minutes=JWT_SETTINGS['access_token_expire_minutes'])
+_SECRET = JWT_SETTINGS['secret_key']
+_ALG = JWT_SETTINGS['algorithm']
+_ALGORITHMS = [_ALG]
 
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-def get_password_hash(password: str) -> str:
-    """使用 PBKDF2-SHA256 生成密码哈希"""
-    salt = "gpu_management_salt"  # 在生产环境中应该为每个用户使用唯一的salt
-    key = hashlib.pbkdf2_hmac(
+# 已验证凭据缓存：避免同一用户短时间内重复登录时反复执行密码哈希
+# 键为以进程内随机密钥计算的 HMAC-SHA256([username, password])，不在内存中保留明文密码；
+# 用 JSON 数组编码避免用户名/密码中的分隔符造成键冲突
+_auth_cache = TTLCache(maxsize=10_000, ttl=30)
+_AUTH_CACHE_KEY = os.urandom(32)
+_auth_cache_lock = threading.Lock()
+
+# 已验证令牌缓存：键为 sha256(token)，值为 (username, exp)
+# 每个条目的有效期取令牌剩余有效期与 30 秒中的较小值，过期令牌不会被缓存命中
+_JWT_CACHE_TTL = 30
+
+def _jwt_cache_ttu(_key, value, now):
+    _, exp = value
+    if exp is None:
+        return now + _JWT_CACHE_TTL
+    return now + min(exp - time.time(), _JWT_CACHE_TTL)
+
+_jwt_cache = TLRUCache(maxsize=10_000, ttu=_jwt_cache_ttu)
+_jwt_cache_lock = threading.Lock()
+
+# 密码哈希使用 Argon2id（每条记录自带随机 salt）
+_password_hasher = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
+
+# 旧版 PBKDF2 哈希使用的全局 salt，仅用于校验 users.json 中已有的十六进制哈希
+_LEGACY_SALT = b"gpu_management_salt"
+
+def _legacy_password_hash(password: str) -> bytes:
+    """旧版 PBKDF2-SHA256 密码哈希（原始字节）"""
+    return hashlib.pbkdf2_hmac(
         'sha256',  # 使用的哈希算法
         password.encode(),  # 要加密的密码
-        salt.encode(),  # salt值
+        _LEGACY_SALT,  # salt值
         100000,  # 迭代次数
         dklen=64  # 密钥长度
     )
-    return key.hex()
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """验证密码"""
-    return get_password_hash(plain_password) == hashed_password
+def get_password_hash(password: str) -> str:
+    """使用 Argon2id 生成密码哈希"""
+    return _password_hasher.hash(password)
+
+def verify_password(plain_password: str, hashed_password) -> bool:
+    """验证密码，兼容旧版 PBKDF2 哈希（bytes）"""
+    if isinstance(hashed_password, bytes):
+        return hmac.compare_digest(_legacy_password_hash(plain_password), hashed_password)
+    try:
+        return _password_hasher.verify(hashed_password, plain_password)
+    except (VerifyMismatchError, InvalidHashError):
+        return False
+
+def _load_user(user: dict) -> dict:
+    """构造内存中的用户记录：启动时一次性哈希化明文密码，且不保留明文"""
+    record = {key: value for key, value in user.items() if key != 'password'}
+    hashed_password = user.get('hashed_password')
+    if hashed_password is None:
+        record['hashed_password'] = get_password_hash(user['password'])
+    elif not hashed_password.startswith('$argon2'):
+        # 旧版 users.json 中的 PBKDF2 哈希以十六进制字符串保存
+        record['hashed_password'] = bytes.fromhex(hashed_password)
+    return record
+
+# 用户表（从配置中取出后不再保留原始记录，避免明文密码常驻内存）
+USERS = {user['username']: _load_user(user) for user in USERS_CONFIG.pop('users')}
 
 def authenticate_user(username: str, password: str):
     """验证用户"""
     if username not in USERS:
         return False
     user = USERS[username]
-    stored_password = user.get('hashed_password', get_password_hash(user['password']))
-    if not verify_password(password, stored_password):
+
+    cache_key = hmac.digest(_AUTH_CACHE_KEY, orjson.dumps([username, password]), 'sha256')
+    with _auth_cache_lock:
+        if cache_key in _auth_cache:
+            return user
+
+    if not verify_password(password, user['hashed_password']):
         return False
+
+    with _auth_cache_lock:
+        _auth_cache[cache_key] = True
     return user
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """创建访问令牌"""
     to_encode = data.copy()
     if expires_delta:
-        expire = datetime.utcnow() + expires_delta
+        expire_seconds = expires_delta.total_seconds()
     else:
-        expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(
-        to_encode, 
-        JWT_SETTINGS['secret_key'], 
-        algorithm=JWT_SETTINGS['algorithm']
-    )
+        expire_seconds = 15 * 60
+    # exp 直接使用整数时间戳，省去 datetime 的构造与转换
+    to_encode["exp"] = int(time.time() + expire_seconds)
+    encoded_jwt = jwt.encode(to_encode, _SECRET, algorithm=_ALG)
     return encoded_jwt
 
 async def get_current_user(token: str = Depends(oauth2_scheme)):
@@ -69,24 +132,25 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(
-            token, 
-            JWT_SETTINGS['secret_key'], 
-            algorithms=[JWT_SETTINGS['algorithm']]
-        )
-        username: str = payload.get("sub")
-        if username is None:
+    cache_key = hashlib.sha256(token.encode()).digest()
+    with _jwt_cache_lock:
+        cached = _jwt_cache.get(cache_key)
+
+    if cached is not None:
+        username = cached[0]
+    else:
+        try:
+            payload = jwt.decode(token, _SECRET, algorithms=_ALGORITHMS)
+            username: str = payload.get("sub")
+            if username is None:
+                raise credentials_exception
+        except jwt.PyJWTError:
             raise credentials_exception
-    except JWTError:
-        raise credentials_exception
+
+        with _jwt_cache_lock:
+            _jwt_cache[cache_key] = (username, payload.get("exp"))
     
     user = USERS.get(username)
     if user is None:
         raise credentials_exception
     return user
-
-# 初始化：确保管理员密码已经哈希化
-for username, user in USERS.items():
-    if 'hashed_password' not in user:
-        user['hashed_password'] = get_password_hash(user['password']) 
\ No newline at end of file
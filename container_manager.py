@@ -1,16 +1,31 @@
 #!/usr/bin/env python3
 import docker
 import docker.types
+import functools
+import heapq
+import itertools
+import queue
 import threading
 import json
+import logging
+import msgpack
+import orjson
 import os
+import re
+import shlex
+import string
 import time
-import socket
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from typing import Dict, Tuple, Optional, List, Any
-from datetime import datetime # 确保导入
+from datetime import datetime, timezone # 确保导入
 
 # 导入 DynamicTunnelManager
 from dynamic_tunnel_manager import DynamicTunnelManager
+from state_io import atomic_write
+
+logger = logging.getLogger(__name__)
 
 def load_config():
     """加载配置文件"""
@@ -20,18 +35,233 @@ def load_config():
             return json.load(f)
     except Exception as e:
         # 保留: 配置加载错误
-        print(f"[ContainerManager] Error: 加载配置文件失败 ({config_path}): {e}") 
+        logger.error("加载配置文件失败 (%s): %s", config_path, e) 
         return None
 
-# 全局配置
-CONFIG = load_config()
-if not CONFIG:
-    raise RuntimeError("加载配置失败，请检查 config.json")
+@functools.lru_cache(maxsize=1)
+def get_config() -> Optional[Dict[str, Any]]:
+    """全局配置，首次调用时才读取 config.json（导入模块本身不再读取文件）"""
+    return load_config()
+
+def _read_json(path: str) -> Any:
+    """读取 JSON 状态文件（orjson 解析失败时回退到标准库，兼容旧文件中的 NaN 等写法）"""
+    with open(path, 'rb') as f:
+        raw = f.read()
+    try:
+        return orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        return json.loads(raw)
+
+def _write_json(path: str, obj: Any):
+    """以缩进格式写入 JSON 状态文件"""
+    atomic_write(path, orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+
+def _resolve_state_file(path: str) -> Optional[str]:
+    """返回实际要读取的状态文件路径，不存在时返回 None
+
+    配置从 .json 切换为 .msgpack 后，首次启动读取同名的旧 JSON 文件，下次保存即完成迁移。
+    """
+    if os.path.exists(path):
+        return path
+    if path.endswith('.msgpack'):
+        legacy_path = path[:-len('.msgpack')] + '.json'
+        if os.path.exists(legacy_path):
+            return legacy_path
+    return None
+
+def _read_state_file(path: str) -> Any:
+    """读取状态文件，按扩展名选择格式：.msgpack 为 MessagePack，其余为 JSON"""
+    if path.endswith('.msgpack'):
+        with open(path, 'rb') as f:
+            return msgpack.unpackb(f.read())
+    return _read_json(path)
+
+def _encode_state(obj: Any) -> Any:
+    """msgpack 的 default 钩子：将状态中的 dataclass 转为字典（orjson 原生支持 dataclass）"""
+    if isinstance(obj, TunnelInfo):
+        return obj.to_dict()
+    raise TypeError(f"Cannot serialize {type(obj).__name__}")
+
+def _write_state_file(path: str, obj: Any):
+    """写入状态文件，格式与 _read_state_file 相同"""
+    if path.endswith('.msgpack'):
+        atomic_write(path, msgpack.packb(obj, default=_encode_state, use_bin_type=True))
+        return
+    _write_json(path, obj)
+
+@dataclass
+class TunnelInfo:
+    """单个服务的隧道记录（使用 __slots__，比嵌套字典更省内存，属性访问也更快）"""
+    __slots__ = ('tunnel_id', 'port', 'service', 'client_id', 'target', 'remark')
+    tunnel_id: Optional[int]
+    port: Optional[int]
+    service: Optional[str]
+    client_id: Optional[int]
+    target: Optional[str]
+    remark: Optional[str]
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "TunnelInfo":
+        """由 tunnel_manager 返回的字典或状态文件中的记录构造"""
+        return cls(
+            tunnel_id=data.get('tunnel_id'),
+            port=data.get('port'),
+            service=data.get('service'),
+            client_id=data.get('client_id'),
+            target=data.get('target'),
+            remark=data.get('remark')
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'tunnel_id': self.tunnel_id,
+            'port': self.port,
+            'service': self.service,
+            'client_id': self.client_id,
+            'target': self.target,
+            'remark': self.remark
+        }
+
+@functools.lru_cache(maxsize=4096)
+def _format_image_created(timestamp: int) -> str:
+    """将镜像摘要中的 Created（Unix 时间戳）格式化为 UTC 时间字符串，同一镜像重复列出时直接命中缓存"""
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+# 最近一次生成的快照时间戳 (秒, 字符串)，同一秒内连续提交时复用
+_LAST_SNAPSHOT_TS: Tuple[int, str] = (0, "")
+
+def _snapshot_timestamp() -> str:
+    """快照标签中的时间戳（本地时间，与已有标签格式一致），按秒缓存格式化结果"""
+    global _LAST_SNAPSHOT_TS
+    now = int(time.time())
+    cached_second, cached_str = _LAST_SNAPSHOT_TS
+    if now != cached_second:
+        cached_str = time.strftime("%Y%m%d_%H%M%S", time.localtime(now))
+        _LAST_SNAPSHOT_TS = (now, cached_str)
+    return cached_str
+
+def _short_image_id(image_id: str) -> str:
+    """与 docker-py Image.short_id 相同的短 ID"""
+    if image_id.startswith('sha256:'):
+        return image_id[:17]
+    return image_id[:10]
+
+def _ports_from_tunnels(tunnels: Dict[str, TunnelInfo]) -> Optional[Dict[str, int]]:
+    """由容器的隧道记录生成 {service}_port 端口字典，没有可用端口时返回 None"""
+    ports_info = {f"{service}_port": info.port for service, info in tunnels.items() if info.port is not None}
+    return ports_info or None
+
+# 容器启动脚本模板，创建容器时只需代入少量变量
+_START_COMMAND_TEMPLATE = string.Template("""
+set -e
+# Prepare SSH environment
+mkdir -p /var/run/sshd
+echo 'PermitRootLogin yes' >> /etc/ssh/sshd_config
+echo ${root_credentials} | chpasswd
+ssh-keygen -A
+/usr/sbin/sshd -D &
+echo "SSH service started"
+
+# Prepare and start Jupyter Lab
+mkdir -p ${notebook_dir} && chmod -R 777 ${notebook_dir}
+source /root/miniconda3/bin/activate || echo "Miniconda not found or activation failed"
+echo "Starting Jupyter Lab..."
+jupyter lab \\
+    --ip=0.0.0.0 \\
+    --port=${jupyter_port} \\
+    --allow-root \\
+    --no-browser \\
+    --ServerApp.token=${jupyter_token} \\
+    --notebook-dir=${notebook_dir} \\
+    --ServerApp.base_url=${jupyter_base_url} &> /var/log/jupyter.log &
+echo "Jupyter Lab started in background, logs at /var/log/jupyter.log"
+
+echo "Container setup complete. Keeping container alive."
+tail -f /dev/null
+""")
+
+# containers.get 结果的缓存时间（秒）
+_CONTAINER_CACHE_TTL = 1.5
+# list_containers 需要逐个查询容器状态时的最大并发数
+_STATUS_QUERY_WORKERS = 10
+# 刚被删除的容器在该时间（秒）内直接视为不存在，不再向 Docker 查询
+_KNOWN_MISSING_TTL = 30.0
+
+# 状态增量日志超过快照文件 2 倍（且不小于该大小）时合并为新快照
+_STATE_LOG_MIN_COMPACT_BYTES = 64 * 1024
+
+def _state_log_path(state_file: str) -> str:
+    """状态增量日志路径：与快照同名，扩展名为 .jsonl"""
+    return os.path.splitext(state_file)[0] + '.jsonl'
+
+def _read_state_log(log_file: str) -> List[Dict[str, Any]]:
+    """读取增量日志中的全部记录，文件不存在时返回空列表"""
+    records = []
+    if os.path.exists(log_file):
+        with open(log_file, 'rb') as f:
+            for line in f:
+                try:
+                    records.append(orjson.loads(line))
+                except orjson.JSONDecodeError:
+                    # 追加中途崩溃只会留下残缺的最后一行，忽略即可
+                    break
+    return records
+
+def _append_state_log(state_file: str, records: List[Dict[str, Any]]) -> bool:
+    """向快照对应的增量日志追加记录，返回日志是否已大到需要合并为快照"""
+    with open(_state_log_path(state_file), 'ab') as f:
+        f.write(b''.join(orjson.dumps(record) + b'\n' for record in records))
+        log_size = f.tell()
+    try:
+        snapshot_size = os.path.getsize(state_file)
+    except OSError:
+        snapshot_size = 0
+    return log_size > max(2 * snapshot_size, _STATE_LOG_MIN_COMPACT_BYTES)
+
+def _state_files_signature(state_file: str) -> Tuple:
+    """快照与增量日志的 (mtime_ns, size)，用于判断状态文件自上次读取后是否变化"""
+    signature = []
+    for path in (_resolve_state_file(state_file), _state_log_path(state_file)):
+        try:
+            st = os.stat(path) if path else None
+        except OSError:
+            st = None
+        signature.append((st.st_mtime_ns, st.st_size) if st else None)
+    return tuple(signature)
+
+def _remove_state_log(state_file: str):
+    """快照写入后删除增量日志（快照写入后、删除前崩溃也无妨：重放日志记录是幂等的）"""
+    try:
+        os.remove(_state_log_path(state_file))
+    except FileNotFoundError:
+        pass
+
+# 并行删除镜像时的最大并发请求数
+_IMAGE_REMOVE_WORKERS = 4
+
+# 后台删除旧镜像失败时的重试次数和首次重试间隔（秒），之后按指数增长
+_GC_MAX_RETRIES = 3
+_GC_RETRY_DELAY = 5.0
+
+# 提交快照时不写入镜像的环境变量（端口在每次创建容器时重新指定）
+_COMMIT_SKIP_ENV_PREFIXES = ("JUPYTER_PORT=", "APP_PORT=")
+# 快照标签 "<name>:v<version>_<timestamp>" 中的版本号
+_SNAPSHOT_VERSION_RE = re.compile(r':v(\d+)_')
+# 容器列表摘要中 Status 字段里的退出码，如 "Exited (137) 5 minutes ago"
+_EXIT_CODE_RE = re.compile(r'^Exited \((-?\d+)\)')
 
 # 移除 PortPoolManager 类
 # class PortPoolManager:
 #     ...
 
+def _flush_state_on_exit(method):
+    """装饰会修改状态的公开方法：方法内只标记状态为脏，返回时统一写盘一次"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._batched_state_save():
+            return method(self, *args, **kwargs)
+    return wrapper
+
 class DockerContainerManager:
     """Docker容器生命周期管理 (已集成动态隧道管理)"""
 
@@ -44,20 +274,47 @@ class DockerContainerManager:
         """
         docker_connected = False
         connection_errors = []
-        # 尝试不同的连接方式
-        urls_to_try = ['tcp://localhost:2375', 'tcp://localhost:2376', 'unix://var/run/docker.sock']
+        if not get_config():
+            raise RuntimeError("加载配置失败，请检查 config.json")
+        docker_config = get_config().get('docker', {})
+        # 连接池大小：API 线程池中的并发容器操作共用同一个客户端，默认的 10 个连接不够用；
+        # 配置值不低于内部单次并发查询/删除的线程数，否则这些请求会在连接池上排队
+        max_pool_size = max(docker_config.get('max_pool_size', 32), _STATUS_QUERY_WORKERS, _IMAGE_REMOVE_WORKERS)
+        # 尝试不同的连接方式：优先使用配置的地址和上次连接成功的地址，避免每次启动都逐个探测
+        url_cache_file = os.path.join(os.path.dirname(get_config()['persistence']['container_state_file']), 'docker_url')
+        cached_url = None
+        try:
+            with open(url_cache_file, 'r') as f:
+                cached_url = f.read().strip() or None
+        except OSError:
+            pass
+        urls_to_try = [docker_config.get('base_url'), cached_url,
+                       'tcp://localhost:2375', 'tcp://localhost:2376', 'unix://var/run/docker.sock']
+        urls_to_try = list(dict.fromkeys(url for url in urls_to_try if url))
         for url in urls_to_try:
+            client = None
             try:
                 # print(f"[ContainerManager Debug] Attempting to connect to Docker at {url}...") # 注释掉
-                self.client = docker.DockerClient(base_url=url)
-                self.client.ping() # 确保连接成功
+                client = docker.DockerClient(base_url=url, max_pool_size=max_pool_size)
+                client.ping() # 确保连接成功
+                self.client = client
                 # 保留: 连接成功信息
-                print(f"[ContainerManager] 成功连接到 Docker Daemon: {url}") 
+                logger.info("成功连接到 Docker Daemon: %s", url) 
                 docker_connected = True
                 break
             except Exception as e:
                 # print(f"[ContainerManager Debug] Connection to {url} failed: {e}") # 注释掉
                 connection_errors.append(f"{url}: {e}")
+                if client is not None:
+                    client.close()
+
+        if docker_connected and url != cached_url:
+            try:
+                os.makedirs(os.path.dirname(url_cache_file), exist_ok=True)
+                with open(url_cache_file, 'w') as f:
+                    f.write(url)
+            except OSError as e:
+                logger.warning("保存 Docker 连接地址失败 (%s): %s", url_cache_file, e)
         
         if not docker_connected:
             error_details = ' / '.join(connection_errors)
@@ -70,74 +327,242 @@ class DockerContainerManager:
         # 状态变量初始化
         self.container_images = {}
         self.image_history = {}
-        self.max_history_per_container = CONFIG.get('container_snapshots', {}).get('max_history', 1)
-        self.container_tunnels: Dict[str, Dict[str, Any]] = {}
+        self.snapshot_versions: Dict[str, int] = {} # 每个容器已分配的最大快照版本号
+        self.max_history_per_container = get_config().get('container_snapshots', {}).get('max_history', 1)
+        self.container_tunnels: Dict[str, Dict[str, TunnelInfo]] = {}
+        # API 接口在线程池中并发执行，状态文件写入需要串行化
+        self._persist_lock = threading.Lock()
+        # containers.get 结果缓存: {name: (container, 过期时间)}，容器被创建/启停/删除时失效
+        self._container_cache: Dict[str, Tuple[Any, float]] = {}
+        # 最近由本管理器删除的容器: {name: 过期时间}，容器被重新创建时移除
+        self._known_missing: Dict[str, float] = {}
+        # 旧镜像由后台线程删除，不阻塞创建/快照流程
+        self._gc_queue: "queue.Queue[str]" = queue.Queue()
+        threading.Thread(target=self._gc_worker, name="image-gc", daemon=True).start()
+        # 状态变更只标记为脏，由公开方法结束时统一写盘（见 _flush_state_on_exit）
+        self._save_batch = threading.local() # 当前线程 _batched_state_save 的嵌套深度
+        self._dirty_lock = threading.Lock() # 保护 _dirty_images/_dirty_tunnels 的标记与取出
+        self._dirty_images: set = set() # 镜像记录有变化的容器名，写入增量日志
+        self._images_signature: Optional[Tuple] = None # 上次加载/写入后镜像状态文件的签名
+        self._image_comments: Dict[str, str] = {} # 镜像 ID -> 提交信息（list_snapshots 使用）
+        self._snapshot_indexes: Dict[str, Dict[str, str]] = {} # 见 _snapshot_index
+        self._dirty_tunnels: set = set() # 隧道状态有变化的容器名，写入增量日志
+        # get_container_ports 的结果缓存，隧道状态变化时更新（见 _tunnels_changed）
+        self._ports_cache: Dict[str, Dict[str, int]] = {}
         
         # 加载持久化状态
         self._load_container_images()
         self._load_container_states()
         # 保留: 初始化完成信息
-        print("[ContainerManager] 初始化完成，已加载状态。") 
+        logger.info("初始化完成，已加载状态。") 
 
     def _load_container_images(self):
-        """从文件加载容器-镜像映射关系和历史记录"""
-        image_file = CONFIG['persistence']['image_mapping_file']
-        if os.path.exists(image_file):
-            try:
-                with open(image_file, 'r') as f:
-                    data = json.load(f)
-                    self.container_images = data.get('current', {})
-                    self.image_history = data.get('history', {})
-                    # print(f"[ContainerManager Debug] Loaded container images from {image_file}") # 注释掉
-            except Exception as e:
-                # 保留: 加载失败警告
-                print(f"[ContainerManager] Warning: 加载容器镜像映射失败 ({image_file}): {e}") 
+        """从文件加载容器-镜像映射关系和历史记录（快照 + 增量日志回放）
+
+        快照/提交流程会反复调用以“确保历史最新”，文件未变化时只需一次 stat。
+        """
+        image_file = get_config()['persistence']['image_mapping_file']
+        if self._dirty_images:
+            # 内存中有尚未写盘的修改，以内存为准，避免被旧文件覆盖
+            return
+        signature = _state_files_signature(image_file)
+        if signature == self._images_signature:
+            return
+        source_file = _resolve_state_file(image_file)
+        try:
+            data = _read_state_file(source_file) if source_file else {}
+            container_images = data.get('current', {})
+            image_history = data.get('history', {})
+            snapshot_versions = data.get('versions', {})
+            for record in _read_state_log(_state_log_path(image_file)):
+                name = record['name']
+                for mapping, value in ((container_images, record.get('current')), (image_history, record.get('history')),
+                                       (snapshot_versions, record.get('version'))):
+                    if value is None:
+                        mapping.pop(name, None)
+                    else:
+                        mapping[name] = value
+            self.container_images = container_images
+            self.image_history = image_history
+            self.snapshot_versions = snapshot_versions
+            self._snapshot_indexes = {}
+            self._images_signature = signature
+            # print(f"[ContainerManager Debug] Loaded container images from {image_file}") # 注释掉
+        except Exception as e:
+            # 保留: 加载失败警告
+            logger.warning("加载容器镜像映射失败 (%s): %s", image_file, e) 
+
+    def _images_changed(self, name: str):
+        """container_images/image_history 中 name 的记录被修改后调用，标记待写入增量日志"""
+        self._snapshot_indexes.pop(name, None)
+        with self._dirty_lock:
+            self._dirty_images.add(name)
+
+    def _snapshot_index(self, name: str) -> Dict[str, str]:
+        """容器快照的版本索引 {完整标签/标签部分/版本号: 完整标签}，历史记录变化时重建"""
+        index = self._snapshot_indexes.get(name)
+        if index is None:
+            index = {}
+            # 按时间顺序写入，同名键保留最新的快照
+            for tag in self.image_history.get(name, []):
+                tag_part = tag.rpartition(':')[2]
+                index[tag_part.partition('_')[0]] = tag
+                index[tag_part] = tag
+                index[tag] = tag
+            self._snapshot_indexes[name] = index
+        return index
 
     def _save_container_images(self):
-        """保存容器-镜像映射关系和历史记录到文件"""
-        image_file = CONFIG['persistence']['image_mapping_file']
+        """将完整的镜像映射和历史记录写为快照并清空增量日志（调用方需持有 _persist_lock）"""
+        image_file = get_config()['persistence']['image_mapping_file']
+        _write_state_file(image_file, {
+            'current': self.container_images,
+            'history': self.image_history,
+            'versions': self.snapshot_versions
+        })
+        _remove_state_log(image_file)
+
+    def _append_container_images(self, names):
+        """将指定容器的镜像记录追加到增量日志，日志过大时合并为快照"""
+        image_file = get_config()['persistence']['image_mapping_file']
         try:
             os.makedirs(os.path.dirname(image_file), exist_ok=True)
-            with open(image_file, 'w') as f:
-                json.dump({
-                    'current': self.container_images,
-                    'history': self.image_history
-                }, f, indent=2)
+            with self._persist_lock:
+                # current/history 为 None 表示该容器的对应记录已被删除
+                records = [
+                    {'name': name, 'current': self.container_images.get(name), 'history': self.image_history.get(name),
+                     'version': self.snapshot_versions.get(name)}
+                    for name in list(names)
+                ]
+                if _append_state_log(image_file, records):
+                    self._save_container_images()
+                # 自己写入的变化无需重新加载
+                self._images_signature = _state_files_signature(image_file)
             # print(f"[ContainerManager Debug] Saved container images to {image_file}") # 注释掉
         except Exception as e:
             # 保留: 保存失败警告
-            print(f"[ContainerManager] Warning: 保存容器镜像映射失败 ({image_file}): {e}") 
+            logger.warning("保存容器镜像映射失败 (%s): %s", image_file, e) 
             
     def _load_container_states(self):
-        """从文件加载容器隧道状态"""
-        state_file = CONFIG['persistence']['container_state_file']
-        if os.path.exists(state_file):
-            try:
-                with open(state_file, 'r') as f:
-                    self.container_tunnels = json.load(f)
-                    # print(f"[ContainerManager Debug] Loaded container states from {state_file}") # 注释掉
-            except Exception as e:
-                # 保留: 加载失败警告
-                print(f"[ContainerManager] Warning: 加载容器隧道状态失败 ({state_file}): {e}") 
-                self.container_tunnels = {}
+        """从文件加载容器隧道状态（快照 + 增量日志回放）"""
+        state_file = get_config()['persistence']['container_state_file']
+        source_file = _resolve_state_file(state_file)
+        try:
+            tunnels_by_name = _read_state_file(source_file) if source_file else {}
+            for record in _read_state_log(_state_log_path(state_file)):
+                if record.get('op') == 'set':
+                    tunnels_by_name[record['name']] = record['tunnels']
+                else:
+                    tunnels_by_name.pop(record['name'], None)
+            # 加载时一次性转换为 TunnelInfo，之后的查询均为属性访问
+            self.container_tunnels = {
+                name: {service: TunnelInfo.from_dict(info) for service, info in tunnels.items() if info}
+                for name, tunnels in tunnels_by_name.items()
+            }
+            self._ports_cache = {name: _ports_from_tunnels(tunnels) for name, tunnels in self.container_tunnels.items()}
+            # print(f"[ContainerManager Debug] Loaded container states from {state_file}") # 注释掉
+        except Exception as e:
+            # 保留: 加载失败警告
+            logger.warning("加载容器隧道状态失败 (%s): %s", state_file, e) 
+            self.container_tunnels = {}
+            self._ports_cache = {}
+
+    def _tunnels_changed(self, name: str):
+        """container_tunnels[name] 被修改后调用：更新端口缓存并标记待写入增量日志"""
+        tunnels = self.container_tunnels.get(name)
+        if tunnels is None:
+            self._ports_cache.pop(name, None)
+        else:
+            self._ports_cache[name] = _ports_from_tunnels(tunnels)
+        with self._dirty_lock:
+            self._dirty_tunnels.add(name)
 
     def _save_container_states(self):
-        """保存容器隧道状态到文件"""
-        state_file = CONFIG['persistence']['container_state_file']
+        """将完整的隧道状态写为快照并清空增量日志（调用方需持有 _persist_lock）"""
+        state_file = get_config()['persistence']['container_state_file']
+        _write_state_file(state_file, self.container_tunnels)
+        _remove_state_log(state_file)
+
+    def _append_container_states(self, names):
+        """将指定容器的隧道状态追加到增量日志（每次变更 O(1)），日志过大时合并为快照"""
+        state_file = get_config()['persistence']['container_state_file']
         try:
             os.makedirs(os.path.dirname(state_file), exist_ok=True)
-            with open(state_file, 'w') as f:
-                json.dump(self.container_tunnels, f, indent=2)
+            with self._persist_lock:
+                records = []
+                for name in list(names):
+                    tunnels = self.container_tunnels.get(name)
+                    if tunnels is None:
+                        records.append({'op': 'del', 'name': name})
+                    else:
+                        records.append({'op': 'set', 'name': name, 'tunnels': tunnels})
+                if _append_state_log(state_file, records):
+                    self._save_container_states()
             # print(f"[ContainerManager Debug] Saved container states to {state_file}") # 注释掉
         except Exception as e:
             # 保留: 保存失败警告
-            print(f"[ContainerManager] Warning: 保存容器隧道状态失败 ({state_file}): {e}") 
-
-    def _get_container_ip(self, container_name_or_id: str) -> Optional[str]:
-        """获取运行中容器的IP地址"""
+            logger.warning("保存容器隧道状态失败 (%s): %s", state_file, e) 
+
+    def _get_container(self, name: str):
+        """获取容器对象，短时间内重复查询同一容器时复用上次的结果（不存在时抛出 NotFound）"""
+        cached = self._container_cache.get(name)
+        if cached is not None and time.monotonic() < cached[1]:
+            return cached[0]
+        missing_until = self._known_missing.get(name)
+        if missing_until is not None:
+            if time.monotonic() < missing_until:
+                raise docker.errors.NotFound(f"No such container: {name}")
+            self._known_missing.pop(name, None)
+        container = self.client.containers.get(name)
+        self._container_cache[name] = (container, time.monotonic() + _CONTAINER_CACHE_TTL)
+        return container
+
+    def _forget_container(self, name: str):
+        """容器状态发生变化后使缓存失效"""
+        self._container_cache.pop(name, None)
+
+    def _mark_container_removed(self, name: str):
+        """容器已被删除：使缓存失效，并在一段时间内直接判定为不存在"""
+        self._container_cache.pop(name, None)
+        self._known_missing[name] = time.monotonic() + _KNOWN_MISSING_TTL
+
+    @contextmanager
+    def _batched_state_save(self):
+        """在此范围内只标记状态为脏，退出最外层时统一写盘一次
+
+        remove_container 会调用 stop_container，start_from_snapshot 又会调用 remove_container
+        和 create_container；嵌套调用只在最外层操作结束时写盘。嵌套深度按线程记录，
+        并发的其他操作不受影响。
+        """
+        depth = getattr(self._save_batch, 'depth', 0)
+        self._save_batch.depth = depth + 1
         try:
-            container = self.client.containers.get(container_name_or_id)
-            container.reload()
+            yield
+        finally:
+            self._save_batch.depth = depth
+            if depth == 0:
+                self._flush_if_dirty()
+
+    def _flush_if_dirty(self):
+        """将标记为脏的状态写入文件（每个文件最多写一次）"""
+        # 先在锁内取出并清除标记再写盘，写入期间其他线程的新修改会标记到新集合并触发下一次写入
+        with self._dirty_lock:
+            dirty_images, self._dirty_images = self._dirty_images, set()
+            dirty_tunnels, self._dirty_tunnels = self._dirty_tunnels, set()
+        if dirty_images:
+            self._append_container_images(dirty_images)
+        if dirty_tunnels:
+            self._append_container_states(dirty_tunnels)
+
+    def _get_container_ip(self, container_name_or_id) -> Optional[str]:
+        """获取运行中容器的IP地址（可直接传入已获取的容器对象，避免再次查询）"""
+        try:
+            if isinstance(container_name_or_id, str):
+                container = self.client.containers.get(container_name_or_id)
+            else:
+                container = container_name_or_id
+                container_name_or_id = container.name
+            # containers.get 返回的已是最新信息，无需再 reload
             networks = container.attrs['NetworkSettings']['Networks']
             if networks:
                 first_network_name = list(networks.keys())[0]
@@ -145,19 +570,128 @@ class DockerContainerManager:
                 if ip_address:
                     return ip_address
             # 保留: 未找到 IP 警告
-            print(f"[ContainerManager] Warning: 未找到容器 {container_name_or_id} 的 IP 地址") 
+            logger.warning("未找到容器 %s 的 IP 地址", container_name_or_id) 
             return None
         except docker.errors.NotFound:
             # 保留: 容器不存在错误
-            print(f"[ContainerManager] Error: 尝试获取 IP 时，容器 {container_name_or_id} 未找到。") 
+            logger.error("尝试获取 IP 时，容器 %s 未找到。", container_name_or_id) 
             return None
         except Exception as e:
             # 保留: 获取 IP 异常错误
-            print(f"[ContainerManager] Error: 获取容器 {container_name_or_id} 的 IP 地址时出错: {e}") 
+            logger.error("获取容器 %s 的 IP 地址时出错: %s", container_name_or_id, e) 
             return None
 
+    def _wait_for_ip(self, container, timeout: float = 5.0, interval: float = 0.1) -> Optional[str]:
+        """轮询等待容器分配到 IP 地址，超时或容器已退出时返回 None"""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                container.reload()
+            except docker.errors.NotFound:
+                logger.error("尝试获取 IP 时，容器 %s 未找到。", container.name)
+                return None
+            except Exception as e:
+                logger.error("获取容器 %s 的 IP 地址时出错: %s", container.name, e)
+                return None
+            networks = container.attrs.get('NetworkSettings', {}).get('Networks') or {}
+            for network in networks.values():
+                if network.get('IPAddress'):
+                    return network['IPAddress']
+            if container.status in ('exited', 'dead') or time.monotonic() >= deadline:
+                break
+            time.sleep(interval)
+        # 保留: 未找到 IP 警告
+        logger.warning("未找到容器 %s 的 IP 地址", container.name)
+        return None
+
+    def _create_container_tunnels(self, name: str, container_ip: str, services_to_tunnel: Dict[str, int]) -> Tuple[Dict[str, TunnelInfo], Dict[str, int], List[str]]:
+        """并行为容器的各个服务创建隧道，返回 (已创建的隧道, 端口信息, 失败的服务列表)"""
+        # 各服务的隧道互不依赖，每个都需要一次 NPS 往返，并行创建。
+        # 任一服务失败时调用方会回滚全部已创建的隧道，与原先 ssh 失败即中止的串行逻辑结果一致
+        with ThreadPoolExecutor(max_workers=len(services_to_tunnel)) as executor:
+            futures = {
+                service_name: executor.submit(
+                    self.tunnel_manager.create_tunnel,
+                    target=f"{container_ip}:{internal_port}",
+                    service_name=service_name,
+                    remark=f"Container:{name}_Service:{service_name}"
+                )
+                for service_name, internal_port in services_to_tunnel.items()
+            }
+
+        created_tunnels = {}
+        ports_info = {}
+        failed_services = []
+        for service_name, future in futures.items():
+            try:
+                tunnel_info = future.result()
+            except Exception as e:
+                logger.error("创建服务 '%s' 的隧道时出错: %s", service_name, e)
+                tunnel_info = None
+            if tunnel_info and tunnel_info.get("port") is not None:
+                created_tunnels[service_name] = TunnelInfo.from_dict(tunnel_info)
+                ports_info[f"{service_name}_port"] = tunnel_info["port"]
+            else:
+                failed_services.append(service_name)
+        return created_tunnels, ports_info, failed_services
+
+    def _gc_worker(self):
+        """后台删除旧镜像：批量取出队列中的镜像并发删除，失败的按指数退避重试"""
+        retries = [] # 堆: (到期时间, 已重试次数, 镜像标签)
+        with ThreadPoolExecutor(max_workers=_IMAGE_REMOVE_WORKERS) as executor:
+            while True:
+                timeout = max(0.0, retries[0][0] - time.monotonic()) if retries else None
+                batch = []
+                try:
+                    batch.append((self._gc_queue.get(timeout=timeout), 0))
+                    while True:
+                        batch.append((self._gc_queue.get_nowait(), 0))
+                except queue.Empty:
+                    pass
+                now = time.monotonic()
+                while retries and retries[0][0] <= now:
+                    _, attempt, image_tag = heapq.heappop(retries)
+                    batch.append((image_tag, attempt))
+                if not batch:
+                    continue
+
+                # Docker Daemon 可以并发处理删除请求
+                results = list(executor.map(self._try_remove_image, [image_tag for image_tag, _ in batch]))
+                for (image_tag, attempt), result in zip(batch, results):
+                    # 镜像可能仍被刚停止的容器占用，稍后再试
+                    if result == 'failed' and attempt < _GC_MAX_RETRIES:
+                        heapq.heappush(retries, (now + _GC_RETRY_DELAY * 2 ** attempt, attempt + 1, image_tag))
+                removed_count = results.count('removed')
+                failed_count = results.count('failed')
+                if removed_count > 0 or failed_count > 0:
+                    # 保留: 清理结果信息
+                    logger.info("旧镜像清理完成: 成功移除 %s 个, 失败 %s 个。", removed_count, failed_count)
+
+    def _try_remove_image(self, image_tag: str) -> str:
+        """删除一个旧镜像，返回 'removed' / 'missing' / 'failed'"""
+        try:
+            # 不再预先 images.get 检查，直接依赖 remove 抛出的 ImageNotFound
+            self.client.api.remove_image(image_tag, force=True)
+            # print(f"[ContainerManager] Removed old image: {image_tag}") # 注释掉
+            return 'removed'
+        except docker.errors.ImageNotFound:
+            # print(f"[ContainerManager Debug] Old image {image_tag} already removed.") # 注释掉
+            return 'missing' # 不算失败
+        except docker.errors.APIError as e:
+            if 'image is being used by stopped container' in str(e) or 'image is referenced in multiple repositories' in str(e):
+                 # print(f"[ContainerManager] Info: Cannot remove image {image_tag} as it might be in use or referenced elsewhere.") # 注释掉
+                 pass # 这种情况可以容忍
+            else:
+                # 保留: 删除旧镜像 API 错误
+                logger.warning("删除旧镜像失败 %s (API Error): %s", image_tag, e) 
+            return 'failed'
+        except Exception as e:
+            # 保留: 删除旧镜像未知错误
+            logger.warning("删除旧镜像时发生未知错误 %s: %s", image_tag, e) 
+            return 'failed'
+
     def _cleanup_old_images(self, container_name: str):
-        """清理旧的镜像，只保留最近的几个版本"""
+        """清理旧的镜像，只保留最近的几个版本（实际删除交给后台线程）"""
         if container_name not in self.image_history:
             return
 
@@ -166,55 +700,32 @@ class DockerContainerManager:
         if len(history) > max_history:
             images_to_remove = history[:-max_history]
             # print(f"[ContainerManager Debug] Cleaning up old images for {container_name}: {images_to_remove}") # 注释掉
-            removed_count = 0
-            failed_count = 0
             for image_tag in images_to_remove:
-                try:
-                    self.client.images.get(image_tag) # 检查是否存在
-                    self.client.images.remove(image_tag, force=True)
-                    # print(f"[ContainerManager] Removed old image: {image_tag}") # 注释掉
-                    removed_count += 1
-                except docker.errors.ImageNotFound:
-                    # print(f"[ContainerManager Debug] Old image {image_tag} already removed.") # 注释掉
-                    pass # 不算失败
-                except docker.errors.APIError as e:
-                    failed_count += 1
-                    if 'image is being used by stopped container' in str(e) or 'image is referenced in multiple repositories' in str(e):
-                         # print(f"[ContainerManager] Info: Cannot remove image {image_tag} as it might be in use or referenced elsewhere.") # 注释掉
-                         pass # 这种情况可以容忍
-                    else:
-                        # 保留: 删除旧镜像 API 错误
-                        print(f"[ContainerManager] Warning: 删除旧镜像失败 {image_tag} (API Error): {e}") 
-                except Exception as e:
-                    failed_count += 1
-                    # 保留: 删除旧镜像未知错误
-                    print(f"[ContainerManager] Warning: 删除旧镜像时发生未知错误 {image_tag}: {e}") 
-            
-            if removed_count > 0 or failed_count > 0:
-                 # 保留: 清理结果信息
-                 print(f"[ContainerManager] 旧镜像清理完成 ({container_name}): 成功移除 {removed_count} 个, 失败 {failed_count} 个。") 
+                self._gc_queue.put(image_tag)
             # 更新历史记录
             self.image_history[container_name] = history[-max_history:]
-            self._save_container_images()
+            self._images_changed(container_name)
 
+    @_flush_state_on_exit
     def create_container(self, image: str, name: str, container_config: dict = None) -> Optional[Dict[str, int]]:
         """创建并启动容器，并为其服务创建NPS隧道"""
         # print(f"[ContainerManager Debug] Request to create container: Name={name}, Image={image}") # 注释掉
         try:
-            existing_container = self.client.containers.get(name)
-            if existing_container:
+            # 按名称过滤列出（Docker 中名称带前导 /），不存在时返回空列表，无需 inspect 也无需异常分支
+            existing_containers = self.client.containers.list(
+                all=True, sparse=True, filters={'name': f'^/{re.escape(name)}$'}
+            )
+            if existing_containers:
                 # 保留: 容器已存在错误
-                print(f"[ContainerManager] Error: 容器 '{name}' 已存在。")
+                logger.error("容器 '%s' 已存在。", name)
                 return self.get_container_ports(name)
-        except docker.errors.NotFound:
-            pass # Ok
         except Exception as e:
             # 保留: 检查存在性时出错
-            print(f"[ContainerManager] Error: 检查容器 '{name}' 是否存在时出错: {e}")
+            logger.error("检查容器 '%s' 是否存在时出错: %s", name, e)
             return None
 
         # 配置合并逻辑
-        default_config = CONFIG.get('container_config', {}) # 使用 .get 以防 key 不存在
+        default_config = get_config().get('container_config', {}) # 使用 .get 以防 key 不存在
         if container_config is None:
             container_config = {}
         
@@ -230,11 +741,11 @@ class DockerContainerManager:
                         jupyter_config.get('notebook_dir', '/root'))
         # Restore logging to show the source of the notebook_dir
         if 'jupyter_dir' in container_config:
-            print(f"[ContainerManager] Info: 容器 '{name}' 将使用 Jupyter 根目录: '{notebook_dir}' (来自运行时参数 'jupyter_dir')")
+            logger.info("容器 '%s' 将使用 Jupyter 根目录: '%s' (来自运行时参数 'jupyter_dir')", name, notebook_dir)
         elif 'notebook_dir' in jupyter_config:
-             print(f"[ContainerManager] Info: 容器 '{name}' 将使用 Jupyter 根目录: '{notebook_dir}' (来自 config.json)")
+             logger.info("容器 '%s' 将使用 Jupyter 根目录: '%s' (来自 config.json)", name, notebook_dir)
         else:
-             print(f"[ContainerManager] Info: 容器 '{name}' 将使用 Jupyter 根目录: '{notebook_dir}' (默认值)")
+             logger.info("容器 '%s' 将使用 Jupyter 根目录: '%s' (默认值)", name, notebook_dir)
         
         config = {
             'ssh': {
@@ -252,35 +763,14 @@ class DockerContainerManager:
             }
         }
 
-        notebook_dir_setup = f"mkdir -p {config['jupyter']['notebook_dir']} && chmod -R 777 {config['jupyter']['notebook_dir']}"
-        # Corrected start_command f-string definition
-        start_command = f"""
-set -e
-# Prepare SSH environment
-mkdir -p /var/run/sshd
-echo 'PermitRootLogin yes' >> /etc/ssh/sshd_config
-echo 'root:{config['ssh']['root_password']}' | chpasswd
-ssh-keygen -A
-/usr/sbin/sshd -D &
-echo "SSH service started"
-
-# Prepare and start Jupyter Lab
-{notebook_dir_setup}
-source /root/miniconda3/bin/activate || echo "Miniconda not found or activation failed"
-echo "Starting Jupyter Lab..."
-jupyter lab \\
-    --ip=0.0.0.0 \\
-    --port={config['jupyter']['port']} \\
-    --allow-root \\
-    --no-browser \\
-    --ServerApp.token='{config['jupyter']['token']}' \\
-    --notebook-dir='{config['jupyter']['notebook_dir']}' \\
-    --ServerApp.base_url='{config['jupyter']['base_url']}' &> /var/log/jupyter.log &
-echo "Jupyter Lab started in background, logs at /var/log/jupyter.log"
-
-echo "Container setup complete. Keeping container alive."
-tail -f /dev/null
-"""
+        # 用户提供的值统一经 shlex.quote 转义后代入模板，避免破坏脚本或注入命令
+        start_command = _START_COMMAND_TEMPLATE.substitute(
+            root_credentials=shlex.quote(f"root:{config['ssh']['root_password']}"),
+            notebook_dir=shlex.quote(config['jupyter']['notebook_dir']),
+            jupyter_port=int(config['jupyter']['port']),
+            jupyter_token=shlex.quote(config['jupyter']['token']),
+            jupyter_base_url=shlex.quote(config['jupyter']['base_url'])
+        )
 
         # Define environment variables
         env_list = {
@@ -325,7 +815,7 @@ tail -f /dev/null
             container = self.client.containers.run(
                 image=image,
                 name=name,
-                hostname=CONFIG.get('container_config', {}).get('hostname', 'origincloud'),  # 从配置文件获取主机名，默认为 origincloud
+                hostname=get_config().get('container_config', {}).get('hostname', 'origincloud'),  # 从配置文件获取主机名，默认为 origincloud
                 detach=True,
                 tty=True,
                 stdin_open=True,
@@ -339,156 +829,134 @@ tail -f /dev/null
                 ports=ports,
                 **resource_config
             )
-            print(f"[ContainerManager] 容器 '{name}' 创建成功 (ID: {container.short_id})，已请求 GPU 访问。")
-
-            # 更新状态并保存
-            self.container_images[name] = image
-            if name not in self.image_history: self.image_history[name] = []
-            self.image_history[name].append(image)
-            self._save_container_images()
+            self._known_missing.pop(name, None)
+            logger.info("容器 '%s' 创建成功 (ID: %s)，已请求 GPU 访问。", name, container.short_id)
 
             # 等待并获取 IP
-            time.sleep(5)
-            container_ip = self._get_container_ip(name)
+            container_ip = self._wait_for_ip(container)
             if not container_ip:
-                print(f"[ContainerManager] Error: 无法获取容器 IP，正在尝试清理...")
+                logger.error("无法获取容器 IP，正在尝试清理...")
                 try:
-                    container.stop(timeout=5)
-                    container.remove()
-                    print(f"[ContainerManager] Info: 失败的容器 '{name}' 已清理。")
+                    self._discard_container(container.id)
+                    self._mark_container_removed(name)
+                    logger.info("失败的容器 '%s' 已清理。", name)
                 except Exception as rm_err:
-                    print(f"[ContainerManager] Warning: 清理失败的容器 '{name}' 时出错: {rm_err}")
+                    logger.warning("清理失败的容器 '%s' 时出错: %s", name, rm_err)
                 return None
 
             # 创建隧道逻辑
-            created_tunnels = {}
-            ports_info = {}
             services_to_tunnel = {
                 "ssh": config['ssh']['port'],
                 "jupyter": config['jupyter']['port'],
                 "app": config['app']['port']
             }
-            tunnel_creation_failed = False
-            failed_services = []
-
-            for service_name, internal_port in services_to_tunnel.items():
-                target = f"{container_ip}:{internal_port}"
-                remark = f"Container:{name}_Service:{service_name}"
-                tunnel_info = self.tunnel_manager.create_tunnel(
-                    target=target,
-                    service_name=service_name,
-                    remark=remark
-                )
-
-                if tunnel_info and tunnel_info.get("port") is not None:
-                    created_tunnels[service_name] = tunnel_info
-                    ports_info[f"{service_name}_port"] = tunnel_info["port"]
-                else:
-                    print(f"[ContainerManager] Error: 为容器 '{name}' 的服务 '{service_name}' 创建隧道失败。")
-                    tunnel_creation_failed = True
-                    failed_services.append(service_name)
-                    if service_name == 'ssh':
-                        break
+            created_tunnels, ports_info, failed_services = self._create_container_tunnels(name, container_ip, services_to_tunnel)
+            for service_name in failed_services:
+                logger.error("为容器 '%s' 的服务 '%s' 创建隧道失败。", name, service_name)
+            tunnel_creation_failed = bool(failed_services)
 
             if tunnel_creation_failed:
-                print(f"[ContainerManager] Error: 由于服务 {failed_services} 的隧道创建失败，正在回滚容器 '{name}'...")
+                logger.error("由于服务 %s 的隧道创建失败，正在回滚容器 '%s'...", failed_services, name)
                 for service, info in created_tunnels.items():
-                    if info.get("tunnel_id") is not None:
-                        self.tunnel_manager.delete_tunnel(info["tunnel_id"])
+                    if info.tunnel_id is not None:
+                        self.tunnel_manager.delete_tunnel(info.tunnel_id)
                 try:
-                    container.stop(timeout=5)
-                    container.remove()
+                    self._discard_container(container.id)
+                    self._mark_container_removed(name)
                 except Exception as clean_err:
-                    print(f"[ContainerManager] Warning: 回滚清理容器 '{name}' 时出错: {clean_err}")
-                if name in self.container_images: del self.container_images[name]
-                if name in self.image_history: del self.image_history[name]
-                self._save_container_images()
-                if name in self.container_tunnels: del self.container_tunnels[name]
-                self._save_container_states()
+                    logger.warning("回滚清理容器 '%s' 时出错: %s", name, clean_err)
+                # 镜像记录在全部隧道创建成功后才写入，回滚时无需撤销
+                if name in self.container_tunnels:
+                    del self.container_tunnels[name]
+                    self._tunnels_changed(name)
                 return None
 
+            # 容器与隧道均已就绪后再更新状态，由 _flush_state_on_exit 统一写盘
+            self.container_images[name] = image
+            if name not in self.image_history: self.image_history[name] = []
+            self.image_history[name].append(image)
+            self._images_changed(name)
             self.container_tunnels[name] = created_tunnels
-            self._save_container_states()
-            print(f"[ContainerManager] 容器 '{name}' 及关联隧道创建完成。")
+            self._tunnels_changed(name)
+            logger.info("容器 '%s' 及关联隧道创建完成。", name)
             return ports_info
 
         except docker.errors.ImageNotFound:
-            print(f"[ContainerManager] Error: 镜像 '{image}' 未找到。")
+            logger.error("镜像 '%s' 未找到。", image)
             return None
         except docker.errors.APIError as e:
-            print(f"[ContainerManager] Error: 创建容器 '{name}' 时出现 Docker API 错误: {e}")
+            logger.error("创建容器 '%s' 时出现 Docker API 错误: %s", name, e)
             if "container with name \\\"/{name}\\\" is already in use" in str(e):
-                 print(f"[ContainerManager] Info: 容器 '{name}' 已存在。将返回现有端口。")
+                 logger.info("容器 '%s' 已存在。将返回现有端口。", name)
                  return self.get_container_ports(name)
             return None
         except Exception as e:
-            print(f"[ContainerManager] Error: 创建容器 '{name}' 时发生意外错误: {e}")
+            logger.error("创建容器 '%s' 时发生意外错误: %s", name, e)
             try:
-                cont = self.client.containers.get(name)
-                cont.stop()
-                cont.remove()
+                self._discard_container(name)
+                self._mark_container_removed(name)
             except: pass
             return None
 
+    def _discard_container(self, container_id: str):
+        """回滚时直接强制删除刚创建的容器（SIGKILL + 删除，一次 API 调用，不等待优雅退出）"""
+        self.client.api.remove_container(container_id, force=True, v=True)
+
     def get_container_ports(self, name: str) -> Optional[Dict[str, int]]:
         """获取容器映射的公网端口 (主要从状态文件获取)"""
-        if name in self.container_tunnels:
-            ports_info = {}
-            for service, tunnel_data in self.container_tunnels[name].items():
-                if tunnel_data and 'port' in tunnel_data:
-                    ports_info[f"{service}_port"] = tunnel_data['port']
-            return ports_info if ports_info else None
-        # print(f"[ContainerManager Debug] No tunnel info found in state for {name}") # 注释掉
-        return None
+        # 端口字典在隧道状态变化时预先计算好，这里直接返回
+        return self._ports_cache.get(name)
 
-    def stop_container(self, name: str) -> bool:
-        """停止容器并删除其关联的NPS隧道"""
-        container = None
+    @_flush_state_on_exit
+    def stop_container(self, name: str, container=None) -> bool:
+        """停止容器并删除其关联的NPS隧道（调用方已持有容器对象时可直接传入，省去一次查询）"""
         try:
-            container = self.client.containers.get(name)
+            if container is None:
+                container = self._get_container(name)
             # print(f"[ContainerManager Debug] Stopping container {name}...") # 注释掉
             container.stop(timeout=10)
+            self._forget_container(name)
             # 保留: 停止成功信息
-            print(f"[ContainerManager] 容器 '{name}' 已停止。") 
+            logger.info("容器 '%s' 已停止。", name) 
         except docker.errors.NotFound:
             # 保留: 容器不存在警告 (但仍需清理隧道)
-            print(f"[ContainerManager] Warning: 尝试停止时，容器 '{name}' 未找到。") 
+            logger.warning("尝试停止时，容器 '%s' 未找到。", name) 
             # 继续执行下面的隧道清理逻辑
         except docker.errors.APIError as e:
             # 保留: 停止 API 错误
-            print(f"[ContainerManager] Error: 停止容器 '{name}' 时出错 (API Error): {e}") 
+            logger.error("停止容器 '%s' 时出错 (API Error): %s", name, e) 
             # 即使停止失败，也尝试清理隧道
         except Exception as e:
             # 保留: 停止未知错误
-            print(f"[ContainerManager] Error: 停止容器 '{name}' 时发生意外错误: {e}") 
+            logger.error("停止容器 '%s' 时发生意外错误: %s", name, e) 
             # 即使停止失败，也尝试清理隧道
 
         # 清理隧道逻辑 (无论容器是否找到或停止成功，都尝试清理)
         tunnel_cleanup_success = True
         if name in self.container_tunnels:
             tunnels_to_delete = self.container_tunnels.pop(name) # 直接从字典移除
-            self._save_container_states() # 更新状态文件
+            self._tunnels_changed(name)
             # print(f"[ContainerManager Debug] Deleting tunnels for container {name}...") # 注释掉
             deleted_count = 0
             failed_count = 0
             for service, tunnel_info in tunnels_to_delete.items():
-                if tunnel_info and tunnel_info.get("tunnel_id") is not None:
-                    tunnel_id = tunnel_info["tunnel_id"]
+                if tunnel_info.tunnel_id is not None:
+                    tunnel_id = tunnel_info.tunnel_id
                     # print(f"[ContainerManager Debug] Deleting tunnel {tunnel_id} for service {service}...") # 注释掉
                     if self.tunnel_manager.delete_tunnel(tunnel_id):
                         # print(f"[ContainerManager Debug] Tunnel {tunnel_id} deleted.") # 注释掉
                         deleted_count += 1
                     else:
                         # 隧道删除失败信息已由 tunnel_manager 打印
-                        print(f"[ContainerManager] Warning: 删除服务 '{service}' (Tunnel ID: {tunnel_id}) 的隧道失败。") 
+                        logger.warning("删除服务 '%s' (Tunnel ID: %s) 的隧道失败。", service, tunnel_id) 
                         tunnel_cleanup_success = False
                         failed_count += 1
                 else:
                      # 保留: 无 Tunnel ID 警告
-                     print(f"[ContainerManager] Warning: 无法删除服务 '{service}' 的隧道，因为状态中缺少 tunnel_id (容器: {name})。") 
+                     logger.warning("无法删除服务 '%s' 的隧道，因为状态中缺少 tunnel_id (容器: %s)。", service, name) 
             if deleted_count > 0 or failed_count > 0:
                  # 保留: 隧道清理结果
-                 print(f"[ContainerManager] 隧道清理完成 ({name}): 成功删除 {deleted_count} 个, 失败 {failed_count} 个。") 
+                 logger.info("隧道清理完成 (%s): 成功删除 %s 个, 失败 %s 个。", name, deleted_count, failed_count) 
         else:
             # print(f"[ContainerManager Debug] No tunnel information found in state for container {name}.") # 注释掉
             pass # 没有隧道记录，无需清理
@@ -497,34 +965,36 @@ tail -f /dev/null
         # 容器停止成功或不存在，并且隧道清理没有失败，才算完全成功
         return (container is not None or not docker.errors.NotFound) and tunnel_cleanup_success 
 
+    @_flush_state_on_exit
     def start_container(self, name: str) -> Optional[Dict[str, int]]:
         """启动已停止的容器，并重新创建NPS隧道"""
         try:
-            container = self.client.containers.get(name)
+            container = self._get_container(name)
             if container.status == 'running':
                  # 保留: 已运行信息
-                 print(f"[ContainerManager] Info: 容器 '{name}' 已在运行中。尝试获取现有端口...") 
+                 logger.info("容器 '%s' 已在运行中。尝试获取现有端口...", name) 
                  return self.get_container_ports(name)
                  
             # print(f"[ContainerManager Debug] Starting container {name}...") # 注释掉
             container.start()
+            self._forget_container(name)
             # 保留: 启动成功信息
-            print(f"[ContainerManager] 容器 '{name}' 已启动。") 
+            logger.info("容器 '%s' 已启动。", name) 
 
             # print(f"[ContainerManager Debug] Waiting for container {name} network...") # 注释掉
-            time.sleep(5) 
-            container_ip = self._get_container_ip(name)
+            container_ip = self._wait_for_ip(container)
             if not container_ip:
-                # 错误已在 _get_container_ip 打印
-                print(f"[ContainerManager] Error: 无法获取已启动容器 '{name}' 的 IP。尝试停止...") 
+                # 错误已在 _wait_for_ip 打印
+                logger.error("无法获取已启动容器 '%s' 的 IP。尝试停止...", name) 
                 try: container.stop(timeout=5) 
                 except: pass
+                self._forget_container(name)
                 return None
             
             # print(f"[ContainerManager Debug] Container {name} IP: {container_ip}. Re-creating tunnels...") # 注释掉
 
             # 获取内部端口配置
-            config = CONFIG['container_config']
+            config = get_config()['container_config']
             services_to_tunnel = {
                 "ssh": config['ssh'].get('port', 22),
                 "jupyter": config['jupyter'].get('port', 8888),
@@ -532,75 +1002,75 @@ tail -f /dev/null
             }
             
             # 重新创建隧道
-            created_tunnels = {}
-            ports_info = {}
-            tunnel_creation_failed = False
-            failed_services = []
             # print(f"[ContainerManager Debug] Re-creating tunnels for container {name}...") # 注释掉
-            for service_name, internal_port in services_to_tunnel.items():
-                target = f"{container_ip}:{internal_port}"
-                remark = f"Container:{name}_Service:{service_name}"
-                # print(f"[ContainerManager Debug] Creating tunnel for {service_name} -> {target}") # 注释掉
-                tunnel_info = self.tunnel_manager.create_tunnel(
-                    target=target,
-                    service_name=service_name,
-                    remark=remark
-                )
-
-                if tunnel_info and tunnel_info.get("port") is not None:
-                    created_tunnels[service_name] = tunnel_info
-                    ports_info[f"{service_name}_port"] = tunnel_info["port"]
-                    # print(f"[ContainerManager Debug] Tunnel for {service_name} re-created: Port {tunnel_info['port']}") # 注释掉
-                else: # Handle failure WITHIN the loop
-                    # 保留: 隧道创建失败错误
-                    print(f"[ContainerManager] Error: 为已启动的容器 '{name}' 重新创建服务 '{service_name}' 的隧道失败。")
-                    tunnel_creation_failed = True
-                    failed_services.append(service_name)
-                    if service_name == 'ssh': # Break loop on critical failure
-                        break
+            created_tunnels, ports_info, failed_services = self._create_container_tunnels(name, container_ip, services_to_tunnel)
+            for service_name in failed_services:
+                # 保留: 隧道创建失败错误
+                logger.error("为已启动的容器 '%s' 重新创建服务 '%s' 的隧道失败。", name, service_name)
+            tunnel_creation_failed = bool(failed_services)
 
             if tunnel_creation_failed:
                 # 保留: 回滚信息
-                print(f"[ContainerManager] Error: 由于服务 {failed_services} 的隧道重建失败，正在停止容器 '{name}' 并回滚...")
+                logger.error("由于服务 %s 的隧道重建失败，正在停止容器 '%s' 并回滚...", failed_services, name)
                 for created_service, info in created_tunnels.items():
-                     if info.get("tunnel_id") is not None:
-                         self.tunnel_manager.delete_tunnel(info["tunnel_id"])
+                     if info.tunnel_id is not None:
+                         self.tunnel_manager.delete_tunnel(info.tunnel_id)
                 try: container.stop(timeout=5) 
                 except: pass
+                self._forget_container(name)
                 return None
 
             # 更新并保存状态
             self.container_tunnels[name] = created_tunnels
-            self._save_container_states()
+            self._tunnels_changed(name)
             
             # 保留: 启动和隧道重建成功
-            print(f"[ContainerManager] 容器 '{name}' 启动成功，并已重新创建关联隧道。") 
+            logger.info("容器 '%s' 启动成功，并已重新创建关联隧道。", name) 
             return ports_info
 
         except docker.errors.NotFound:
             # 保留: 容器不存在错误
-            print(f"[ContainerManager] Error: 尝试启动时，容器 '{name}' 未找到。") 
+            logger.error("尝试启动时，容器 '%s' 未找到。", name) 
             return None
         except docker.errors.APIError as e:
             # 保留: 启动 API 错误
-            print(f"[ContainerManager] Error: 启动容器 '{name}' 时出错 (API Error): {e}") 
+            logger.error("启动容器 '%s' 时出错 (API Error): %s", name, e) 
             return None
         except Exception as e:
             # 保留: 启动未知错误
-            print(f"[ContainerManager] Error: 启动容器 '{name}' 时发生意外错误: {e}") 
+            logger.error("启动容器 '%s' 时发生意外错误: %s", name, e) 
             return None
 
-    def remove_container(self, name: str, remove_snapshots: bool = False) -> bool:
-        """完全删除容器，关联的隧道和可选的快照镜像"""
+    def _remove_snapshot_image(self, image_tag: str) -> str:
+        """删除一个快照镜像，返回 'removed' / 'missing' / 'failed'"""
+        try:
+            self.client.api.remove_image(image_tag, force=True)
+            # print(f"[ContainerManager Debug] Removed snapshot image: {image_tag}") # 注释掉
+            return 'removed'
+        except docker.errors.ImageNotFound:
+            # print(f"[ContainerManager Debug] Snapshot image {image_tag} not found, skipping.") # 注释掉
+            return 'missing'
+        except docker.errors.APIError as e:
+            # 保留: 快照删除 API 错误
+            logger.warning("删除快照镜像失败 %s (API Error): %s", image_tag, e) 
+            return 'failed'
+        except Exception as e:
+             # 保留: 快照删除未知错误
+             logger.warning("删除快照镜像时发生未知错误 %s: %s", image_tag, e)
+             return 'failed'
+
+    @_flush_state_on_exit
+    def remove_container(self, name: str, remove_snapshots: bool = False, container=None) -> bool:
+        """完全删除容器，关联的隧道和可选的快照镜像（调用方已持有容器对象时可直接传入，省去一次查询）"""
         container_exists = True
-        container = None
         try:
-            container = self.client.containers.get(name)
+            if container is None:
+                container = self._get_container(name)
             if container.status == 'running':
                 # print(f"[ContainerManager Debug] Container {name} is running. Stopping it first...") # 注释掉
                 # stop_container 会处理隧道删除和状态更新，并打印日志
-                if not self.stop_container(name): 
-                     print(f"[ContainerManager] Warning: 停止运行中的容器 '{name}' 失败，但仍将尝试移除。")
+                if not self.stop_container(name, container): 
+                     logger.warning("停止运行中的容器 '%s' 失败，但仍将尝试移除。", name)
         except docker.errors.NotFound:
             container_exists = False
             # print(f"[ContainerManager Debug] Container {name} not found. Checking for residual tunnel state...") # 注释掉
@@ -608,26 +1078,28 @@ tail -f /dev/null
             if name in self.container_tunnels:
                 # print(f"[ContainerManager Debug] Deleting residual tunnels for non-existent container {name}...") # 注释掉
                 tunnels_to_delete = self.container_tunnels.pop(name)
-                self._save_container_states()
+                self._tunnels_changed(name)
                 deleted_count = 0
                 for service, tunnel_info in tunnels_to_delete.items():
-                    if tunnel_info and tunnel_info.get("tunnel_id") is not None:
-                        if self.tunnel_manager.delete_tunnel(tunnel_info["tunnel_id"]):
+                    if tunnel_info.tunnel_id is not None:
+                        if self.tunnel_manager.delete_tunnel(tunnel_info.tunnel_id):
                              deleted_count += 1
                 if deleted_count > 0:
                      # 保留: 清理残留隧道信息
-                     print(f"[ContainerManager] Info: 清理了 {deleted_count} 个与不存在容器 '{name}' 关联的残留隧道。") 
+                     logger.info("清理了 %s 个与不存在容器 '%s' 关联的残留隧道。", deleted_count, name) 
         except Exception as e:
             # 保留: 检查容器错误
-            print(f"[ContainerManager] Error: 移除前检查容器 '{name}' 时出错: {e}. 将继续尝试移除...") 
+            logger.error("移除前检查容器 '%s' 时出错: %s. 将继续尝试移除...", name, e) 
             
         remove_success = False
         try:
             if container_exists and container: # 确保 container 对象有效
                  # print(f"[ContainerManager Debug] Removing container {name}...") # 注释掉
-                 container.remove(force=True) # 强制移除
+                 # 直接调用底层 API 强制移除，不经过模型层
+                 self.client.api.remove_container(container.id, force=True, v=False)
+                 self._mark_container_removed(name)
                  # 保留: 容器移除成功
-                 print(f"[ContainerManager] 容器 '{name}' 已移除。") 
+                 logger.info("容器 '%s' 已移除。", name) 
                  remove_success = True
             elif not container_exists:
                  # print(f"[ContainerManager Debug] Container {name} was already removed or never existed.") # 注释掉
@@ -637,71 +1109,54 @@ tail -f /dev/null
              remove_success = True # 不存在也算成功
         except docker.errors.APIError as e:
             # 保留: 移除 API 错误
-            print(f"[ContainerManager] Error: 移除容器 '{name}' 时出错 (API Error): {e}") 
+            logger.error("移除容器 '%s' 时出错 (API Error): %s", name, e) 
         except Exception as e:
              # 保留: 移除未知错误
-             print(f"[ContainerManager] Error: 移除容器 '{name}' 时发生意外错误: {e}") 
+             logger.error("移除容器 '%s' 时发生意外错误: %s", name, e) 
 
         # 清理镜像映射 (无论容器移除是否成功，都清理记录)
         image_record_cleaned = False
         if name in self.container_images:
             del self.container_images[name]
-            self._save_container_images()
+            self._images_changed(name)
             image_record_cleaned = True
         
-        # 清理快照
-        snapshot_cleaned = False
-        if remove_snapshots:
-            if name in self.image_history:
-                # print(f"[ContainerManager Debug] Removing snapshots for {name}...") # 注释掉
-                images_to_remove = self.image_history.pop(name) # 使用 pop 获取并删除
-                self._save_container_images()
-                removed_count = 0
-                failed_count = 0
-                for image_tag in images_to_remove:
-                    try:
-                        self.client.images.remove(image_tag, force=True)
-                        # print(f"[ContainerManager Debug] Removed snapshot image: {image_tag}") # 注释掉
-                        removed_count += 1
-                    except docker.errors.ImageNotFound:
-                        # print(f"[ContainerManager Debug] Snapshot image {image_tag} not found, skipping.") # 注释掉
-                        pass
-                    except docker.errors.APIError as e:
-                        # 保留: 快照删除 API 错误
-                        print(f"[ContainerManager] Warning: 删除快照镜像失败 {image_tag} (API Error): {e}") 
-                        failed_count += 1
-                    except Exception as e:
-                         # 保留: 快照删除未知错误
-                         print(f"[ContainerManager] Warning: 删除快照镜像时发生未知错误 {image_tag}: {e}")
-                         failed_count += 1
-                if removed_count > 0 or failed_count > 0:
-                     # 保留: 快照清理结果
-                     print(f"[ContainerManager] 快照清理完成 ({name}): 成功移除 {removed_count} 个, 失败 {failed_count} 个。") 
-                snapshot_cleaned = (failed_count == 0) # 只有全部成功才算清理成功
-            else:
-                snapshot_cleaned = True # 没有历史记录也算清理成功
-        else:
-             snapshot_cleaned = True # 不要求删除快照则认为成功
+        # 清理快照：不要求删除快照或没有历史记录都算清理成功，只有一次字典查找
+        snapshot_cleaned = True
+        images_to_remove = self.image_history.pop(name, None) if remove_snapshots else None
+        if images_to_remove is not None:
+            self._images_changed(name)
+        if images_to_remove:
+            # print(f"[ContainerManager Debug] Removing snapshots for {name}...") # 注释掉
+            # Docker 每个请求只能删除一个镜像，并行发出请求以节省往返时间
+            with ThreadPoolExecutor(max_workers=min(_IMAGE_REMOVE_WORKERS, len(images_to_remove))) as executor:
+                results = list(executor.map(self._remove_snapshot_image, images_to_remove))
+            removed_count = results.count('removed')
+            failed_count = results.count('failed')
+            if removed_count > 0 or failed_count > 0:
+                 # 保留: 快照清理结果
+                 logger.info("快照清理完成 (%s): 成功移除 %s 个, 失败 %s 个。", name, removed_count, failed_count) 
+            snapshot_cleaned = (failed_count == 0) # 只有全部成功才算清理成功
 
         # 确保隧道状态最终被清理
         tunnel_record_cleaned = False
         if name in self.container_tunnels:
             del self.container_tunnels[name]
-            self._save_container_states()
+            self._tunnels_changed(name)
         tunnel_record_cleaned = (name not in self.container_tunnels)
             
         # 最终成功状态取决于：容器移除成功 + (如果需要)快照清理成功 + 状态记录清理成功
         final_success = remove_success and snapshot_cleaned and image_record_cleaned and tunnel_record_cleaned
         if final_success:
-             print(f"[ContainerManager] 容器 '{name}' 及相关记录和快照（如果请求）已成功移除。")
+             logger.info("容器 '%s' 及相关记录和快照（如果请求）已成功移除。", name)
         else:
-             print(f"[ContainerManager] Warning: 容器 '{name}' 移除过程中可能存在问题，请检查日志。")
+             logger.warning("容器 '%s' 移除过程中可能存在问题，请检查日志。", name)
         return final_success
 
     def container_status(self, name: str) -> Optional[Dict[str, Any]]:
         """检查容器详细状态，包括公网端口"""
         try:
-            container = self.client.containers.get(name)
+            container = self._get_container(name)
             inspect = container.attrs
             status_info = inspect.get('State', {})
             
@@ -714,168 +1169,242 @@ tail -f /dev/null
                 "error": status_info.get('Error'),
                 "created": inspect.get('Created'),
                 "image": inspect.get('Config', {}).get('Image'),
-                "ip_address": self._get_container_ip(name),
+                "ip_address": self._get_container_ip(container),
                 "public_ports": self.get_container_ports(name)
             }
             return result
 
         except docker.errors.NotFound:
             # print(f"[ContainerManager Debug] Container {name} not found for status check.") # 注释掉
-            # 检查是否有残留隧道信息
-            ports = self.get_container_ports(name)
-            if ports:
-                 # 保留: 容器不存在但有残留端口警告
-                 print(f"[ContainerManager] Warning: 容器 '{name}' 未找到，但存在残留的隧道端口记录: {ports}") 
-                 return {
-                     "name": name,
-                     "status": "not found (with tunnels)",
-                     "running": False,
-                     "public_ports": ports
-                 }
-            return {
-                 "name": name,
-                 "status": "not found",
-                 "running": False,
-                 "public_ports": None
-             }
+            return self._missing_container_status(name)
         except Exception as e:
             # 保留: 获取状态错误
-            print(f"[ContainerManager] Error: 获取容器 '{name}' 状态时出错: {e}") 
+            logger.error("获取容器 '%s' 状态时出错: %s", name, e) 
             return None
 
+    def _missing_container_status(self, name: str) -> Dict[str, Any]:
+        """构造 Docker 中不存在的容器的状态（只读本地记录，不访问 Docker）"""
+        # 检查是否有残留隧道信息
+        ports = self.get_container_ports(name)
+        if ports:
+             # 保留: 容器不存在但有残留端口警告
+             logger.warning("容器 '%s' 未找到，但存在残留的隧道端口记录: %s", name, ports) 
+             return {
+                 "name": name,
+                 "status": "not found (with tunnels)",
+                 "running": False,
+                 "public_ports": ports
+             }
+        return {
+             "name": name,
+             "status": "not found",
+             "running": False,
+             "public_ports": None
+         }
+
+    def _status_from_summary(self, name: str, attrs: Dict[str, Any]) -> Dict[str, Any]:
+        """根据 /containers/json 的摘要信息构造与 container_status 相同结构的状态"""
+        state = attrs.get('State', 'unknown')
+        # 摘要中没有 ExitCode，从 "Exited (137) 5 minutes ago" 形式的 Status 中解析
+        exit_match = _EXIT_CODE_RE.search(attrs.get('Status', ''))
+        networks = (attrs.get('NetworkSettings') or {}).get('Networks') or {}
+        ip_address = next((net.get('IPAddress') for net in networks.values()), None) or None
+        created = attrs.get('Created')
+        if isinstance(created, (int, float)):
+            created = datetime.fromtimestamp(created, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        return {
+            "name": name,
+            "id": attrs.get('Id', '')[:12],
+            "status": state,
+            "running": state in ('running', 'paused', 'restarting'),
+            "exit_code": int(exit_match.group(1)) if exit_match else 0,
+            "error": None,
+            "created": created,
+            "image": attrs.get('Image'),
+            "ip_address": ip_address,
+            "public_ports": self.get_container_ports(name)
+        }
+
     def list_containers(self, all_containers=True) -> List[Dict[str, Any]]:
         """列出容器及其状态和公网端口"""
         containers_list = []
         try:
-            docker_containers = self.client.containers.list(all=all_containers)
-            managed_containers = set(self.container_tunnels.keys()) | set(self.container_images.keys())
+            # sparse=True 只发起一次 /containers/json 请求，直接使用列表摘要信息，
+            # 不再对每个容器单独 inspect
+            docker_containers = self.client.containers.list(all=all_containers, sparse=True)
             processed_names = set()
+            to_inspect = [] # 需要单独查询状态的容器: (name, 列表中的容器对象或 None)
 
             for container in docker_containers:
-                name = container.name
+                name = container.attrs['Names'][0].lstrip('/')
                 processed_names.add(name)
-                status_info = self.container_status(name)
-                if status_info:
-                     containers_list.append(status_info)
-                else: 
-                     # 获取状态失败，提供基本信息
-                     # 保留: 状态获取失败警告
-                     print(f"[ContainerManager] Warning: 获取容器 '{name}' 的详细状态失败，仅列出基本信息。") 
-                     containers_list.append({
-                         "name": name,
-                         "id": container.short_id,
-                         "status": container.status,
-                         "running": container.status == 'running',
-                         "image": container.image.tags[0] if container.image.tags else 'unknown',
-                         "public_ports": self.get_container_ports(name)
-                     })
+                if 'State' in container.attrs:
+                    containers_list.append(self._status_from_summary(name, container.attrs))
+                else:
+                    # 旧版 Docker API 的列表摘要不含 State，退回逐个查询
+                    to_inspect.append((name, container))
 
             # 添加状态记录中存在但 Docker 中没有的容器
-            for name in managed_containers:
-                 if name not in processed_names:
-                     status_info = self.container_status(name) # 会返回 not found 状态
-                     if status_info:
-                          containers_list.append(status_info)
+            # 依次遍历两个字典的键，复用 processed_names 去重，不再构造并集/差集；
+            # 先用 tuple 取键快照，避免其他线程同时修改字典时迭代出错
+            for name in itertools.chain(tuple(self.container_tunnels), tuple(self.container_images)):
+                if name in processed_names:
+                    continue
+                processed_names.add(name)
+                if all_containers:
+                    # 列表已包含全部容器，未出现的一定不存在，无需再向 Docker 查询
+                    containers_list.append(self._missing_container_status(name))
+                else:
+                    # 只列出了运行中的容器，已停止的容器仍需单独查询
+                    to_inspect.append((name, None))
+
+            if to_inspect:
+                # 逐个 inspect 互不依赖，限制并发数并行查询，避免压垮 Docker Daemon
+                with ThreadPoolExecutor(max_workers=min(_STATUS_QUERY_WORKERS, len(to_inspect))) as executor:
+                    statuses = list(executor.map(self.container_status, [name for name, _ in to_inspect]))
+                for (name, container), status_info in zip(to_inspect, statuses):
+                    if status_info:
+                         containers_list.append(status_info)
+                    elif container is not None:
+                         # 获取状态失败，提供基本信息
+                         # 保留: 状态获取失败警告
+                         logger.warning("获取容器 '%s' 的详细状态失败，仅列出基本信息。", name) 
+                         containers_list.append({
+                             "name": name,
+                             "id": container.short_id,
+                             "status": container.attrs.get('State', 'unknown'),
+                             "running": container.attrs.get('State') == 'running',
+                             "image": container.attrs.get('Image', 'unknown'),
+                             "public_ports": self.get_container_ports(name)
+                         })
             
             return containers_list
         except Exception as e:
             # 保留: 列出容器错误
-            print(f"[ContainerManager] Error: 列出容器时出错: {e}") 
+            logger.error("列出容器时出错: %s", e) 
             return []
 
+    def _next_snapshot_version(self, name: str) -> int:
+        """分配下一个快照版本号（计数器单独持久化，O(1) 且不受历史记录裁剪的影响）"""
+        version = self.snapshot_versions.get(name)
+        if version is None:
+            # 旧状态文件中没有计数器：从现有快照标签推算
+            history = self.image_history.get(name, [])
+            tag_versions = [int(m.group(1)) for m in map(_SNAPSHOT_VERSION_RE.search, history) if m]
+            version = max(tag_versions, default=len(history))
+        self.snapshot_versions[name] = version + 1
+        return version + 1
+
+    @_flush_state_on_exit
     def stop_and_commit(self, name: str, commit_message: str = None) -> Optional[str]:
         """停止容器，删除隧道，并将其提交为新快照镜像"""
         container = None
         try:
-            container = self.client.containers.get(name)
+            container = self._get_container(name)
         except docker.errors.NotFound:
             # 保留: 容器不存在错误
-            print(f"[ContainerManager] Error: 无法提交快照，容器 '{name}' 未找到。") 
+            logger.error("无法提交快照，容器 '%s' 未找到。", name) 
             return None
         except Exception as e:
-            print(f"[ContainerManager] Error: 检查容器 '{name}' 时出错: {e}")
+            logger.error("检查容器 '%s' 时出错: %s", name, e)
             return None
             
+        # 提交所需的配置在停止前从已获取的 inspect 结果中读取一次，后续不再查询
+        config = container.attrs['Config']
+
         # 1. 停止容器并删除隧道
         # stop_container 会打印相关日志
-        if not self.stop_container(name):
+        if not self.stop_container(name, container):
             # 保留: 停止失败错误
-            print(f"[ContainerManager] Error: 停止容器 '{name}' 或删除隧道失败。中止快照提交。") 
+            logger.error("停止容器 '%s' 或删除隧道失败。中止快照提交。", name) 
             return None
 
         # 2. 生成新标签
-            timestamp = time.strftime("%Y%m%d_%H%M%S")
+        timestamp = _snapshot_timestamp()
         self._load_container_images() # 确保历史最新
-        version = len(self.image_history.get(name, [])) + 1
+        version = self._next_snapshot_version(name)
         new_image_tag_base = f"{name}" # Repository name
         new_image_tag_version = f"v{version}_{timestamp}" # Tag part
         
         # 3. 准备 commit changes
-        config = container.attrs['Config']
         changes = []
         if config.get('Entrypoint'): changes.append(f"ENTRYPOINT {json.dumps(config['Entrypoint'])}")
         if config.get('Cmd'): changes.append(f"CMD {json.dumps(config['Cmd'])}")
         if config.get('WorkingDir'): changes.append(f"WORKDIR {config['WorkingDir']}")
-        if config.get('Env'):
-            for env_str in config['Env']:
-                if not env_str.startswith("JUPYTER_PORT=") and not env_str.startswith("APP_PORT="):
-                    changes.append(f"ENV {env_str}")
-        if config.get('ExposedPorts'):
-            for port_proto in config['ExposedPorts']:
-                changes.append(f"EXPOSE {port_proto}")
+        changes.extend(f"ENV {env_str}" for env_str in config.get('Env') or () if not env_str.startswith(_COMMIT_SKIP_ENV_PREFIXES))
+        changes.extend(f"EXPOSE {port_proto}" for port_proto in config.get('ExposedPorts') or ())
 
         # 4. 提交镜像
         final_image_tag = None
         try:
             # print(f"[ContainerManager Debug] Committing container {name} to image {new_image_tag_base}:{new_image_tag_version}...") # 注释掉
-            new_image = container.commit(
+            # 直接调用底层 API：container.commit 会额外 inspect 一次新镜像，而标签本就已知
+            self.client.api.commit(
+                container.id,
                 repository=new_image_tag_base,
                 tag=new_image_tag_version,
                 message=commit_message or f"Snapshot v{version} for {name} at {timestamp}",
                 changes=changes
             )
-            final_image_tag = new_image.tags[0] if new_image.tags else f"{new_image_tag_base}:{new_image_tag_version}" # 获取最终标签
+            final_image_tag = f"{new_image_tag_base}:{new_image_tag_version}"
             # 保留: 提交成功信息
-            print(f"[ContainerManager] 镜像 '{final_image_tag}' 创建成功。") 
+            logger.info("镜像 '%s' 创建成功。", final_image_tag) 
         except docker.errors.APIError as e:
             # 保留: 提交 API 错误
-            print(f"[ContainerManager] Error: 提交容器 '{name}' 为镜像时出错 (API Error): {e}") 
+            logger.error("提交容器 '%s' 为镜像时出错 (API Error): %s", name, e) 
             return None
         except Exception as e:
              # 保留: 提交未知错误
-             print(f"[ContainerManager] Error: 提交容器 '{name}' 为镜像时发生意外错误: {e}") 
+             logger.error("提交容器 '%s' 为镜像时发生意外错误: %s", name, e) 
              return None
         
         # 5. 更新状态并保存
         self.container_images[name] = final_image_tag
         if name not in self.image_history: self.image_history[name] = []
         self.image_history[name].append(final_image_tag)
-        self._save_container_images()
+        self._images_changed(name)
             
         # 6. 删除旧容器 (此时容器已停止)
         try:
             container.remove()
+            self._mark_container_removed(name)
             # print(f"[ContainerManager Debug] Original container {name} removed after commit.") # 注释掉
         except docker.errors.APIError as e:
              # 保留: 删除旧容器警告
-             print(f"[ContainerManager] Warning: 提交快照后未能移除原始容器 '{name}': {e}") 
+             logger.warning("提交快照后未能移除原始容器 '%s': %s", name, e) 
         except Exception as e:
-             print(f"[ContainerManager] Warning: 移除原始容器 '{name}' 时发生意外错误: {e}")
+             logger.warning("移除原始容器 '%s' 时发生意外错误: %s", name, e)
         
         # 7. 清理旧镜像
         self._cleanup_old_images(name) # 会打印清理日志
         
         # 保留: 快照流程完成
-        print(f"[ContainerManager] 容器 '{name}' 的快照 '{final_image_tag}' 创建完成。") 
+        logger.info("容器 '%s' 的快照 '%s' 创建完成。", name, final_image_tag) 
         return final_image_tag
 
+    def _snapshot_image_exists(self, image_tag: str) -> bool:
+        """确认快照镜像在本地存在"""
+        try:
+            # print(f"[ContainerManager Debug] Checking if snapshot image {image_tag} exists locally...") # 注释掉
+            self.client.api.inspect_image(image_tag)
+            return True
+        except docker.errors.ImageNotFound:
+            # 保留: 快照镜像不存在错误
+            logger.error("快照镜像 '%s' 在本地未找到。", image_tag) 
+            return False
+        except Exception as e:
+             # 保留: 检查镜像错误
+             logger.error("检查快照镜像 '%s' 时出错: %s", image_tag, e) 
+             return False
+
+    @_flush_state_on_exit
     def start_from_snapshot(self, name: str, version_tag: str = None) -> Optional[Dict[str, int]]:
         """从快照镜像启动一个新容器，并创建隧道"""
         self._load_container_images()
         available_versions = self.image_history.get(name, [])
         if not available_versions:
             # 保留: 无快照错误
-            print(f"[ContainerManager] Error: 未找到容器 '{name}' 的任何快照。") 
+            logger.error("未找到容器 '%s' 的任何快照。", name) 
             return None
 
         image_tag_to_use = None
@@ -883,42 +1412,35 @@ tail -f /dev/null
             image_tag_to_use = available_versions[-1]
             # print(f"[ContainerManager Debug] Starting from latest snapshot for {name}: {image_tag_to_use}") # 注释掉
         else:
-            found = False
-            for tag in reversed(available_versions):
-                if version_tag == tag or version_tag in tag.split(':')[-1]:
-                    image_tag_to_use = tag
-                    found = True
-                    # print(f"[ContainerManager Debug] Found snapshot matching '{version_tag}': {image_tag_to_use}") # 注释掉
-                    break
-            if not found:
+            # 完整标签、标签部分 (v3_20240101_120000) 或版本号 (v3) 直接查索引
+            image_tag_to_use = self._snapshot_index(name).get(version_tag)
+            if image_tag_to_use is None:
+                # 其他写法（如时间戳片段）保持原有的子串匹配，取最新的匹配项
+                for tag in reversed(available_versions):
+                    if version_tag in tag.rpartition(':')[2]:
+                        image_tag_to_use = tag
+                        # print(f"[ContainerManager Debug] Found snapshot matching '{version_tag}': {image_tag_to_use}") # 注释掉
+                        break
+            if image_tag_to_use is None:
                 # 保留: 未找到指定版本快照错误
-                print(f"[ContainerManager] Error: 未找到与 '{version_tag}' 匹配的快照版本 (容器: {name})。") 
+                logger.error("未找到与 '%s' 匹配的快照版本 (容器: %s)。", version_tag, name) 
                 # print("Available snapshots:")
                 # for v in available_versions: print(f"  - {v}") # 调试时可取消注释
                 return None
 
         # print(f"[ContainerManager Debug] Attempting to start from snapshot: {image_tag_to_use}") # 注释掉
-        try:
-            # print(f"[ContainerManager Debug] Checking if snapshot image {image_tag_to_use} exists locally...") # 注释掉
-            image = self.client.images.get(image_tag_to_use)
-            # print(f"[ContainerManager Debug] Snapshot image found.") # 注释掉
-        except docker.errors.ImageNotFound:
-            # 保留: 快照镜像不存在错误
-            print(f"[ContainerManager] Error: 快照镜像 '{image_tag_to_use}' 在本地未找到。") 
-            return None
-        except Exception as e:
-             # 保留: 检查镜像错误
-             print(f"[ContainerManager] Error: 检查快照镜像 '{image_tag_to_use}' 时出错: {e}") 
-             return None
-            
         # 检查并移除同名容器
         try:
-            existing_container = self.client.containers.get(name)
+            existing_container = self._get_container(name)
+            # 快照标签来自我们自己的历史记录，通常存在；只有在即将移除现有容器时才确认一次，
+            # 避免镜像丢失时白白删掉容器。没有同名容器时直接由 create_container 报错
+            if not self._snapshot_image_exists(image_tag_to_use):
+                return None
             # 保留: 移除现有容器信息
-            print(f"[ContainerManager] Info: 容器 '{name}' 已存在，将在从快照启动前移除它...") 
-            if not self.remove_container(name, remove_snapshots=False):
+            logger.info("容器 '%s' 已存在，将在从快照启动前移除它...", name) 
+            if not self.remove_container(name, remove_snapshots=False, container=existing_container):
                  # 保留: 移除失败错误
-                 print(f"[ContainerManager] Error: 移除现有容器 '{name}' 失败。无法从快照启动。") 
+                 logger.error("移除现有容器 '%s' 失败。无法从快照启动。", name) 
                  return None
             # print(f"[ContainerManager Debug] Existing container {name} removed.") # 注释掉
         except docker.errors.NotFound:
@@ -927,20 +1449,32 @@ tail -f /dev/null
             if name in self.container_tunnels:
                 # print(f"[ContainerManager Debug] Cleaning up residual tunnel state for {name}...") # 注释掉
                 tunnels_to_delete = self.container_tunnels.pop(name)
-                self._save_container_states()
+                self._tunnels_changed(name)
                 for service, tunnel_info in tunnels_to_delete.items():
-                    if tunnel_info and tunnel_info.get("tunnel_id") is not None:
-                         self.tunnel_manager.delete_tunnel(tunnel_info["tunnel_id"])
+                    if tunnel_info.tunnel_id is not None:
+                         self.tunnel_manager.delete_tunnel(tunnel_info.tunnel_id)
         except Exception as e:
              # 保留: 检查/移除现有容器错误
-             print(f"[ContainerManager] Error: 检查或移除现有容器 '{name}' 时出错: {e}. 谨慎继续...") 
+             logger.error("检查或移除现有容器 '%s' 时出错: %s. 谨慎继续...", name, e) 
 
         # 使用 create_container 逻辑启动
         # 保留: 从快照启动信息
-        print(f"[ContainerManager] 正在从快照 '{image_tag_to_use}' 启动容器 '{name}'...") 
+        logger.info("正在从快照 '%s' 启动容器 '%s'...", image_tag_to_use, name) 
         # create_container 会打印后续日志
         return self.create_container(image=image_tag_to_use, name=name, container_config=None)
 
+    def _image_comment(self, image_id: str) -> str:
+        """镜像的提交信息（镜像内容不可变，按 ID 缓存，每个镜像只 inspect 一次）"""
+        comment = self._image_comments.get(image_id)
+        if comment is None:
+            try:
+                comment = self.client.api.inspect_image(image_id).get('Comment') or ''
+            except Exception as e:
+                logger.warning("获取镜像 %s 的提交信息失败: %s", image_id, e)
+                return ''
+            self._image_comments[image_id] = comment
+        return comment
+
     def list_snapshots(self, name: str = None) -> List[Dict[str, Any]]:
         """列出容器的快照历史 (返回结构化数据)"""
         snapshot_list = []
@@ -954,35 +1488,40 @@ tail -f /dev/null
         else:
             history_to_show = self.image_history
 
+        # 一次 /images/json 请求取得全部镜像摘要，按标签索引，不再逐个 images.get
+        listing_error = None
+        images_by_tag = {}
+        try:
+            for summary in self.client.api.images():
+                for tag in summary.get('RepoTags') or []:
+                    images_by_tag[tag] = summary
+        except Exception as e:
+            listing_error = e
+        # 摘要中没有提交信息，按镜像 ID 缓存，只清理已不存在的镜像
+        live_ids = {summary['Id'] for summary in images_by_tag.values()}
+        for image_id in self._image_comments.keys() - live_ids:
+            self._image_comments.pop(image_id, None)
+
         for container_name, versions in history_to_show.items():
             container_snapshots = {"container_name": container_name, "versions": []}
             for i, version_tag in enumerate(reversed(versions), 1):
-                snapshot_info = {"tag": version_tag, "index": len(versions) - i + 1}
-                try:
-                    image = self.client.images.get(version_tag)
-                    created_str = image.attrs.get('Created', 'N/A')
-                    # Attempt to parse the date string, fall back to raw string on error
-                    try:
-                        if isinstance(created_str, str) and 'T' in created_str:
-                             time_part = created_str.split('.')[0] # Remove fractional seconds
-                             created_dt = datetime.fromisoformat(time_part)
-                             snapshot_info["created"] = created_dt.strftime('%Y-%m-%d %H:%M:%S')
-                        else:
-                             snapshot_info["created"] = created_str # Use raw string if not matching format
-                    except (ValueError, TypeError) as date_parse_err: # Catch potential parsing errors
-                         print(f"[ContainerManager] Warning: Could not parse date format '{created_str}' for snapshot '{version_tag}'. Using raw value. Error: {date_parse_err}")
-                         snapshot_info["created"] = created_str # Fallback to raw string on error
-
-                    snapshot_info["size_mb"] = round(image.attrs.get('Size', 0) / (1024*1024), 1)
-                    snapshot_info["message"] = image.attrs.get('Comment', '')
-                    snapshot_info["id"] = image.short_id
-                    snapshot_info["found"] = True
-                except docker.errors.ImageNotFound:
-                    snapshot_info["found"] = False
+                # 预先填充全部字段，使接口直接序列化时结构与 SnapshotInfo 一致
+                snapshot_info = {
+                    "tag": version_tag, "index": len(versions) - i + 1,
+                    "created": None, "size_mb": None, "message": None, "id": None, "found": False
+                }
+                image = images_by_tag.get(version_tag)
+                if listing_error is not None:
+                     snapshot_info["message"] = f"(获取信息时出错: {listing_error})"
+                elif image is None:
                     snapshot_info["message"] = "(镜像在本地未找到)"
-                except Exception as e:
-                     snapshot_info["found"] = False
-                     snapshot_info["message"] = f"(获取信息时出错: {e})"
+                else:
+                    created = image.get('Created')
+                    snapshot_info["created"] = _format_image_created(created) if isinstance(created, int) else created
+                    snapshot_info["size_mb"] = round(image.get('Size', 0) / (1024*1024), 1)
+                    snapshot_info["message"] = self._image_comment(image['Id'])
+                    snapshot_info["id"] = _short_image_id(image['Id'])
+                    snapshot_info["found"] = True
                 
                 container_snapshots["versions"].append(snapshot_info)
             snapshot_list.append(container_snapshots)
@@ -1052,4 +1591,5 @@ def main():
         print(f"[Main Error] 容器 '{container_name}' 和快照清理失败。")
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(name)s] %(levelname)s: %(message)s")
     main()
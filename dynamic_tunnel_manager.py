@@ -9,14 +9,82 @@ Dynamic Tunnel Manager - 动态隧道管理工具
 4. 持久化隧道配置
 """
 
+import logging
 import os
-import json
+import orjson
+import random
+import threading
 import time
-from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
 
 # 导入相关模块
 from nps_manager import NPSManager
 from port_manager import PortManager
+from state_io import atomic_write
+
+logger = logging.getLogger(__name__)
+
+# 创建隧道后查询隧道 ID 的重试次数与退避参数（秒）：指数退避 + 随机抖动，
+# 避免并行创建时多个线程同时轮询 NPS
+_TUNNEL_ID_FETCH_ATTEMPTS = 6
+_TUNNEL_ID_BACKOFF_BASE = 0.05
+_TUNNEL_ID_BACKOFF_CAP = 1.0
+
+# NPS 隧道列表缓存的有效期（秒），合并并发创建时的突发查询
+_LIST_CACHE_TTL = 0.5
+
+# 本地隧道映射缓存文件在此时间（秒）内视为新鲜：启动时直接加载，再在后台与 NPS 同步
+_MAPPINGS_CACHE_MAX_AGE = 300
+
+# NPS 确认不存在的隧道ID在此时间（秒）内不再重复查询，最多记录的条目数
+_MISSING_TUNNEL_TTL = 5.0
+_MISSING_TUNNEL_MAX = 128
+
+# 批量创建/删除服务隧道时的最大并发数（每个隧道的耗时主要是 NPS 网络往返）
+_SERVICE_TUNNEL_WORKERS = 8
+
+# 根据隧道备注和目标地址推断服务名称的规则，按顺序匹配：(服务名, 备注关键字, 目标端口片段)
+_SERVICE_RULES = (
+    ("ssh", ("ssh",), (":22",)),
+    ("http", ("http",), (":80", ":8080")),
+    ("jupyter", ("jupyter",), (":8888",)),
+    ("web", ("web",), ()), # 更通用的web服务
+)
+
+def _classify_service(remark: str, target: str) -> str:
+    """根据隧道备注和目标地址推断服务名称，无法识别时返回 unknown"""
+    remark_lower = remark.lower()
+    for service, keywords, port_parts in _SERVICE_RULES:
+        if any(k in remark_lower for k in keywords) or any(p in target for p in port_parts):
+            return service
+    return "unknown"
+
+@dataclass
+class TunnelRecord:
+    """隧道映射中的一条记录（使用 __slots__，比嵌套字典更省内存，属性访问也更快）"""
+    __slots__ = ('port', 'service', 'client_id', 'target', 'remark')
+    port: int
+    service: str
+    client_id: Optional[int]
+    target: str
+    remark: str
+
+    def to_dict(self, tunnel_id: int) -> Dict:
+        """对外返回的隧道信息字典（带 tunnel_id）"""
+        return {
+            "port": self.port,
+            "service": self.service,
+            "client_id": self.client_id,
+            "target": self.target,
+            "remark": self.remark,
+            "tunnel_id": tunnel_id
+        }
+
+def _index_tunnels_by_port(rows: List[Dict]) -> Dict[int, int]:
+    """将 NPS 隧道列表按端口建立索引 {port: tunnel_id}"""
+    return {row.get('Port'): row.get('Id') for row in rows}
 
 class DynamicTunnelManager:
     def __init__(self, nps_config=None, port_config=None):
@@ -30,48 +98,117 @@ class DynamicTunnelManager:
         # 初始化NPS和端口管理器
         self.nps = NPSManager(config_file=nps_config)
         self.port_manager = PortManager(config_file=port_config)
+        # 默认客户端 ID 在配置加载后即确定，启动时解析一次
+        self._default_client_id = self.nps.config.get("clients", {}).get("default_client_id", 2)
         
         # 初始化隧道映射关系
-        self.tunnel_mappings = {}  # {tunnel_id: {"port": port, "service": "ssh", "client_id": 1, ...}}
+        self.tunnel_mappings: Dict[int, TunnelRecord] = {}
+        # 隧道可能被多个线程并发创建/删除，修改映射时持有此锁（网络请求在锁外进行）
+        self._mappings_lock = threading.Lock()
+        # 按服务名/客户端ID索引的隧道ID {service: {tunnel_id, ...}}，随 tunnel_mappings 一起维护
+        self._by_service: Dict[str, Set[int]] = {}
+        self._by_client: Dict[Optional[int], Set[int]] = {}
+        # NPS 隧道列表缓存 {client_id: (请求发出时间, rows)}
+        self._list_cache = {}
+        # NPS 确认不存在的隧道ID {tunnel_id: 过期时间 (time.monotonic)}
+        self._missing_tunnels: Dict[int, float] = {}
+        # 隧道映射的本地缓存文件，与端口分配状态文件放在同一目录
+        self._mappings_cache_path = os.path.join(
+            os.path.dirname(self.port_manager.config["persistence"]["file"]) or ".", "tunnel_mappings.json")
+        # 串行化缓存文件的写入，保证后写入的快照一定更新
+        self._cache_file_lock = threading.Lock()
         
         # 加载隧道映射
         self._load_tunnel_mappings()
         
-        print("动态隧道管理器初始化完成")
+        logger.info("动态隧道管理器初始化完成")
     
     def _load_tunnel_mappings(self):
-        """加载隧道映射关系"""
+        """加载隧道映射关系：本地缓存新鲜时直接使用并在后台与 NPS 同步，否则同步从 NPS 加载"""
+        cached_ids = self._load_cached_mappings()
+        if cached_ids is None:
+            self._sync_tunnel_mappings()
+        else:
+            threading.Thread(target=self._sync_tunnel_mappings, args=(cached_ids,),
+                             name="tunnel-mappings-sync", daemon=True).start()
+
+    def _load_cached_mappings(self) -> Optional[Set[int]]:
+        """从本地缓存文件加载隧道映射，缓存不存在或已过期时返回 None，否则返回加载的隧道ID集合"""
+        try:
+            if time.time() - os.path.getmtime(self._mappings_cache_path) > _MAPPINGS_CACHE_MAX_AGE:
+                return None
+            with open(self._mappings_cache_path, 'rb') as f:
+                cached = orjson.loads(f.read())
+            # 先完整解析所有记录，格式错误或旧格式的缓存不会留下部分加载的映射
+            records = {int(tunnel_id): TunnelRecord(**info) for tunnel_id, info in cached.items()}
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("读取隧道映射缓存失败，将从 NPS 加载: %s", e)
+            return None
+
+        for tunnel_id, record in records.items():
+            self._set_mapping(tunnel_id, record)
+            if not self.port_manager.is_port_allocated(record.port):
+                self.port_manager._mark_port_allocated(record.port, record.service, record.client_id)
+        # 保留: 加载成功信息
+        logger.info("已从本地缓存加载 %s 个隧道映射，正在后台与 NPS 同步", len(records))
+        return set(records)
+
+    def _save_cached_mappings(self):
+        """将隧道映射写入本地缓存文件（先写临时文件再替换），映射每次变化后调用"""
+        try:
+            with self._cache_file_lock:
+                with self._mappings_lock:
+                    data = orjson.dumps(self.tunnel_mappings, option=orjson.OPT_NON_STR_KEYS)
+                atomic_write(self._mappings_cache_path, data)
+        except Exception as e:
+            logger.warning("保存隧道映射缓存失败: %s", e)
+
+    def _sync_tunnel_mappings(self, cached_ids: Set[int] = None):
+        """
+        从 NPS 获取现有隧道并同步映射关系
+
+        参数:
+            cached_ids: 从本地缓存加载的隧道ID，NPS 中已不存在的将被移除
+        """
         # 从NPS获取现有隧道
-        client_id = self.nps.config.get("clients", {}).get("default_client_id", 2)
-        tunnels = self.nps.list_tunnels(client_id=client_id)
+        client_id = self._default_client_id
+        rows = self._list_tunnel_rows(client_id)
+        if rows is None:
+            # 保留: 同步失败警告
+            logger.warning("无法从 NPS 获取隧道列表，隧道映射未同步")
+            return
+
+        if cached_ids:
+            # 只清理来自缓存的过期条目，避免误删同步期间新建的隧道；
+            # 这些隧道的端口是加载缓存时标记的，NPS 中已无隧道使用时一并释放
+            live_ports = {tunnel['Port'] for tunnel in rows}
+            for tunnel_id in cached_ids - {tunnel['Id'] for tunnel in rows}:
+                record = self._remove_mapping(tunnel_id)
+                if record is None or record.port in live_ports:
+                    continue
+                with self._mappings_lock:
+                    in_use = any(r.port == record.port for r in self.tunnel_mappings.values())
+                if not in_use:
+                    self.port_manager.release_port(record.port)
         
         loaded_count = 0
-        if tunnels and 'rows' in tunnels and tunnels['rows']:
-            for tunnel in tunnels['rows']:
+        if rows:
+            for tunnel in rows:
                 tunnel_id = tunnel['Id']
+                if cached_ids is not None and tunnel_id in self.tunnel_mappings:
+                    # 后台同步时保留已有映射（缓存中记录的是创建时的真实服务名，也可能是同步期间新建的隧道）
+                    continue
                 port = tunnel['Port']
-                target = tunnel['Target']['TargetStr'] if 'Target' in tunnel and 'TargetStr' in tunnel['Target'] else ""
+                target = tunnel.get('Target', {}).get('TargetStr', "")
                 remark = tunnel.get('Remark', '')
                 
                 # 提取服务名称，如果备注中包含服务信息
-                service = "unknown"
-                if "ssh" in remark.lower() or ":22" in target:
-                    service = "ssh"
-                elif "http" in remark.lower() or ":80" in target or ":8080" in target:
-                    service = "http"
-                elif "jupyter" in remark.lower() or ":8888" in target:
-                    service = "jupyter"
-                elif "web" in remark.lower(): # 更通用的web服务
-                    service = "web"
+                service = _classify_service(remark, target)
                 
                 # 保存隧道映射关系
-                self.tunnel_mappings[tunnel_id] = {
-                    "port": port,
-                    "service": service,
-                    "client_id": client_id,
-                    "target": target,
-                    "remark": remark
-                }
+                self._set_mapping(tunnel_id, TunnelRecord(port, service, client_id, target, remark))
                 
                 # 在端口管理器中标记该端口已分配 (使用 internal 方法需要注意)
                 # 确保端口管理器确实加载了该端口
@@ -81,8 +218,71 @@ class DynamicTunnelManager:
             
             # 保留: 加载成功信息
             if loaded_count > 0:
-                print(f"已从 NPS 加载并同步 {loaded_count} 个现有隧道映射")
+                logger.info("已从 NPS 加载并同步 %s 个现有隧道映射", loaded_count)
+        self._save_cached_mappings()
     
+    @staticmethod
+    def _index_discard(index: Dict, key, tunnel_id: int):
+        """从二级索引中移除隧道ID，集合为空时删除该键"""
+        ids = index.get(key)
+        if ids is not None:
+            ids.discard(tunnel_id)
+            if not ids:
+                del index[key]
+
+    def _set_mapping(self, tunnel_id: int, record: TunnelRecord):
+        """写入隧道映射并同步服务/客户端索引"""
+        with self._mappings_lock:
+            old = self.tunnel_mappings.get(tunnel_id)
+            if old is not None:
+                self._index_discard(self._by_service, old.service, tunnel_id)
+                self._index_discard(self._by_client, old.client_id, tunnel_id)
+            self.tunnel_mappings[tunnel_id] = record
+            self._by_service.setdefault(record.service, set()).add(tunnel_id)
+            self._by_client.setdefault(record.client_id, set()).add(tunnel_id)
+
+    def _remove_mapping(self, tunnel_id: int) -> Optional[TunnelRecord]:
+        """删除隧道映射并同步服务/客户端索引，返回被删除的记录"""
+        with self._mappings_lock:
+            record = self.tunnel_mappings.pop(tunnel_id, None)
+            if record is not None:
+                self._index_discard(self._by_service, record.service, tunnel_id)
+                self._index_discard(self._by_client, record.client_id, tunnel_id)
+        return record
+
+    def _matching_tunnel_ids(self, client_id=None, service=None):
+        """按筛选条件从索引取出隧道ID (需持有 _mappings_lock)"""
+        if service is not None and client_id is not None:
+            return self._by_service.get(service, set()) & self._by_client.get(client_id, set())
+        if service is not None:
+            return self._by_service.get(service, ())
+        if client_id is not None:
+            return self._by_client.get(client_id, ())
+        return self.tunnel_mappings.keys()
+
+    def _list_tunnel_rows(self, client_id, since: float = None) -> Optional[List[Dict]]:
+        """
+        获取客户端的 NPS 隧道列表 (rows)，短时间内的重复查询直接使用缓存；查询失败时返回 None
+
+        参数:
+            client_id: 客户端ID
+            since: 只接受在此时刻 (time.monotonic) 之后发出的查询结果，
+                   用于确认刚创建的隧道一定包含在结果中
+        """
+        now = time.monotonic()
+        cached = self._list_cache.get(client_id)
+        if cached is not None:
+            fetched_at, rows = cached
+            if now - fetched_at < _LIST_CACHE_TTL and (since is None or fetched_at >= since):
+                return rows
+        # 这里自带按 since 判断新鲜度的缓存，绕过 NPSManager 的 TTL 缓存，避免轮询新隧道 ID 时拿到旧结果
+        tunnels = self.nps.list_tunnels(client_id=client_id, use_cache=False)
+        if not tunnels:
+            return None
+        rows = tunnels.get('rows') or []
+        self._list_cache[client_id] = (now, rows)
+        return rows
+
     def create_tunnel(self, target: str, service_name: str, client_id: int = None, preferred_port: int = None, remark: str = None) -> Optional[Dict]:
         """
         创建新的动态隧道
@@ -97,11 +297,11 @@ class DynamicTunnelManager:
         返回:
             成功返回隧道信息字典，失败返回None
         """
-        print(f"[TunnelManager] 请求创建隧道: 服务='{service_name}', 目标='{target}', 偏好端口={preferred_port}")
+        logger.debug("请求创建隧道: 服务='%s', 目标='%s', 偏好端口=%s", service_name, target, preferred_port)
         
         # 获取客户端ID
         if client_id is None:
-            client_id = self.nps.config.get("clients", {}).get("default_client_id", 2)
+            client_id = self._default_client_id
         # print(f"[TunnelManager] Using Client ID: {client_id}") # 调试信息，注释掉
 
         # 分配端口
@@ -109,7 +309,7 @@ class DynamicTunnelManager:
         port = self.port_manager.allocate_port(service_name, client_id, preferred_port)
         if port is None:
             # 保留: 端口分配失败错误
-            print(f"[TunnelManager] Error: 分配端口失败，无法创建隧道 (服务: {service_name})")
+            logger.error("分配端口失败，无法创建隧道 (服务: %s)", service_name)
             return None
         # print(f"[TunnelManager] Allocated port: {port}") # 调试信息，注释掉
 
@@ -128,6 +328,7 @@ class DynamicTunnelManager:
             target=target,
             remark=remark
         )
+        added_at = time.monotonic()
         # print(f"[TunnelManager] NPS API add_tunnel result: {result}") # 调试信息，注释掉
 
         if not result:
@@ -135,33 +336,32 @@ class DynamicTunnelManager:
             # print(f"[TunnelManager] NPS API call failed. Releasing allocated port {port}...") # 调试信息，注释掉
             self.port_manager.release_port(port)
             # 保留: NPS API 调用失败错误
-            print(f"[TunnelManager] Error: 创建隧道失败 (NPS API 调用失败)，已释放端口 {port}")
+            logger.error("创建隧道失败 (NPS API 调用失败)，已释放端口 %s", port)
             return None
 
-        # 获取新建隧道的ID
-        tunnel_id = None
+        # 获取新建隧道的ID：NPS 响应中带回了 ID 时直接使用，否则轮询隧道列表按端口查找
+        tunnel_id = result if result is not True else None
         # print(f"[TunnelManager] Attempting to fetch Tunnel ID for port {port}...") # 调试信息，注释掉
-        for attempt in range(3):  # 尝试3次
-            # print(f"[TunnelManager] Fetch attempt {attempt + 1}/3...") # 调试信息，注释掉
-            tunnels = self.nps.list_tunnels(client_id=client_id)
-            if tunnels and 'rows' in tunnels and tunnels['rows']:
-                for tunnel in tunnels['rows']:
-                    # 确保 port 匹配
-                    if tunnel.get('Port') == port: 
-                        tunnel_id = tunnel.get('Id')
-                        # print(f"[TunnelManager] Found Tunnel ID: {tunnel_id}") # 调试信息，注释掉
-                        break
+        for attempt in range(0 if tunnel_id else _TUNNEL_ID_FETCH_ATTEMPTS):
+            # print(f"[TunnelManager] Fetch attempt {attempt + 1}/{_TUNNEL_ID_FETCH_ATTEMPTS}...") # 调试信息，注释掉
+            # 并发创建时其他线程在 add_tunnel 之后发出的查询结果可以直接复用
+            rows = self._list_tunnel_rows(client_id, since=added_at)
+            if rows:
+                # 每次响应只遍历一遍建立端口索引，之后按端口直接查找
+                tunnel_id = _index_tunnels_by_port(rows).get(port)
+                # print(f"[TunnelManager] Found Tunnel ID: {tunnel_id}") # 调试信息，注释掉
             
-            if tunnel_id:
+            if tunnel_id or attempt == _TUNNEL_ID_FETCH_ATTEMPTS - 1:
                 break
                 
-            # print(f"[TunnelManager] Tunnel ID not found yet, sleeping for 1 second...") # 调试信息，注释掉
-            time.sleep(1)  # 等待1秒后重试
+            # print(f"[TunnelManager] Tunnel ID not found yet, backing off...") # 调试信息，注释掉
+            delay = min(_TUNNEL_ID_BACKOFF_CAP, _TUNNEL_ID_BACKOFF_BASE * 2 ** attempt)
+            time.sleep(delay * (0.5 + random.random()))
         
         if not tunnel_id:
             # 虽然隧道可能已创建成功，但无法获取ID进行后续管理
             # 保留: 获取隧道 ID 失败警告
-            print(f"[TunnelManager] Warning: 无法获取端口 {port} 的隧道 ID。隧道可能已创建但无法被管理器追踪。")
+            logger.warning("无法获取端口 %s 的隧道 ID。隧道可能已创建但无法被管理器追踪。", port)
             # 依然返回信息，但标记 tunnel_id 为 None
             return {
                 "port": port,
@@ -173,15 +373,10 @@ class DynamicTunnelManager:
             }
         
         # 保存隧道映射关系
-        self.tunnel_mappings[tunnel_id] = {
-            "port": port,
-            "service": service_name,
-            "client_id": client_id,
-            "target": target,
-            "remark": remark
-        }
+        self._set_mapping(tunnel_id, TunnelRecord(port, service_name, client_id, target, remark))
+        self._save_cached_mappings()
         # 保留: 隧道创建成功信息
-        print(f"[TunnelManager] 隧道创建成功: ID={tunnel_id}, 端口={port}, 服务={service_name}, 目标={target}")
+        logger.info("隧道创建成功: ID=%s, 端口=%s, 服务=%s, 目标=%s", tunnel_id, port, service_name, target)
         
         # 返回隧道信息
         return {
@@ -204,35 +399,33 @@ class DynamicTunnelManager:
             成功返回True，失败返回False
         """
         # 保留: 函数入口信息
-        print(f"[TunnelManager] 请求删除隧道: ID={tunnel_id}")
-        # 检查隧道是否存在
-        if tunnel_id not in self.tunnel_mappings:
+        logger.debug("请求删除隧道: ID=%s", tunnel_id)
+        # 检查隧道是否存在并获取隧道信息
+        if (tunnel_info := self.tunnel_mappings.get(tunnel_id)) is None:
             # 保留: 隧道不存在错误
-            print(f"[TunnelManager] Error: 删除隧道失败，隧道ID {tunnel_id} 不存在于映射中")
+            logger.error("删除隧道失败，隧道ID %s 不存在于映射中", tunnel_id)
             # 尝试从 NPS 强制删除，以防映射不同步
-            print(f"[TunnelManager] 尝试从 NPS 直接删除隧道 ID {tunnel_id}...")
+            logger.info("尝试从 NPS 直接删除隧道 ID %s...", tunnel_id)
             result = self.nps.delete_tunnel(tunnel_id)
             if result:
-                print(f"[TunnelManager] Info: 成功从 NPS 删除了未被追踪的隧道 ID {tunnel_id}")
+                logger.info("成功从 NPS 删除了未被追踪的隧道 ID %s", tunnel_id)
                 # 即使本地没有，也检查下端口管理器里是否有残留端口
                 port_to_check = None
                 # (这里逻辑比较复杂，暂时不实现孤立端口的查找和释放)
                 return True
             else:
-                print(f"[TunnelManager] Error: 从 NPS 直接删除隧道 ID {tunnel_id} 也失败了")
+                logger.error("从 NPS 直接删除隧道 ID %s 也失败了", tunnel_id)
                 return False
 
-        # 获取隧道信息
-        tunnel_info = self.tunnel_mappings[tunnel_id]
-        port = tunnel_info["port"]
-        service_name = tunnel_info.get("service", "unknown")
+        port = tunnel_info.port
+        service_name = tunnel_info.service
         
         # 删除NPS隧道
         # print(f"[TunnelManager] Calling NPS API to delete tunnel ID {tunnel_id}...") # 调试信息，注释掉
         result = self.nps.delete_tunnel(tunnel_id)
         if not result:
             # 保留: NPS API 调用失败错误
-            print(f"[TunnelManager] Error: 删除隧道失败 (NPS API 错误)，隧道 ID={tunnel_id}")
+            logger.error("删除隧道失败 (NPS API 错误)，隧道 ID=%s", tunnel_id)
             return False
         
         # 释放端口
@@ -240,10 +433,12 @@ class DynamicTunnelManager:
         self.port_manager.release_port(port)
         
         # 删除隧道映射
-        del self.tunnel_mappings[tunnel_id]
+        self._remove_mapping(tunnel_id)
+        self._save_cached_mappings()
+        self._list_cache.pop(tunnel_info.client_id, None)
         
         # 保留: 隧道删除成功信息
-        print(f"[TunnelManager] 隧道删除成功: ID={tunnel_id}, 端口={port}, 服务={service_name}")
+        logger.info("隧道删除成功: ID=%s, 端口=%s, 服务=%s", tunnel_id, port, service_name)
         return True
     
     def update_tunnel(self, tunnel_id: int, target=None, port=None, remark=None) -> bool:
@@ -260,20 +455,22 @@ class DynamicTunnelManager:
             成功返回True，失败返回False
         """
         # 保留: 函数入口信息
-        print(f"[TunnelManager] 请求更新隧道: ID={tunnel_id}, 新目标={target}, 新端口={port}, 新备注={remark}")
-        # 检查隧道是否存在
-        if tunnel_id not in self.tunnel_mappings:
+        logger.debug("请求更新隧道: ID=%s, 新目标=%s, 新端口=%s, 新备注=%s", tunnel_id, target, port, remark)
+        # 没有指定任何要修改的字段时无需查询映射或调用 NPS
+        if target is None and port is None and remark is None:
+            logger.info("隧道 %s 无需更新", tunnel_id)
+            return True
+        # 检查隧道是否存在并获取隧道信息
+        if (tunnel_info := self.tunnel_mappings.get(tunnel_id)) is None:
             # 保留: 隧道不存在错误
-            print(f"[TunnelManager] Error: 更新隧道失败，隧道ID {tunnel_id} 不存在于映射中")
+            logger.error("更新隧道失败，隧道ID %s 不存在于映射中", tunnel_id)
             return False
         
-        # 获取隧道信息
-        tunnel_info = self.tunnel_mappings[tunnel_id]
-        old_port = tunnel_info["port"]
-        service_name = tunnel_info["service"]
-        client_id = tunnel_info["client_id"]
-        old_target = tunnel_info.get("target", "unknown")
-        old_remark = tunnel_info.get("remark", "")
+        old_port = tunnel_info.port
+        service_name = tunnel_info.service
+        client_id = tunnel_info.client_id
+        old_target = tunnel_info.target
+        old_remark = tunnel_info.remark
         
         # 确定最终要更新的值
         final_target = target if target is not None else old_target
@@ -282,7 +479,7 @@ class DynamicTunnelManager:
         
         # 如果没有实际变化，则直接返回成功
         if final_target == old_target and final_port == old_port and final_remark == old_remark:
-            print(f"[TunnelManager] Info: 隧道 {tunnel_id} 无需更新")
+            logger.info("隧道 %s 无需更新", tunnel_id)
             return True
         
         allocated_new_port = False
@@ -291,13 +488,11 @@ class DynamicTunnelManager:
             # 检查新端口是否可用
             if not self.port_manager._is_port_available(port):
                 # 保留: 端口不可用错误
-                print(f"[TunnelManager] Error: 更新隧道失败，新端口 {port} 不可用")
+                logger.error("更新隧道失败，新端口 %s 不可用", port)
                 return False
             
-            # 尝试分配新端口
-            if not self.port_manager._mark_port_allocated(port, service_name, client_id):
-                print(f"[TunnelManager] Error: 更新隧道失败，无法在 PortManager 中标记新端口 {port}")
-                return False
+            # 分配新端口 (_mark_port_allocated 没有返回值，不能用来判断成败)
+            self.port_manager._mark_port_allocated(port, service_name, client_id)
             allocated_new_port = True
             final_port = port # 确认使用新端口
             # print(f"[TunnelManager] New port {port} allocated for update.") # 调试信息，注释掉
@@ -317,23 +512,21 @@ class DynamicTunnelManager:
                 self.port_manager.release_port(port)
                 # print(f"[TunnelManager] NPS API update failed. Released newly allocated port {port}.") # 调试信息，注释掉
             # 保留: NPS API 调用失败错误
-            print(f"[TunnelManager] Error: 更新隧道失败 (NPS API 错误)，隧道 ID={tunnel_id}")
+            logger.error("更新隧道失败 (NPS API 错误)，隧道 ID=%s", tunnel_id)
             return False
         
         # 更新成功，处理端口和映射
+        self._list_cache.pop(client_id, None)
         if allocated_new_port:
             self.port_manager.release_port(old_port) # 释放旧端口
-            self.tunnel_mappings[tunnel_id]["port"] = final_port
             # print(f"[TunnelManager] Old port {old_port} released.") # 调试信息，注释掉
         
-        # 更新映射中的其他信息
-        if target is not None:
-            self.tunnel_mappings[tunnel_id]["target"] = final_target
-        if remark is not None:
-            self.tunnel_mappings[tunnel_id]["remark"] = final_remark
+        # 以新记录替换映射（不原地修改其他线程可能正在读取的记录），并同步写入映射缓存
+        self._set_mapping(tunnel_id, TunnelRecord(final_port, service_name, client_id, final_target, final_remark))
+        self._save_cached_mappings()
         
         # 保留: 隧道更新成功信息
-        print(f"[TunnelManager] 隧道更新成功: ID={tunnel_id}")
+        logger.info("隧道更新成功: ID=%s", tunnel_id)
         return True
     
     def get_tunnel_info(self, tunnel_id: int) -> Optional[Dict]:
@@ -347,11 +540,17 @@ class DynamicTunnelManager:
             成功返回隧道信息字典，失败返回None
         """
         # 检查本地缓存
-        if tunnel_id in self.tunnel_mappings:
-            info = self.tunnel_mappings[tunnel_id].copy()
-            info["tunnel_id"] = tunnel_id
+        if (record := self.tunnel_mappings.get(tunnel_id)) is not None:
+            info = record.to_dict(tunnel_id)
             # print(f"[TunnelManager] Tunnel info for ID {tunnel_id} found in cache.") # 调试信息，注释掉
             return info
+
+        # 最近刚确认不存在的隧道直接返回，避免反复查询 NPS
+        missing_until = self._missing_tunnels.get(tunnel_id)
+        if missing_until is not None:
+            if time.monotonic() < missing_until:
+                return None
+            self._missing_tunnels.pop(tunnel_id, None)
         
         # 如果缓存没有，尝试从NPS获取 (可能表示映射不同步)
         # print(f"[TunnelManager] Tunnel ID {tunnel_id} not in cache, fetching from NPS...") # 调试信息，注释掉
@@ -360,45 +559,35 @@ class DynamicTunnelManager:
             data = tunnel_info['data']
             # 检查返回的数据是否有效
             if not data or 'Id' not in data or 'Port' not in data or 'Client' not in data or 'Id' not in data['Client']:
-                print(f"[TunnelManager] Warning: 从 NPS 获取的隧道 {tunnel_id} 信息不完整或格式错误")
+                logger.warning("从 NPS 获取的隧道 %s 信息不完整或格式错误", tunnel_id)
                 return None
 
             # 提取服务名称
             port = data['Port']
             client_id = data['Client']['Id']
-            target = data['Target']['TargetStr'] if 'Target' in data and 'TargetStr' in data['Target'] else ""
+            target = data.get('Target', {}).get('TargetStr', "")
             remark = data.get('Remark', '')
-            service = "unknown"
-            if "ssh" in remark.lower() or ":22" in target:
-                service = "ssh"
-            elif "http" in remark.lower() or ":80" in target or ":8080" in target:
-                service = "http"
-            elif "jupyter" in remark.lower() or ":8888" in target:
-                service = "jupyter"
-            elif "web" in remark.lower():
-                service = "web"
+            service = _classify_service(remark, target)
             
             # 更新本地缓存
-            self.tunnel_mappings[tunnel_id] = {
-                "port": port,
-                "service": service,
-                "client_id": client_id,
-                "target": target,
-                "remark": remark
-            }
+            self._set_mapping(tunnel_id, TunnelRecord(port, service, client_id, target, remark))
+            self._save_cached_mappings()
             # print(f"[TunnelManager] Tunnel info for ID {tunnel_id} fetched from NPS and cached.") # 调试信息，注释掉
             
             # 在端口管理器中标记该端口 (如果之前未标记)
             if not self.port_manager.is_port_allocated(port):
                 self.port_manager._mark_port_allocated(port, service, client_id)
-                print(f"[TunnelManager] Info: 从NPS同步并标记了端口 {port} (服务: {service})")
+                logger.info("从NPS同步并标记了端口 %s (服务: %s)", port, service)
             
-            result = self.tunnel_mappings[tunnel_id].copy()
-            result["tunnel_id"] = tunnel_id
-            return result
+            return self.tunnel_mappings[tunnel_id].to_dict(tunnel_id)
         else:
             # 保留: 获取隧道信息失败
-            print(f"[TunnelManager] Info: 无法从 NPS 获取隧道 ID {tunnel_id} 的信息")
+            logger.info("无法从 NPS 获取隧道 ID %s 的信息", tunnel_id)
+            if tunnel_info is not None:
+                # NPS 有响应但隧道不存在时才记录（请求失败不算），超出上限时淘汰最早的记录
+                if len(self._missing_tunnels) >= _MISSING_TUNNEL_MAX:
+                    self._missing_tunnels.pop(next(iter(self._missing_tunnels)), None)
+                self._missing_tunnels[tunnel_id] = time.monotonic() + _MISSING_TUNNEL_TTL
         
         return None
     
@@ -416,19 +605,11 @@ class DynamicTunnelManager:
         result = []
         # print(f"[TunnelManager] Listing tunnels (Client={client_id}, Service={service})...") # 调试信息，注释掉
         
-        # 创建副本以防迭代时修改
-        mappings_copy = self.tunnel_mappings.copy()
-        for tunnel_id, info in mappings_copy.items():
-            # 筛选条件
-            if client_id is not None and info.get("client_id") != client_id:
-                continue
-            if service is not None and info.get("service") != service:
-                continue
-            
-            # 添加隧道ID
-            tunnel_info = info.copy()
-            tunnel_info["tunnel_id"] = tunnel_id
-            result.append(tunnel_info)
+        # 持锁直接遍历映射（修改映射同样需要持锁），不再先复制一份；筛选条件通过服务/客户端索引直接定位
+        with self._mappings_lock:
+            for tunnel_id in self._matching_tunnel_ids(client_id, service):
+                # 添加隧道ID（返回新字典，调用方修改不影响映射）
+                result.append(self.tunnel_mappings[tunnel_id].to_dict(tunnel_id))
         
         # print(f"[TunnelManager] Found {len(result)} tunnels matching criteria.") # 调试信息，注释掉
         return result
@@ -444,12 +625,11 @@ class DynamicTunnelManager:
         返回:
             端口列表
         """
-        result = []
         # print(f"[TunnelManager] Finding ports for service '{service_name}' (Client={client_id})...") # 调试信息，注释掉
         
-        for info in self.list_tunnels(client_id=client_id, service=service_name):
-            if "port" in info:
-                result.append(info["port"])
+        # 直接按服务索引取端口，不再复制整张映射表
+        with self._mappings_lock:
+            result = [self.tunnel_mappings[tunnel_id].port for tunnel_id in self._matching_tunnel_ids(client_id, service_name)]
         
         # print(f"[TunnelManager] Found ports for service '{service_name}': {result}") # 调试信息，注释掉
         return result
@@ -470,32 +650,36 @@ class DynamicTunnelManager:
             服务名称到成功创建的隧道信息的映射字典
         """
         # 保留: 函数入口信息
-        print(f"[TunnelManager] 请求批量创建 {len(services)} 个服务隧道...")
+        logger.debug("请求批量创建 %s 个服务隧道...", len(services))
         result = {}
         success_count = 0
         
+        valid_services = []
         for service_config in services:
-            name = service_config.get("name")
-            target = service_config.get("target")
-            
-            if not name or not target:
+            if not service_config.get("name") or not service_config.get("target"):
                 # 保留: 配置错误警告
-                print(f"[TunnelManager] Warning: 跳过无效的服务配置: {service_config}")
+                logger.warning("跳过无效的服务配置: %s", service_config)
                 continue
+            valid_services.append(service_config)
 
-            preferred_port = service_config.get("preferred_port")
-            client_id = service_config.get("client_id")
-            remark = service_config.get("remark")
-            
-            # print(f"[TunnelManager] Creating tunnel for service: {name}...") # 调试信息，注释掉
-            tunnel = self.create_tunnel(
-                target=target,
-                service_name=name,
-                client_id=client_id,
-                preferred_port=preferred_port,
-                remark=remark
+        def create_one(service_config):
+            # print(f"[TunnelManager] Creating tunnel for service: {service_config['name']}...") # 调试信息，注释掉
+            return self.create_tunnel(
+                target=service_config["target"],
+                service_name=service_config["name"],
+                client_id=service_config.get("client_id"),
+                preferred_port=service_config.get("preferred_port"),
+                remark=service_config.get("remark")
             )
-            
+
+        # 各服务的隧道互不依赖，并行创建以重叠 NPS 网络往返
+        tunnels = []
+        if valid_services:
+            with ThreadPoolExecutor(max_workers=min(_SERVICE_TUNNEL_WORKERS, len(valid_services))) as executor:
+                tunnels = list(executor.map(create_one, valid_services))
+
+        for service_config, tunnel in zip(valid_services, tunnels):
+            name = service_config["name"]
             if tunnel and tunnel.get("tunnel_id") is not None:
                 result[name] = tunnel
                 success_count += 1
@@ -507,7 +691,7 @@ class DynamicTunnelManager:
                 pass
 
         # 保留: 批量创建结果信息
-        print(f"[TunnelManager] 批量创建完成: {success_count} 个隧道成功创建 (共请求 {len(services)} 个)")
+        logger.info("批量创建完成: %s 个隧道成功创建 (共请求 %s 个)", success_count, len(services))
         return result
     
     def clear_service_tunnels(self, service_name: str, client_id=None) -> int:
@@ -522,43 +706,47 @@ class DynamicTunnelManager:
             删除的隧道数量
         """
         # 保留: 函数入口信息
-        print(f"[TunnelManager] 请求清除服务 '{service_name}' 的所有隧道" + (f" (客户端ID: {client_id})" if client_id else "") + "...")
+        logger.debug("请求清除服务 '%s' 的所有隧道 (客户端ID: %s)...", service_name, client_id)
         # 获取服务隧道 (基于缓存)
         tunnels_to_delete = self.list_tunnels(client_id=client_id, service=service_name)
         count = 0
         
         if not tunnels_to_delete:
-            print(f"[TunnelManager] Info: 没有找到服务 '{service_name}' 的隧道，无需清除")
+            logger.info("没有找到服务 '%s' 的隧道，无需清除", service_name)
             return 0
 
         # 删除隧道
+        tunnel_ids = []
         for tunnel in tunnels_to_delete:
             tunnel_id = tunnel.get("tunnel_id")
             if tunnel_id:
-                # print(f"[TunnelManager] Deleting tunnel ID: {tunnel_id} for service '{service_name}'...") # 调试信息，注释掉
-                if self.delete_tunnel(tunnel_id):
-                    count += 1
-                else:
-                    # 删除失败信息已在 delete_tunnel 打印
-                    pass
+                tunnel_ids.append(tunnel_id)
             else:
                 # 保留: 无法删除警告
-                print(f"[TunnelManager] Warning: 无法删除服务 '{service_name}' 的一个隧道，因为它没有有效的 tunnel_id: {tunnel}")
+                logger.warning("无法删除服务 '%s' 的一个隧道，因为它没有有效的 tunnel_id: %s", service_name, tunnel)
+
+        # 各隧道的删除互不依赖，并行发出 NPS 请求；映射和端口的修改由各自的锁保护
+        # 删除失败信息已在 delete_tunnel 打印
+        if tunnel_ids:
+            with ThreadPoolExecutor(max_workers=min(_SERVICE_TUNNEL_WORKERS, len(tunnel_ids))) as executor:
+                count = sum(executor.map(self.delete_tunnel, tunnel_ids))
         
         # 保留: 清除结果信息
-        print(f"[TunnelManager] 已清除 {count} 个 '{service_name}' 服务隧道 (共找到 {len(tunnels_to_delete)} 个)")
+        logger.info("已清除 %s 个 '%s' 服务隧道 (共找到 %s 个)", count, service_name, len(tunnels_to_delete))
         return count
     
     def cleanup(self):
         """保存状态并清理"""
-        # 保存端口分配状态
+        # 保存端口分配状态和隧道映射缓存
         self.port_manager.save_allocated_ports()
+        self._save_cached_mappings()
         # 保留: 清理完成信息
-        print("[TunnelManager] 已触发端口分配状态保存")
+        logger.info("已触发端口分配状态和隧道映射保存")
 
 
 # 测试代码
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(name)s] %(levelname)s: %(message)s")
     # 初始化管理器
     # 确保测试前 config 目录和空的 state 目录存在
     os.makedirs("config", exist_ok=True)
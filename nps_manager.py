@@ -21,13 +21,60 @@ NPSManager - NPS（NProxy Server）管理工具
 详细文档请参考 README.md 文件
 """
 
+import asyncio
+import functools
+import threading
+from collections import OrderedDict
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
 import hashlib
+import logging
 import time
-import json
+import orjson
 import os
+import socket
 from datetime import datetime
-from typing import Dict, Optional, Any
+from typing import Dict, Optional, Any, Iterable, List, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# 单个响应体的读取上限，防止异常的 NPS 响应占满内存
+_MAX_RESPONSE_BYTES = 8 * 1024 * 1024
+
+# 只读查询 (list_clients/list_tunnels/get_tunnel) 结果缓存的最大条目数
+_READ_CACHE_MAX = 128
+
+# 最近添加的隧道 备注 -> ID 映射的最大条目数
+_REMARK_ID_MAX = 128
+
+# 视为本机 NPS 的服务器地址
+_LOOPBACK_ADDRESSES = ('127.0.0.1', 'localhost', '::1')
+
+# NPSManager._send_batch 的返回值：批量请求确定未到达服务器，可以安全回退为逐个请求
+_BATCH_UNAVAILABLE = object()
+
+
+def _is_connect_failure(error: requests.exceptions.ConnectionError) -> bool:
+    """判断 requests 的连接错误是否发生在连接建立阶段 (请求尚未发出)"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = error.args[0] if error.args else None
+    # 重试用尽时 urllib3 抛出 MaxRetryError，真正的原因在其 reason 中
+    reason = getattr(reason, 'reason', reason)
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+class _KeepAliveAdapter(HTTPAdapter):
+    """在 urllib3 默认的 TCP_NODELAY 之外开启 SO_KEEPALIVE，及时发现池中已失效的空闲连接"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        super().init_poolmanager(*args, **kwargs)
+
 
 class NPSManager:
     def __init__(self, config_file=None, server_addr=None, server_port=None, auth_key=None):
@@ -51,7 +98,10 @@ class NPSManager:
             },
             "api": {
                 "timeout": 10,
-                "retry_count": 3
+                "retry_count": 3,
+                "pool_size": 16, # 与 NPS 保持的长连接数上限，需不小于并发创建/删除隧道的线程数
+                "batch_endpoint": "", # 批量接口路径 (NPS 本身不提供，需前置 sidecar)，为空时 batch() 退化为并发逐个请求
+                "cache_ttl": 2.0 # 只读查询结果的缓存秒数，任何修改操作成功后清空；0 表示不缓存
             },
             "clients": {
                 "default_client_id": 2 # 默认使用的客户端ID
@@ -76,20 +126,20 @@ class NPSManager:
                     
         if config_file and os.path.exists(config_file):
             try:
-                with open(config_file, 'r', encoding='utf-8') as f:
-                    file_config = json.load(f)
+                with open(config_file, 'rb') as f:
+                    file_config = orjson.loads(f.read())
                     self._update_nested_dict(self.config, file_config)
                     # 保留: 配置加载成功信息
-                    print(f"已从 {config_file} 加载NPS配置") 
+                    logger.info("已从 %s 加载NPS配置", config_file)
             except Exception as e:
                 # 保留: 配置加载错误信息
-                print(f"加载NPS配置文件出错 ({config_file}): {e}") 
+                logger.error("加载NPS配置文件出错 (%s): %s", config_file, e)
         elif found_config_file:
              # 如果尝试找默认文件但找到了无效的
-             print(f"警告: 找到NPS配置文件 {found_config_file} 但加载失败。")
+             logger.warning("找到NPS配置文件 %s 但加载失败。", found_config_file)
         else:
              # 保留: 配置文件不存在警告
-             print(f"警告: 未找到NPS配置文件，使用默认配置。请确保配置正确。") 
+             logger.warning("未找到NPS配置文件，使用默认配置。请确保配置正确。")
 
         # 命令行参数覆盖
         if server_addr:
@@ -102,43 +152,126 @@ class NPSManager:
         # 设置服务器 URL 和认证密钥
         self.server_url = f"http://{self.config['server']['address']}:{self.config['server']['port']}"
         self.auth_key = self.config["auth"]["key"]
+        # 签名只依赖 auth_key 和秒级时间戳：预先编码 auth_key，并缓存最近一秒的签名
+        self._auth_key_bytes = self.auth_key.encode()
+        self._sign_cache = (0, "", "")
         self.timeout = self.config["api"]["timeout"]
         self.retry_count = self.config["api"]["retry_count"]
+        self.batch_endpoint = self.config["api"].get("batch_endpoint", "")
+        # 只读查询缓存: (endpoint, 参数) -> (查询时刻, 响应)
+        self._cache_ttl = self.config["api"].get("cache_ttl", 2.0)
+        self._cache: "OrderedDict[Tuple, Tuple[float, Dict]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # 最近添加的隧道 备注 -> ID，供 resolve_id_by_remark 免去一次列表查询
+        self._remark_ids: "OrderedDict[str, int]" = OrderedDict()
+        # bulk()/batch() 共用的线程池，首次使用时创建，close() 时关闭
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
         self.post_content_type = self.config.get("nps_version_compatibility", {}).get("post_content_type", "application/x-www-form-urlencoded")
+        # POST 的请求体参数名和请求头在初始化时确定，每次请求不再按 Content-Type 分支
+        if self.post_content_type == "application/json":
+            self._post_kw = 'json'
+            self._post_headers = {'Content-Type': 'application/json'}
+        else:
+            self._post_kw = 'data'
+            self._post_headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        self._urls: Dict[str, str] = {}
+
+        # 所有请求共用一个 Session，复用到 NPS 的 TCP 连接，避免每次请求重新握手
+        pool_size = self.config["api"].get("pool_size", 16)
+        self.session = requests.Session()
+        self.session.headers.update({'User-Agent': 'NPSManager/1.0'})
+        if self.config['server']['address'] in _LOOPBACK_ADDRESSES:
+            # 本机 NPS 不经过代理，跳过每次请求对代理环境变量/.netrc 的查找
+            self.session.trust_env = False
+        # 失败重试交给 urllib3：retry_count 为总尝试次数，按 0.3s、0.6s... 指数退避，并遵循服务端返回的 Retry-After。
+        # 只有 GET 查询在读超时/连接中断/5xx 时重试；POST (index/add、index/del 等修改操作) 只在连接未建立时重试，
+        # 请求一旦发出就不再重发，避免服务器已执行的操作被重复执行
+        retry = Retry(
+            total=max(self.retry_count - 1, 0),
+            backoff_factor=0.3,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(['GET']),
+            raise_on_status=False
+        )
+        self._pool_size = pool_size
+        adapter = _KeepAliveAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
         
         # 保留: 初始化完成信息
-        print(f"NPS Manager 初始化完成，服务器: {self.server_url}") 
+        logger.info("NPS Manager 初始化完成，服务器: %s", self.server_url)
         # 检查 auth_key 是否为默认值
         if self.auth_key == "YOUR_NPS_AUTH_KEY":
              # 保留: 配置不完整警告
-             print("警告: NPS auth_key 未配置，请在配置文件中设置正确的 auth.key") 
+             logger.warning("NPS auth_key 未配置，请在配置文件中设置正确的 auth.key")
     
+    @staticmethod
+    def set_log_level(level):
+        """设置 nps_manager 模块的日志级别，如 logging.WARNING 可关闭成功操作的日志"""
+        logger.setLevel(level)
+
+    def close(self):
+        """关闭 bulk() 线程池和 HTTP Session，释放与 NPS 的连接"""
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        self.session.close()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """返回常驻线程池，线程数与 Session 连接池大小一致"""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._pool_size, thread_name_prefix="nps-bulk")
+            return self._executor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
     def _update_nested_dict(self, d, u):
-        """递归更新嵌套字典"""
-        for k, v in u.items():
-            if isinstance(v, dict):
-                # 如果键不存在或不是字典，直接用 v 替换，而不是尝试合并
-                d[k] = self._update_nested_dict(d.get(k, {}), v) 
-            else:
-                d[k] = v
+        """更新嵌套字典 (用显式栈代替递归)"""
+        stack = [(d, u)]
+        while stack:
+            dst, src = stack.pop()
+            for k, v in src.items():
+                if isinstance(v, dict):
+                    sub = dst.get(k)
+                    # 如果键不存在或不是字典，换成新的空字典再合并
+                    if not isinstance(sub, dict):
+                        sub = dst[k] = {}
+                    stack.append((sub, v))
+                else:
+                    dst[k] = v
         return d
     
     def _md5(self, text: str) -> str:
         """计算 MD5 哈希值"""
         return hashlib.md5(text.encode()).hexdigest()
 
+    def _auth_sign(self) -> Tuple[str, str]:
+        """返回 (timestamp, md5(auth_key + timestamp))，同一秒内的请求复用已计算的签名"""
+        # 先按整数秒比较，只有跨秒时才格式化时间戳字符串并重新计算签名
+        sec = int(time.time())
+        cached_sec, cached_timestamp, cached_sign = self._sign_cache
+        if sec == cached_sec:
+            return cached_timestamp, cached_sign
+        timestamp = str(sec)
+        sign = hashlib.md5(self._auth_key_bytes + timestamp.encode()).hexdigest()
+        self._sign_cache = (sec, timestamp, sign)
+        return timestamp, sign
+
     def _send_request(self, endpoint: str, data: Optional[Dict] = None, method: str = 'POST') -> Optional[Dict]:
         """发送API请求并处理响应 (日志精简版)"""
-        url = f"{self.server_url}/{endpoint}"
-        headers = {}
+        url = self._urls.get(endpoint)
+        if url is None:
+            url = self._urls[endpoint] = f"{self.server_url}/{endpoint}"
         
-        timestamp = str(int(time.time()))
-        auth_str = f"{self.auth_key}{timestamp}"
-        sign = self._md5(auth_str)
-        auth_params = {'auth_key': sign, 'timestamp': timestamp}
-        
-        query_params = auth_params.copy()
-        request_body_data = None
+        timestamp, sign = self._auth_sign()
+        query_params = {'auth_key': sign, 'timestamp': timestamp}
         req_method = method.upper()
 
         # print(f"[NPSManager Debug] Preparing {req_method} request for endpoint: {endpoint}") # 注释掉
@@ -147,94 +280,135 @@ class NPSManager:
             if data:
                 query_params.update(data)
             # print(f"[NPSManager] GET request - Query Params: {query_params}") # 注释掉
-        elif req_method == 'POST':
-            request_body_data = data
-            if self.post_content_type == "application/json":
-                 headers['Content-Type'] = 'application/json'
-                 # print(f"[NPSManager] POST request (JSON) - Query Params: {query_params}") # 注释掉
-                 # if request_body_data:
-                 #     print(f"[NPSManager] POST request - Body (JSON): {json.dumps(request_body_data)}") # 注释掉
-            else:
-                 headers['Content-Type'] = 'application/x-www-form-urlencoded'
-                 # print(f"[NPSManager] POST request (Form) - Query Params: {query_params}") # 注释掉
-                 # if request_body_data:
-                 #     print(f"[NPSManager] POST request - Body (Form Data): {request_body_data}") # 注释掉
-        else:
+        elif req_method != 'POST':
             # 保留: 不支持的 HTTP 方法错误
-            print(f"[NPSManager] Error: 不支持的 HTTP 方法 '{method}' (Endpoint: {endpoint})") 
+            logger.error("不支持的 HTTP 方法 '%s' (Endpoint: %s)", method, endpoint)
             return None
 
-        for attempt in range(self.retry_count):
-            # print(f"[NPSManager] Sending {req_method} request to {url} (Attempt {attempt + 1}/{self.retry_count})...") # 注释掉
-            try:
-                if req_method == 'POST':
-                    if self.post_content_type == "application/json":
-                         response = requests.post(url, headers=headers, params=query_params, json=request_body_data, timeout=self.timeout)
-                    else:
-                         response = requests.post(url, headers=headers, params=query_params, data=request_body_data, timeout=self.timeout)
-                elif req_method == 'GET':
-                    response = requests.get(url, headers=headers, params=query_params, timeout=self.timeout)
-                
-                # print(f"[NPSManager] Received response: Status Code={response.status_code}") # 注释掉
-                # 如果是 4xx 或 5xx 错误，会抛出异常
-                response.raise_for_status() 
-                
-                content_type = response.headers.get('Content-Type', '')
-                if 'application/json' in content_type:
-                    try:
-                        response_json = response.json()
-                        # print(f"[NPSManager] Response JSON: {json.dumps(response_json, indent=2, ensure_ascii=False)}") # 注释掉
-                        return response_json
-                    except json.JSONDecodeError as e:
-                        # 保留: JSON 解析错误
-                        print(f"[NPSManager] Error: 解析 NPS 响应 JSON 失败 (Endpoint: {endpoint}): {e}") 
-                        print(f"[NPSManager] Raw response text: {response.text[:200]}...") # 显示部分原始文本
-                        return {"status": 0, "msg": f"JSON Decode Error: {e}"} 
+        # 连接错误 (以及 GET 的读超时和 5xx 响应) 由 Session 上挂载的 urllib3 Retry 按指数退避自动重试，
+        # 这里只处理重试用尽后的最终结果
+        # print(f"[NPSManager] Sending {req_method} request to {url}...") # 注释掉
+        response = None
+        body = b""
+        try:
+            if req_method == 'POST':
+                response = self.session.post(url, headers=self._post_headers, params=query_params, timeout=self.timeout, stream=True, **{self._post_kw: data})
+            else:
+                response = self.session.get(url, params=query_params, timeout=self.timeout, stream=True)
+            
+            # print(f"[NPSManager] Received response: Status Code={response.status_code}") # 注释掉
+            body = self._read_body(response)
+            if body is None:
+                # 保留: 响应体过大错误
+                logger.error("NPS 响应体超过 %s 字节，已丢弃 (Endpoint: %s)", _MAX_RESPONSE_BYTES, endpoint)
+                return None
+            # 如果是 4xx 或 5xx 错误，会抛出异常
+            response.raise_for_status() 
+            
+            content_type = response.headers.get('Content-Type', '')
+            if 'application/json' in content_type:
+                try:
+                    response_json = orjson.loads(body)
+                    # print(f"[NPSManager] Response JSON: {json.dumps(response_json, indent=2, ensure_ascii=False)}") # 注释掉
+                    return response_json
+                except orjson.JSONDecodeError as e:
+                    # 保留: JSON 解析错误
+                    logger.error("解析 NPS 响应 JSON 失败 (Endpoint: %s): %s", endpoint, e)
+                    logger.error("Raw response text: %s...", body[:200].decode('utf-8', 'replace')) # 显示部分原始文本
+                    return {"status": 0, "msg": f"JSON Decode Error: {e}"} 
+            else:
+                # 保留: 非 JSON 响应警告
+                logger.warning("NPS 响应 Content-Type 为 '%s'，不是 JSON (Endpoint: %s).", content_type, endpoint)
+                text = body.decode(response.encoding or 'utf-8', 'replace')
+                # print(f"[NPSManager] Raw response text: {text}") # 注释掉
+                # 尝试解释非 JSON 响应
+                if response.status_code == 200 and ("success" in text.lower() or "任务下发成功" in text): 
+                     # print("[NPSManager] Interpreted non-JSON response as success.") # 注释掉
+                     return {"status": 1, "msg": "Success (interpreted)"} 
                 else:
-                    # 保留: 非 JSON 响应警告
-                    print(f"[NPSManager] Warning: NPS 响应 Content-Type 为 '{content_type}'，不是 JSON (Endpoint: {endpoint}).") 
-                    # print(f"[NPSManager] Raw response text: {response.text}") # 注释掉
-                    # 尝试解释非 JSON 响应
-                    if response.status_code == 200 and ("success" in response.text.lower() or "任务下发成功" in response.text): 
-                         # print("[NPSManager] Interpreted non-JSON response as success.") # 注释掉
-                         return {"status": 1, "msg": "Success (interpreted)"} 
-                    else:
-                         # 保留: 无法解析的非 JSON 响应错误
-                         print(f"[NPSManager] Error: 无法解析的非 JSON 响应或操作失败 (Endpoint: {endpoint}). Response text: {response.text[:100]}...") 
-                         return {"status": 0, "msg": f"Non-JSON response or failure: {response.text[:100]}..."}
-
-            except requests.exceptions.Timeout:
-                # 保留: 超时错误
-                print(f"[NPSManager] Warning: 请求 NPS 超时 (Endpoint: {endpoint}, Timeout={self.timeout}s, Attempt {attempt + 1}/{self.retry_count}).") 
-                if attempt == self.retry_count - 1: 
-                    print(f"[NPSManager] Error: 请求 NPS 超时，已达最大重试次数 (Endpoint: {endpoint}).") 
-                    return None
-                time.sleep(1)
-            except requests.exceptions.HTTPError as e:
-                # 保留: HTTP 错误 (4xx, 5xx)
-                print(f"[NPSManager] Error: NPS 返回 HTTP 错误 (Endpoint: {endpoint}, Status: {response.status_code}, Attempt {attempt + 1}/{self.retry_count}): {e}") 
-                print(f"[NPSManager] Response Body: {response.text[:200]}...") # 显示部分错误响应体
-                if attempt == self.retry_count - 1: 
-                    print(f"[NPSManager] Error: NPS HTTP 错误，已达最大重试次数 (Endpoint: {endpoint}).") 
-                    return None # 返回 None 表示请求彻底失败
-                time.sleep(1) # 重试前等待
-            except requests.exceptions.RequestException as e:
-                # 保留: 其他请求错误 (连接错误等)
-                print(f"[NPSManager] Error: 请求 NPS 失败 (Endpoint: {endpoint}, Attempt {attempt + 1}/{self.retry_count}): {e}") 
-                if attempt == self.retry_count - 1: 
-                    print(f"[NPSManager] Error: 请求 NPS 失败，已达最大重试次数 (Endpoint: {endpoint}): {e}") 
-                    return None
-                time.sleep(1)
-            except Exception as e:
-                # 保留: 未知错误
-                print(f"[NPSManager] Error: 请求 NPS 时发生意外错误 (Endpoint: {endpoint}): {e}") 
-                return None # 意外错误，不重试
+                     # 保留: 无法解析的非 JSON 响应错误
+                     logger.error("无法解析的非 JSON 响应或操作失败 (Endpoint: %s). Response text: %s...", endpoint, text[:100])
+                     return {"status": 0, "msg": f"Non-JSON response or failure: {text[:100]}..."}
+
+        except requests.exceptions.Timeout:
+            # 保留: 超时错误
+            logger.error("请求 NPS 超时，已达最大重试次数 (Endpoint: %s, Timeout=%ss).", endpoint, self.timeout)
+        except requests.exceptions.HTTPError as e:
+            # 保留: HTTP 错误 (4xx, 5xx)
+            logger.error("NPS 返回 HTTP 错误 (Endpoint: %s, Status: %s): %s", endpoint, response.status_code, e)
+            logger.error("Response Body: %s...", body[:200].decode('utf-8', 'replace')) # 显示部分错误响应体
+        except requests.exceptions.RequestException as e:
+            # 保留: 其他请求错误 (连接错误、重试用尽等)
+            logger.error("请求 NPS 失败，已达最大重试次数 (Endpoint: %s): %s", endpoint, e)
+        except Exception as e:
+            # 保留: 未知错误
+            logger.error("请求 NPS 时发生意外错误 (Endpoint: %s): %s", endpoint, e)
                 
-        return None # 所有重试失败
+        return None # 请求彻底失败
     
+    def _cached_get(self, endpoint: str, params: Dict, use_cache: bool = True) -> Optional[Dict]:
+        """带 TTL 缓存的 GET 查询，只缓存成功的响应"""
+        if not use_cache or self._cache_ttl <= 0:
+            return self._send_request(endpoint, data=params, method='GET')
+        key = (endpoint, frozenset(params.items()))
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                if time.monotonic() - cached[0] < self._cache_ttl:
+                    self._cache.move_to_end(key)
+                    return cached[1]
+                del self._cache[key]
+        fetched_at = time.monotonic()
+        response = self._send_request(endpoint, data=params, method='GET')
+        if response is not None:
+            with self._cache_lock:
+                self._cache[key] = (fetched_at, response)
+                self._cache.move_to_end(key)
+                if len(self._cache) > _READ_CACHE_MAX:
+                    self._cache.popitem(last=False)
+        return response
+
+    def invalidate_cache(self):
+        """清空只读查询缓存 (修改操作成功后自动调用)"""
+        with self._cache_lock:
+            self._cache.clear()
+
+    def _status_ok(self, response: Optional[Dict], quiet: bool, action: str, detail_fmt: str, *detail_args) -> bool:
+        """
+        检查修改类操作的响应，成功时清空查询缓存
+
+        参数:
+            quiet: 为 True 时不记录成功信息 (失败信息始终记录)
+            action / detail_fmt / detail_args: 用于拼接日志的操作名称和 %-格式的详情，只在对应日志级别启用时才格式化
+        """
+        if response and response.get('status') == 1:
+            self.invalidate_cache()
+            if not quiet and logger.isEnabledFor(logging.INFO):
+                # 保留: 操作成功信息
+                logger.info("%s成功: %s", action, detail_fmt % detail_args)
+            return True
+        if logger.isEnabledFor(logging.ERROR):
+            error_msg = response.get('msg', 'Unknown error') if response else 'Request failed or no response'
+            # 保留: 操作失败信息
+            logger.error("%s失败: %s, 原因: %s", action, detail_fmt % detail_args, error_msg)
+        return False
+
+    @staticmethod
+    def _read_body(response) -> Optional[bytes]:
+        """分块读取响应体，超过 _MAX_RESPONSE_BYTES 时关闭连接并返回 None"""
+        chunks = []
+        size = 0
+        for chunk in response.iter_content(chunk_size=65536):
+            size += len(chunk)
+            if size > _MAX_RESPONSE_BYTES:
+                response.close()
+                return None
+            chunks.append(chunk)
+        return b"".join(chunks)
+
     # 客户端管理
-    def list_clients(self, search="", order="", offset=0, limit=10) -> Optional[Dict]:
-        """获取客户端列表 (使用 GET)"""
+    def list_clients(self, search="", order="", offset=0, limit=10, use_cache: bool = True) -> Optional[Dict]:
+        """获取客户端列表 (使用 GET)，use_cache=False 时跳过缓存直接查询"""
         endpoint = 'client/list'
         params = {
             "searchkey": search,
@@ -243,11 +417,11 @@ class NPSManager:
             "limit": limit
         }
         # print(f"[NPSManager] Preparing to list clients with params: {params}") # 注释掉
-        response = self._send_request(endpoint, data=params, method='GET')
+        response = self._cached_get(endpoint, params, use_cache)
         # 调用方处理响应
         return response
     
-    def add_client(self, remark, vkey, **kwargs) -> bool:
+    def add_client(self, remark, vkey, quiet: bool = False, **kwargs) -> bool:
         """添加客户端 (使用 POST)"""
         endpoint = 'client/add'
         params = {
@@ -265,35 +439,19 @@ class NPSManager:
         }
         # print(f"[NPSManager] Preparing to add client with data: {params}") # 注释掉
         response = self._send_request(endpoint, data=params, method='POST')
-        success = response is not None and response.get('status') == 1
-        if success:
-             # 保留: 操作成功信息
-             print(f"[NPSManager] 客户端添加成功: 备注='{remark}'") 
-        else:
-             error_msg = response.get('msg', 'Unknown error') if response else 'Request failed or no response'
-             # 保留: 操作失败信息
-             print(f"[NPSManager] Error: 添加客户端失败: {error_msg}") 
-        return success
+        return self._status_ok(response, quiet, "添加客户端", "备注='%s'", remark)
     
-    def delete_client(self, client_id) -> bool:
+    def delete_client(self, client_id, quiet: bool = False) -> bool:
         """删除客户端 (使用 POST)"""
         endpoint = 'client/del'
         params = {"id": client_id}
         # print(f"[NPSManager] Preparing to delete client {client_id}") # 注释掉
         response = self._send_request(endpoint, data=params, method='POST')
-        success = response is not None and response.get('status') == 1
-        if success:
-             # 保留: 操作成功信息
-             print(f"[NPSManager] 客户端删除成功: ID={client_id}") 
-        else:
-             error_msg = response.get('msg', 'Unknown error') if response else 'Request failed or no response'
-             # 保留: 操作失败信息
-             print(f"[NPSManager] Error: 删除客户端失败: ID={client_id}, 原因: {error_msg}") 
-        return success
+        return self._status_ok(response, quiet, "删除客户端", "ID=%s", client_id)
     
     # 隧道管理
-    def list_tunnels(self, client_id: str = '', tunnel_type: str = '', search: str = '', offset: int = 0, limit: int = 100) -> Optional[Dict]:
-        """获取隧道列表 (使用 GET)"""
+    def list_tunnels(self, client_id: str = '', tunnel_type: str = '', search: str = '', offset: int = 0, limit: int = 100, use_cache: bool = True) -> Optional[Dict]:
+        """获取隧道列表 (使用 GET)，use_cache=False 时跳过缓存直接查询"""
         endpoint = 'index/gettunnel'
         params = {
             'client_id': client_id,
@@ -303,19 +461,19 @@ class NPSManager:
             'limit': limit
         }
         # print(f"[NPSManager] Preparing to list tunnels with params: {params}") # 注释掉
-        response = self._send_request(endpoint, data=params, method='GET')
+        response = self._cached_get(endpoint, params, use_cache)
         return response
     
-    def get_tunnel(self, tunnel_id) -> Optional[Dict]:
-        """获取单条隧道信息 (使用 GET)"""
+    def get_tunnel(self, tunnel_id, use_cache: bool = True) -> Optional[Dict]:
+        """获取单条隧道信息 (使用 GET)，use_cache=False 时跳过缓存直接查询"""
         endpoint = 'index/getonetunnel'
         params = {"id": tunnel_id}
         # print(f"[NPSManager] Preparing to get tunnel {tunnel_id}") # 注释掉
-        response = self._send_request(endpoint, data=params, method='GET')
+        response = self._cached_get(endpoint, params, use_cache)
         return response
     
-    def add_tunnel(self, client_id: int, tunnel_type: str, port: int, target: str, remark: str = '', **kwargs) -> bool:
-        """添加隧道 (使用 POST)"""
+    def add_tunnel(self, client_id: int, tunnel_type: str, port: int, target: str, remark: str = '', quiet: bool = False, **kwargs) -> Union[int, bool]:
+        """添加隧道 (使用 POST)，NPS 响应中带有新隧道 ID 时返回该 ID，否则返回是否成功"""
         endpoint = 'index/add' 
         data = {
             'type': tunnel_type, 
@@ -331,17 +489,48 @@ class NPSManager:
         # print(f"[NPSManager] Preparing to add tunnel with data: {data}") # 注释掉
         response = self._send_request(endpoint, data=data, method='POST')
         
-        success = response is not None and response.get('status') == 1
-        if success:
-            # 保留: 操作成功信息
-            print(f"[NPSManager] 隧道添加成功: Port={port}, Target={target}, Remark='{remark}'") 
-        else:
-            error_msg = response.get('msg', 'Unknown error') if response else 'Request failed or no response'
-            # 保留: 操作失败信息
-            print(f"[NPSManager] Error: 添加隧道失败: Port={port}, Target={target}, 原因: {error_msg}") 
-        return success
+        if not self._status_ok(response, quiet, "添加隧道", "Port=%s, Target=%s, Remark='%s'", port, target, remark):
+            return False
+        # 部分 NPS 版本会在响应中返回新隧道的 ID，可省去之后按备注/端口查找的列表请求
+        data = response.get('data')
+        tunnel_id = response.get('id') or (data.get('Id') if isinstance(data, dict) else None)
+        if tunnel_id:
+            tunnel_id = int(tunnel_id)
+            if remark:
+                self._remember_remark(remark, tunnel_id)
+            return tunnel_id
+        return True
+
+    def _remember_remark(self, remark: str, tunnel_id: int):
+        """记录 备注 -> 隧道ID，超出上限时淘汰最早的记录"""
+        with self._cache_lock:
+            self._remark_ids[remark] = tunnel_id
+            self._remark_ids.move_to_end(remark)
+            if len(self._remark_ids) > _REMARK_ID_MAX:
+                self._remark_ids.popitem(last=False)
+
+    def resolve_id_by_remark(self, remark: str, client_id='') -> Optional[int]:
+        """
+        按备注查找隧道 ID：先查最近添加的记录，找不到再查询 NPS 隧道列表
+
+        返回:
+            隧道 ID，未找到返回 None
+        """
+        with self._cache_lock:
+            tunnel_id = self._remark_ids.get(remark)
+        if tunnel_id is not None:
+            return tunnel_id
+        tunnels = self.list_tunnels(client_id=client_id, search=remark, use_cache=False)
+        if not tunnels:
+            return None
+        for row in tunnels.get('rows') or []:
+            # searchkey 是模糊匹配，这里要求备注完全一致
+            if row.get('Remark') == remark and row.get('Id'):
+                self._remember_remark(remark, row['Id'])
+                return row['Id']
+        return None
     
-    def update_tunnel(self, tunnel_id, **kwargs) -> bool:
+    def update_tunnel(self, tunnel_id, quiet: bool = False, **kwargs) -> bool:
         """更新隧道 (使用 POST)"""
         endpoint = 'index/edit'
         # 确保 id 在参数中
@@ -353,64 +542,141 @@ class NPSManager:
         # print(f"[NPSManager] Preparing to update tunnel {tunnel_id} with data: {data_to_send}") # 注释掉
         response = self._send_request(endpoint, data=data_to_send, method='POST')
         
-        success = response is not None and response.get('status') == 1
-        if success:
-            # 保留: 操作成功信息
-            print(f"[NPSManager] 隧道更新成功: ID={tunnel_id}") 
-        else:
-            error_msg = response.get('msg', 'Unknown error') if response else 'Request failed or no response'
-            # 保留: 操作失败信息
-            print(f"[NPSManager] Error: 更新隧道失败: ID={tunnel_id}, 原因: {error_msg}") 
-        return success
+        return self._status_ok(response, quiet, "更新隧道", "ID=%s", tunnel_id)
     
-    def delete_tunnel(self, tunnel_id) -> bool:
+    def delete_tunnel(self, tunnel_id, quiet: bool = False) -> bool:
         """删除隧道 (使用 POST)"""
         endpoint = 'index/del'
         params = {"id": tunnel_id}
         # print(f"[NPSManager] Preparing to delete tunnel {tunnel_id}") # 注释掉
         response = self._send_request(endpoint, data=params, method='POST')
-        success = response is not None and response.get('status') == 1
-        if success:
-             # 保留: 操作成功信息
-             print(f"[NPSManager] 隧道删除成功: ID={tunnel_id}") 
-        else:
-             error_msg = response.get('msg', 'Unknown error') if response else 'Request failed or no response'
-             # 保留: 操作失败信息
-             print(f"[NPSManager] Error: 删除隧道失败: ID={tunnel_id}, 原因: {error_msg}") 
-        return success
+        if not self._status_ok(response, quiet, "删除隧道", "ID=%s", tunnel_id):
+            return False
+        with self._cache_lock:
+            for remark in [r for r, i in self._remark_ids.items() if i == tunnel_id]:
+                del self._remark_ids[remark]
+        return True
     
-    def start_tunnel(self, tunnel_id) -> bool:
+    def start_tunnel(self, tunnel_id, quiet: bool = False) -> bool:
         """启动隧道 (使用 POST)"""
         endpoint = 'index/start'
         params = {"id": tunnel_id}
         # print(f"[NPSManager] Preparing to start tunnel {tunnel_id}") # 注释掉
         response = self._send_request(endpoint, data=params, method='POST')
-        success = response is not None and response.get('status') == 1
-        if success:
-             # 保留: 操作成功信息
-             print(f"[NPSManager] 隧道启动成功: ID={tunnel_id}") 
-        else:
-             error_msg = response.get('msg', 'Unknown error') if response else 'Request failed or no response'
-             # 保留: 操作失败信息
-             print(f"[NPSManager] Error: 启动隧道失败: ID={tunnel_id}, 原因: {error_msg}") 
-        return success
+        return self._status_ok(response, quiet, "启动隧道", "ID=%s", tunnel_id)
     
-    def stop_tunnel(self, tunnel_id) -> bool:
+    def stop_tunnel(self, tunnel_id, quiet: bool = False) -> bool:
         """停止隧道 (使用 POST)"""
         endpoint = 'index/stop'
         params = {"id": tunnel_id}
         # print(f"[NPSManager] Preparing to stop tunnel {tunnel_id}") # 注释掉
         response = self._send_request(endpoint, data=params, method='POST')
-        success = response is not None and response.get('status') == 1
-        if success:
-             # 保留: 操作成功信息
-             print(f"[NPSManager] 隧道停止成功: ID={tunnel_id}") 
-        else:
-             error_msg = response.get('msg', 'Unknown error') if response else 'Request failed or no response'
-             # 保留: 操作失败信息
-             print(f"[NPSManager] Error: 停止隧道失败: ID={tunnel_id}, 原因: {error_msg}") 
-        return success
+        return self._status_ok(response, quiet, "停止隧道", "ID=%s", tunnel_id)
     
+    def bulk(self, calls: Iterable[Tuple[str, tuple, dict]], max_workers: int = None) -> List[Any]:
+        """
+        并发执行一批 API 调用（共享同一个连接池化的 Session）
+
+        参数:
+            calls: (方法名, 位置参数, 关键字参数) 列表，如 [("get_tunnel", (5,), {}), ("stop_tunnel", (6,), {})]
+            max_workers: 最大并发数；为 None 时使用常驻线程池 (大小为 api.pool_size)，
+                         避免每批调用都重新创建线程
+
+        返回:
+            与 calls 顺序一致的各调用返回值
+        """
+        calls = list(calls)
+        if not calls:
+            return []
+        if max_workers is None:
+            executor = self._get_executor()
+            futures = [executor.submit(getattr(self, name), *args, **kwargs) for name, args, kwargs in calls]
+            return [future.result() for future in futures]
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(calls))) as executor:
+            futures = [executor.submit(getattr(self, name), *args, **kwargs) for name, args, kwargs in calls]
+            return [future.result() for future in futures]
+
+    def batch(self, ops: List[Dict], max_workers: int = None) -> List[Optional[Dict]]:
+        """
+        批量执行多个原始 API 操作，配置了 api.batch_endpoint 时合并为一次 POST
+
+        参数:
+            ops: 操作列表，如 [{"endpoint": "index/edit", "data": {...}, "method": "POST"}, ...]，method 默认为 POST
+            max_workers: 回退为逐个请求时的最大并发数，含义同 bulk()
+
+        返回:
+            与 ops 顺序一致的各操作响应 (失败项为 None)
+        """
+        ops = list(ops)
+        if not ops:
+            return []
+        # 含修改类操作时，无论成败都要清空查询缓存 (服务器可能已执行部分操作)
+        has_write = any(op.get("method", "POST").upper() != "GET" for op in ops)
+        try:
+            if self.batch_endpoint:
+                results = self._send_batch(ops)
+                if results is not _BATCH_UNAVAILABLE:
+                    return results
+            # NPS 未提供批量接口时，在同一连接池上并发发送各个请求
+            return self.bulk(
+                [("_send_request", (op["endpoint"],), {"data": op.get("data"), "method": op.get("method", "POST")}) for op in ops],
+                max_workers=max_workers
+            )
+        finally:
+            if has_write:
+                self.invalidate_cache()
+
+    def _send_batch(self, ops: List[Dict]):
+        """
+        通过 batch_endpoint 一次提交所有操作
+
+        返回:
+            各操作的响应列表；确定请求未到达服务器 (连接未建立、接口不存在) 时返回 _BATCH_UNAVAILABLE，
+            调用方可安全回退为逐个请求；其余失败可能已被服务器执行，不能重发，各操作结果均为 None
+        """
+        failed = [None] * len(ops)
+        timestamp, sign = self._auth_sign()
+        try:
+            # Session 的重试策略对 POST 只重试连接建立阶段，批量请求发出后不会被重发
+            response = self.session.post(
+                f"{self.server_url}/{self.batch_endpoint}",
+                params={'auth_key': sign, 'timestamp': timestamp},
+                json=ops,
+                timeout=self.timeout,
+                stream=True
+            )
+            if response.status_code in (404, 405):
+                response.close()
+                # 保留: 批量接口不可用警告
+                logger.warning("批量接口不可用 (HTTP %s)，回退为逐个请求 (Endpoint: %s)", response.status_code, self.batch_endpoint)
+                return _BATCH_UNAVAILABLE
+            body = self._read_body(response)
+            if body is None:
+                # 保留: 响应体过大错误
+                logger.error("NPS 响应体超过 %s 字节，已丢弃 (Endpoint: %s)", _MAX_RESPONSE_BYTES, self.batch_endpoint)
+                return failed
+            response.raise_for_status()
+            results = orjson.loads(body)
+        except requests.exceptions.ConnectionError as e:
+            # 只有连接未建立时才能确定请求未发出；读超时、连接中途断开等同样表现为 ConnectionError，
+            # 此时服务器可能已收到并执行了批量操作
+            if not _is_connect_failure(e):
+                # 保留: 批量请求失败错误
+                logger.error("批量接口请求失败，服务器可能已执行部分操作，不再重发 (Endpoint: %s): %s", self.batch_endpoint, e)
+                return failed
+            # 保留: 批量接口连接失败警告
+            logger.warning("批量接口连接失败，回退为逐个请求 (Endpoint: %s): %s", self.batch_endpoint, e)
+            return _BATCH_UNAVAILABLE
+        except Exception as e:
+            # 保留: 批量请求失败错误
+            logger.error("批量接口请求失败，服务器可能已执行部分操作，不再重发 (Endpoint: %s): %s", self.batch_endpoint, e)
+            return failed
+        if isinstance(results, list) and len(results) == len(ops):
+            return results
+        # 保留: 批量接口响应格式不符错误
+        logger.error("批量接口返回格式不符，服务器可能已执行部分操作，不再重发 (Endpoint: %s)", self.batch_endpoint)
+        return failed
+
     @classmethod
     def create_default_config(cls, config_path="config/nps_config.json", overwrite=False):
         """
@@ -425,7 +691,7 @@ class NPSManager:
         """
         if os.path.exists(config_path) and not overwrite:
             # 保留: 文件已存在信息
-            print(f"NPS 配置文件 {config_path} 已存在，跳过创建。") 
+            logger.info("NPS 配置文件 %s 已存在，跳过创建。", config_path)
             return False
             
         # 确保目录存在
@@ -433,7 +699,7 @@ class NPSManager:
              os.makedirs(os.path.dirname(config_path), exist_ok=True)
         except Exception as e:
              # 保留: 目录创建失败错误
-             print(f"创建配置目录失败 ({os.path.dirname(config_path)}): {e}") 
+             logger.error("创建配置目录失败 (%s): %s", os.path.dirname(config_path), e)
              return False
         
         # 创建默认配置
@@ -450,7 +716,10 @@ class NPSManager:
             },
             "api": {
                 "timeout": 10,
-                "retry_count": 3
+                "retry_count": 3,
+                "pool_size": 16,
+                "batch_endpoint": "",
+                "cache_ttl": 2.0
             },
             "nps_version_compatibility": {
                 "post_content_type": "application/x-www-form-urlencoded"
@@ -458,19 +727,84 @@ class NPSManager:
         }
         
         try:
-            with open(config_path, 'w', encoding='utf-8') as f:
-                json.dump(default_config, f, indent=4, ensure_ascii=False)
+            with open(config_path, 'wb') as f:
+                f.write(orjson.dumps(default_config, option=orjson.OPT_INDENT_2))
             # 保留: 文件创建成功信息
-            print(f"已创建默认 NPS 配置文件: {config_path}，请修改 auth.key") 
+            logger.info("已创建默认 NPS 配置文件: %s，请修改 auth.key", config_path)
             return True
         except Exception as e:
             # 保留: 文件创建失败错误
-            print(f"创建 NPS 配置文件失败 ({config_path}): {e}") 
+            logger.error("创建 NPS 配置文件失败 (%s): %s", config_path, e)
             return False
 
 
+class AsyncNPSManager:
+    """
+    NPSManager 的异步版本，供 asyncio 代码并发调用 NPS API:
+
+        async with AsyncNPSManager() as nps:
+            results = await asyncio.gather(*[nps.get_tunnel(i) for i in ids])
+
+    内部复用同步 NPSManager（共享同一个连接池化的 Session），每个调用在独立线程中执行，
+    不引入额外的 HTTP 客户端依赖。参数与返回值与 NPSManager 的同名方法一致。
+    """
+
+    def __init__(self, *args, max_workers: int = None, **kwargs):
+        self.nps = NPSManager(*args, **kwargs)
+        self.config = self.nps.config
+        # 并发数与 Session 连接池大小一致，避免线程在连接池上排队
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or self.config["api"].get("pool_size", 16),
+                                            thread_name_prefix="nps-async")
+
+    async def _run(self, method, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(method, *args, **kwargs))
+
+    async def list_clients(self, *args, **kwargs) -> Optional[Dict]:
+        return await self._run(self.nps.list_clients, *args, **kwargs)
+
+    async def add_client(self, *args, **kwargs) -> bool:
+        return await self._run(self.nps.add_client, *args, **kwargs)
+
+    async def delete_client(self, *args, **kwargs) -> bool:
+        return await self._run(self.nps.delete_client, *args, **kwargs)
+
+    async def list_tunnels(self, *args, **kwargs) -> Optional[Dict]:
+        return await self._run(self.nps.list_tunnels, *args, **kwargs)
+
+    async def get_tunnel(self, *args, **kwargs) -> Optional[Dict]:
+        return await self._run(self.nps.get_tunnel, *args, **kwargs)
+
+    async def add_tunnel(self, *args, **kwargs) -> Union[int, bool]:
+        return await self._run(self.nps.add_tunnel, *args, **kwargs)
+
+    async def update_tunnel(self, *args, **kwargs) -> bool:
+        return await self._run(self.nps.update_tunnel, *args, **kwargs)
+
+    async def delete_tunnel(self, *args, **kwargs) -> bool:
+        return await self._run(self.nps.delete_tunnel, *args, **kwargs)
+
+    async def start_tunnel(self, *args, **kwargs) -> bool:
+        return await self._run(self.nps.start_tunnel, *args, **kwargs)
+
+    async def stop_tunnel(self, *args, **kwargs) -> bool:
+        return await self._run(self.nps.stop_tunnel, *args, **kwargs)
+
+    def close(self):
+        """等待进行中的请求结束并关闭 Session"""
+        self._executor.shutdown(wait=True)
+        self.nps.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+
 # 测试代码
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(name)s] %(levelname)s: %(message)s")
     # 确保测试前 config 目录存在
     if not os.path.exists("config"):
          os.makedirs("config")
@@ -531,11 +865,14 @@ if __name__ == "__main__":
     )
     
     if add_success:
-        # 为了获取 ID，需要重新列出隧道并查找
-        time.sleep(1) # 等待 NPS 更新
-        tunnels = nps.list_tunnels(client_id=client_id_to_use, search=tunnel_remark)
-        if tunnels and 'rows' in tunnels and len(tunnels['rows']) > 0:
-            test_tunnel_id = tunnels['rows'][0]['Id']
+        if add_success is not True:
+            # NPS 响应中直接带回了 ID
+            test_tunnel_id = add_success
+        else:
+            # 为了获取 ID，需要重新列出隧道并查找
+            time.sleep(1) # 等待 NPS 更新
+            test_tunnel_id = nps.resolve_id_by_remark(tunnel_remark, client_id=client_id_to_use)
+        if test_tunnel_id:
             print(f"  隧道添加成功，获取到 ID: {test_tunnel_id}")
         else:
             print(f"  隧道可能已添加，但无法通过备注 '{tunnel_remark}' 找回 ID")
@@ -11,13 +11,165 @@ Port Manager - 动态端口管理工具
 可以与NPSManager配合使用，实现动态端口映射管理。
 """
 
+import atexit
+import heapq
+import logging
 import os
-import json
+import orjson
 import random
 import threading
-from typing import List, Dict, Optional, Tuple, Set
+from typing import List, Dict, FrozenSet, Optional, Tuple, Set
 import time
 
+from state_io import atomic_write
+
+logger = logging.getLogger(__name__)
+
+
+class _ReadLock:
+    """_RWLock 的读锁视图，用于 with 语句"""
+    __slots__ = ('_rw',)
+
+    def __init__(self, rw):
+        self._rw = rw
+
+    def __enter__(self):
+        self._rw.acquire_read()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._rw.release_read()
+
+
+class _RWLock:
+    """
+    读写锁：多个读者可以并发持有，写者独占
+    
+    - `with lock:` 获取写锁，`with lock.reader:` 获取读锁
+    - 写锁可重入，持有写锁的线程也可以再获取读锁 (与原 RLock 的嵌套调用方式兼容)
+    - 读锁在同一线程内可嵌套；但持有读锁时不能再获取写锁
+    - 有写者等待时新的读者会等待，避免写者饿死
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._writer_depth = 0
+        self._writers_waiting = 0
+        self._local = threading.local()
+        self.reader = _ReadLock(self)
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        depth = getattr(self._local, 'depth', 0)
+        if depth or self._writer == me:
+            # 线程已持有读锁或写锁，直接嵌套
+            self._local.depth = depth + 1
+            return
+        with self._cond:
+            while self._writer is not None or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        self._local.depth = 1
+
+    def release_read(self):
+        depth = self._local.depth - 1
+        self._local.depth = depth
+        if depth or self._writer == threading.get_ident():
+            return
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth += 1
+                return
+            self._writers_waiting += 1
+            while self._writer is not None or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = me
+            self._writer_depth = 1
+
+    def release(self):
+        with self._cond:
+            self._writer_depth -= 1
+            if not self._writer_depth:
+                self._writer = None
+                self._cond.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class _PortPool:
+    """端口集合：列表用于 O(1) 随机抽取，字典记录端口在列表中的下标，增删均为 O(1)
+
+    顺序分配需要的最小值由惰性删除的最小堆提供：首次调用 min() 时才建堆，
+    discard 不修改堆，过期端口在到达堆顶时再弹出
+    """
+    __slots__ = ('_list', '_pos', '_heap')
+
+    def __init__(self, ports=()):
+        self._list = list(ports)
+        self._pos = {port: i for i, port in enumerate(self._list)}
+        self._heap = None
+
+    def __len__(self):
+        return len(self._list)
+
+    def __contains__(self, port):
+        return port in self._pos
+
+    def __iter__(self):
+        return iter(self._list)
+
+    def add(self, port: int):
+        if port not in self._pos:
+            self._pos[port] = len(self._list)
+            self._list.append(port)
+            if self._heap is not None:
+                # 过期条目过多时重建，避免堆无限增长
+                if len(self._heap) > 2 * len(self._list) + 64:
+                    self._heap = None
+                else:
+                    heapq.heappush(self._heap, port)
+
+    def discard(self, port: int):
+        i = self._pos.pop(port, None)
+        if i is None:
+            return
+        # 用列表末尾的端口填补空位
+        last = self._list.pop()
+        if last != port:
+            self._list[i] = last
+            self._pos[last] = i
+
+    def choice(self) -> int:
+        return random.choice(self._list)
+
+    def min(self) -> int:
+        heap = self._heap
+        if heap is None:
+            heap = self._heap = list(self._list)
+            heapq.heapify(heap)
+        while heap[0] not in self._pos:
+            heapq.heappop(heap)
+        return heap[0]
+
+    def sorted(self) -> List[int]:
+        return sorted(self._list)
+
+
 class PortManager:
     def __init__(self, config_file=None):
         """
@@ -40,7 +192,10 @@ class PortManager:
             "persistence": {
                 "file": "state/port_allocation.json",  # 确认路径在 config.json 中正确配置
                 "auto_save": True,        # 是否自动保存
-                "save_interval": 300      # 自动保存间隔(秒)
+                "save_interval": 300,     # 自动保存间隔(秒)
+                "flush_delay": 1.0,       # 分配/释放后延迟写盘的秒数，期间的多次修改合并为一次写入
+                "sync_on_release": False, # 释放端口后是否立即写盘
+                "fsync": False            # 写盘后是否 fsync，断电时也不丢失最近的修改
             }
         }
         
@@ -58,20 +213,46 @@ class PortManager:
                     
         if config_file and os.path.exists(config_file):
             try:
-                with open(config_file, 'r', encoding='utf-8') as f:
-                    file_config = json.load(f)
+                with open(config_file, 'rb') as f:
+                    file_config = orjson.loads(f.read())
                     # 使用文件配置更新默认配置
                     self._update_nested_dict(self.config, file_config)
-                    print(f"已从 {config_file} 加载端口配置")
+                    logger.info("已从 %s 加载端口配置", config_file)
             except Exception as e:
-                print(f"加载端口配置文件出错: {e}")
+                logger.error("加载端口配置文件出错 (%s): %s", config_file, e)
+        
+        # 热路径上使用的配置项在初始化时取出，避免每次分配/检查都逐层查字典
+        self._range_start = self.config["port_range"]["start"]
+        self._range_end = self.config["port_range"]["end"]
+        self._reserved = frozenset(self.config["reserved_ports"])
+        self._persistence_file = self.config["persistence"]["file"]
+        self._strategy = self.config["allocation"]["strategy"]
         
         # 初始化端口池状态
-        self.allocated_ports = {}  # {port: {"service": "ssh", "allocated_time": timestamp, "client_id": 1}}
-        self.port_lock = threading.RLock()
+        self.allocated_ports = {}  # {port(int): {"service": "ssh", "allocated_time": timestamp, "client_id": 1}}，仅在读写文件时转换为字符串键
+        # 查询方法取读锁可并发执行，分配/释放/保存取写锁
+        self.port_lock = _RWLock()
+        # 有未写盘的修改时置位，由自动保存线程合并写入
+        self._dirty = threading.Event()
+        # 调用 close() 后置位，通知自动保存线程退出
+        self._shutdown = threading.Event()
+        # 串行化状态文件的写入
+        self._file_lock = threading.Lock()
+        self.save_thread = None
+        
+        # 可用端口池，分配/释放时增量维护
+        self._available = _PortPool()
+        # 配置了 prefer_ranges 时每个优先区间各自维护可用端口: [(start, end, _PortPool)]
+        self._prefer_pools: List[Tuple[int, int, _PortPool]] = []
+        # 二级索引：服务名/客户端ID -> 端口集合，按服务/客户端释放和统计时无需扫描全部端口
+        self._by_service: Dict[str, Set[int]] = {}
+        self._by_client: Dict[object, Set[int]] = {}
+        # 每条分配记录序列化后的 JSON 片段，记录在分配期间不变，保存时直接拼接
+        self._entry_cache: Dict[int, bytes] = {}
         
         # 加载已分配的端口
         self._load_allocated_ports()
+        self._rebuild_available()
         
         # 自动保存线程
         if self.config["persistence"]["auto_save"]:
@@ -79,87 +260,190 @@ class PortManager:
             if interval > 0:
                 self.save_thread = threading.Thread(target=self._auto_save_thread, args=(interval,), daemon=True)
                 self.save_thread.start()
-                print(f"端口自动保存已启用，间隔: {interval} 秒")
+                # 退出前写入尚未落盘的修改
+                atexit.register(self.flush)
+                logger.info("端口自动保存已启用，间隔: %s 秒", interval)
             else:
-                 print("端口自动保存已禁用 (save_interval <= 0)")
+                 logger.info("端口自动保存已禁用 (save_interval <= 0)")
         else:
-             print("端口自动保存已禁用 (auto_save=False)")
+             logger.info("端口自动保存已禁用 (auto_save=False)")
         
-        print(f"端口管理器初始化完成，可用端口范围: {self.config['port_range']['start']}-{self.config['port_range']['end']}")
+        logger.info("端口管理器初始化完成，可用端口范围: %s-%s", self._range_start, self._range_end)
     
+    @staticmethod
+    def set_log_level(level):
+        """设置 port_manager 模块的日志级别，如 logging.DEBUG 可输出每次分配/释放的日志"""
+        logger.setLevel(level)
+
     def _update_nested_dict(self, d, u):
-        """递归更新嵌套字典"""
+        """递归更新嵌套字典（原地修改 d）"""
         for k, v in u.items():
-            if isinstance(v, dict):
-                # 确保目标也是字典
-                current_val = d.get(k, {})
-                if not isinstance(current_val, dict):
-                    current_val = {}
-                d[k] = self._update_nested_dict(current_val, v)
+            # 目标已是字典时直接原地合并，不再构造临时字典
+            if isinstance(v, dict) and isinstance(d.get(k), dict):
+                self._update_nested_dict(d[k], v)
             else:
                 d[k] = v
-        return d
     
     def _load_allocated_ports(self):
         """加载已分配的端口数据"""
-        persistence_file = self.config["persistence"]["file"]
+        persistence_file = self._persistence_file
         if os.path.exists(persistence_file):
             try:
-                with open(persistence_file, 'r', encoding='utf-8') as f:
-                    loaded_data = json.load(f)
+                with open(persistence_file, 'rb') as f:
+                    loaded_data = orjson.loads(f.read())
                     if isinstance(loaded_data, dict):
-                         self.allocated_ports = loaded_data
-                         print(f"从 {persistence_file} 加载了 {len(self.allocated_ports)} 个已分配端口")
+                         # JSON 对象的键一定是字符串，直接 isdigit() 过滤后一次性转换为整数键
+                         self.allocated_ports = {int(k): v for k, v in loaded_data.items() if k.isdigit()}
+                         if len(self.allocated_ports) != len(loaded_data):
+                             logger.warning("忽略了 %d 个无效端口格式的记录", len(loaded_data) - len(self.allocated_ports))
+                         logger.info("从 %s 加载了 %d 个已分配端口", persistence_file, len(self.allocated_ports))
                     else:
-                         print(f"加载端口分配数据格式错误，文件内容不是字典: {persistence_file}")
+                         logger.error("加载端口分配数据格式错误，文件内容不是字典: %s", persistence_file)
                          self.allocated_ports = {}
-            except json.JSONDecodeError as e:
-                print(f"加载端口分配数据失败 (JSON 解析错误): {e} 文件: {persistence_file}")
+            except orjson.JSONDecodeError as e:
+                logger.error("加载端口分配数据失败 (JSON 解析错误): %s 文件: %s", e, persistence_file)
                 self.allocated_ports = {}
             except Exception as e:
-                print(f"加载端口分配数据失败: {e} 文件: {persistence_file}")
+                logger.error("加载端口分配数据失败: %s 文件: %s", e, persistence_file)
                 self.allocated_ports = {}
         else:
-             print(f"端口分配文件 {persistence_file} 不存在，初始化为空。")
+             logger.info("端口分配文件 %s 不存在，初始化为空。", persistence_file)
              self.allocated_ports = {}
     
+    def _rebuild_available(self):
+        """根据端口范围、保留端口和已分配端口重建可用端口池"""
+        with self.port_lock:
+            all_ports = set(range(self._range_start, self._range_end + 1))
+            available = sorted(all_ports - self._reserved - self.allocated_ports.keys())
+            self._available = _PortPool(available)
+            self._prefer_pools = []
+            for range_info in self.config["allocation"].get("prefer_ranges", []):
+                if isinstance(range_info, dict) and "start" in range_info and "end" in range_info:
+                    start, end = range_info["start"], range_info["end"]
+                    self._prefer_pools.append((start, end, _PortPool(p for p in available if start <= p <= end)))
+            self._by_service = {}
+            self._by_client = {}
+            self._entry_cache = {}
+            for port, info in self.allocated_ports.items():
+                self._index_add(port, info)
+
+    def _index_add(self, port: int, info):
+        """将端口加入服务/客户端索引并缓存其 JSON 片段 (需要在持有写锁的情况下调用)"""
+        self._entry_cache[port] = orjson.dumps(info)
+        if isinstance(info, dict):
+            self._by_service.setdefault(info.get("service"), set()).add(port)
+            self._by_client.setdefault(info.get("client_id"), set()).add(port)
+
+    def _index_remove(self, port: int, info):
+        """将端口移出服务/客户端索引和 JSON 片段缓存 (需要在持有写锁的情况下调用)"""
+        self._entry_cache.pop(port, None)
+        if not isinstance(info, dict):
+            return
+        for index, key in ((self._by_service, info.get("service")), (self._by_client, info.get("client_id"))):
+            ports = index.get(key)
+            if ports is not None:
+                ports.discard(port)
+                if not ports:
+                    del index[key]
+
+    def _available_discard(self, port: int):
+        """从可用端口池中移除端口 (需要在持有写锁的情况下调用)"""
+        if port not in self._available:
+            return
+        self._available.discard(port)
+        for start, end, pool in self._prefer_pools:
+            if start <= port <= end:
+                pool.discard(port)
+
+    def _available_add(self, port: int):
+        """端口释放后放回可用端口池 (需要在持有写锁的情况下调用)"""
+        if port in self._available:
+            return
+        if not (self._range_start <= port <= self._range_end):
+            return
+        if port in self._reserved:
+            return
+        self._available.add(port)
+        for start, end, pool in self._prefer_pools:
+            if start <= port <= end:
+                pool.add(port)
+
     def save_allocated_ports(self):
         """保存已分配的端口数据"""
-        persistence_file = self.config["persistence"]["file"]
-        with self.port_lock:
+        persistence_file = self._persistence_file
+        # 锁顺序固定为先文件锁后端口锁：文件锁保证快照按顺序落盘，
+        # 端口锁只以读方式持有并且只用于序列化，写盘期间不阻塞分配/释放
+        with self._file_lock:
+            with self.port_lock.reader:
+                self._dirty.clear()
+                # 拼接缓存的记录片段，只有变更过的记录才需要重新序列化；每条记录占一行
+                if self._entry_cache:
+                    data = b"{\n" + b",\n".join(b'  "%d": %s' % item for item in self._entry_cache.items()) + b"\n}"
+                else:
+                    data = b"{}"
             try:
                 dir_path = os.path.dirname(persistence_file)
                 if dir_path:
                      os.makedirs(dir_path, exist_ok=True)
                 
-                # 确保在持有锁的情况下写入文件
-                with open(persistence_file, 'w', encoding='utf-8') as f:
-                     json.dump(self.allocated_ports, f, indent=4)
+                # 先写临时文件再原子替换，写入中途崩溃也不会损坏原文件
+                atomic_write(persistence_file, data, fsync=self.config["persistence"].get("fsync", False))
                 return True
             except Exception as e:
-                print(f"保存端口分配数据失败: {e}")
+                logger.error("保存端口分配数据失败: %s", e)
+                self._dirty.set()
                 return False
+
+    def flush(self) -> bool:
+        """立即写入尚未落盘的修改，没有修改时直接返回 True"""
+        if not self._dirty.is_set():
+            return True
+        return self.save_allocated_ports()
+
+    def _schedule_save(self):
+        """标记有未保存的修改：自动保存线程运行时由其合并写入，否则立即写盘"""
+        if self.save_thread is None:
+            self.save_allocated_ports()
+        else:
+            self._dirty.set()
     
     def _auto_save_thread(self, interval):
-        """自动保存线程"""
-        while True:
-            time.sleep(interval)
-            self.save_allocated_ports()
+        """自动保存线程：有修改时等待 flush_delay 合并后续修改再写盘，最长每 interval 秒检查一次"""
+        flush_delay = self.config["persistence"].get("flush_delay", 1.0)
+        while not self._shutdown.is_set():
+            if self._dirty.wait(timeout=interval):
+                # 关闭时不再等待合并，由 close() 负责最后一次写盘
+                if self._shutdown.wait(flush_delay):
+                    break
+            self.flush()
+
+    def close(self, timeout: Optional[float] = None):
+        """停止自动保存线程并写入尚未落盘的修改"""
+        save_thread = self.save_thread
+        if save_thread is not None:
+            self._shutdown.set()
+            # 唤醒阻塞在 _dirty.wait() 上的线程；多出的一次写盘由下方 flush 完成
+            self._dirty.set()
+            save_thread.join(timeout)
+            self.save_thread = None
+            atexit.unregister(self.flush)
+        self.flush()
     
     def get_available_ports(self) -> List[int]:
-        """获取所有可用的端口"""
-        with self.port_lock:
-            all_ports = set(range(self.config["port_range"]["start"], self.config["port_range"]["end"] + 1))
-            reserved_ports = set(self.config["reserved_ports"])
-            allocated_ports_set = set(int(p) for p in self.allocated_ports.keys() if p.isdigit())
-            available = sorted(list(all_ports - reserved_ports - allocated_ports_set))
-            return available
+        """获取所有可用的端口 (升序)"""
+        with self.port_lock.reader:
+            return self._available.sorted()
+
+    def get_available_ports_set(self) -> FrozenSet[int]:
+        """获取所有可用端口的集合快照，不需要顺序时使用以省去排序"""
+        with self.port_lock.reader:
+            return frozenset(self._available)
     
-    def get_used_ports(self) -> Dict[str, Dict]:
+    def get_used_ports(self) -> Dict[int, Dict]:
         """获取所有已使用的端口及其信息"""
-        with self.port_lock:
-            copied_data = json.loads(json.dumps(self.allocated_ports))
-            return copied_data
+        with self.port_lock.reader:
+            # 每条记录都是扁平字典，逐条浅拷贝即可与内部状态隔离
+            return {port: dict(info) if isinstance(info, dict) else info for port, info in self.allocated_ports.items()}
     
     def allocate_port(self, service_name: str, client_id: int = None, preferred_port: int = None) -> Optional[int]:
         """
@@ -173,7 +457,7 @@ class PortManager:
         返回:
             分配的端口号，分配失败返回None
         """
-        print(f"[PortManager] 请求分配端口: 服务='{service_name}', 偏好={preferred_port}")
+        logger.debug("请求分配端口: 服务='%s', 偏好=%s", service_name, preferred_port)
         with self.port_lock:
             allocated_port = None
             
@@ -184,42 +468,35 @@ class PortManager:
             
             # 如果没有找到合适的优先端口，则按策略分配
             if allocated_port is None:
-                available_ports = self.get_available_ports()
+                available = self._available
                 
-                if not available_ports:
-                    print("[PortManager] Error: 端口池已耗尽，无可用端口")
+                if not available:
+                    logger.error("端口池已耗尽，无可用端口")
                     return None
                 
-                strategy = self.config["allocation"]["strategy"]
+                strategy = self._strategy
     
                 if strategy == "sequential":
-                    allocated_port = min(available_ports)
+                    allocated_port = available.min()
                 elif strategy == "random":
-                    prefer_ranges = self.config["allocation"].get("prefer_ranges", [])
-                    preferred_candidate_ports = []
-                    if prefer_ranges:
-                         valid_ranges = [r for r in prefer_ranges if isinstance(r, dict) and "start" in r and "end" in r]
-                         for range_info in valid_ranges:
-                             start = range_info["start"]
-                             end = range_info["end"]
-                             preferred_candidate_ports.extend([p for p in available_ports if start <= p <= end])
-                    
-                    if preferred_candidate_ports:
-                        allocated_port = random.choice(preferred_candidate_ports)
-                    elif available_ports:
-                        allocated_port = random.choice(available_ports)
+                    # 在各优先区间的可用端口中均匀随机选择 (按区间可用端口数加权选区间)，都已用尽时再从整个端口池中选
+                    prefer_pools = [pool for _, _, pool in self._prefer_pools if pool]
+                    if prefer_pools:
+                        pool = random.choices(prefer_pools, weights=[len(pool) for pool in prefer_pools])[0]
+                        allocated_port = pool.choice()
+                    else:
+                        allocated_port = available.choice()
                 else:
-                    print(f"[PortManager] Error: 未知的分配策略 '{strategy}'")
+                    logger.error("未知的分配策略 '%s'", strategy)
             
-            # 如果最终找到了要分配的端口
-            if allocated_port is not None:
-                self._mark_port_allocated(allocated_port, service_name, client_id)
-                self.save_allocated_ports()
-                return allocated_port
-            else:
+            if allocated_port is None:
                 # 无论是优先端口不可用还是策略选择失败
-                print("[PortManager] Error: 无法分配合适的端口")
+                logger.error("无法分配合适的端口")
                 return None
+            self._mark_port_allocated(allocated_port, service_name, client_id)
+        # 写盘在释放端口锁之后进行，不阻塞其他分配/释放
+        self._schedule_save()
+        return allocated_port
     
     def release_port(self, port: int) -> bool:
         """
@@ -231,18 +508,20 @@ class PortManager:
         返回:
             成功返回True，失败返回False
         """
-        print(f"[PortManager] 请求释放端口: {port}")
+        logger.debug("请求释放端口: %s", port)
         with self.port_lock:
-            port_str = str(port)
-            if port_str in self.allocated_ports:
-                service_name = self.allocated_ports[port_str].get('service', 'unknown')
-                del self.allocated_ports[port_str]
-                print(f"[PortManager] 端口 {port} (服务: {service_name}) 已释放")
-                self.save_allocated_ports()
-                return True
-            else:
-                print(f"[PortManager] 端口 {port} 未被分配，无需释放")
+            info = self.allocated_ports.pop(port, None)
+            if info is None:
+                logger.debug("端口 %s 未被分配，无需释放", port)
                 return False
+            self._index_remove(port, info)
+            self._available_add(port)
+        logger.debug("端口 %s (服务: %s) 已释放", port, info.get('service', 'unknown'))
+        if self.config["persistence"].get("sync_on_release", False):
+            self.save_allocated_ports()
+        else:
+            self._schedule_save()
+        return True
     
     def release_ports_by_service(self, service_name: str) -> List[int]:
         """
@@ -254,26 +533,16 @@ class PortManager:
         返回:
             释放的端口列表
         """
-        print(f"[PortManager] 请求释放服务 '{service_name}' 的所有端口")
-        released_ports = []
+        logger.debug("请求释放服务 '%s' 的所有端口", service_name)
         with self.port_lock:
-            ports_to_release = []
-            for port_str, info in self.allocated_ports.items():
-                if isinstance(info, dict) and info.get("service") == service_name:
-                    ports_to_release.append(port_str)
-            if ports_to_release:
-                 ports_were_released = False
-                 for port_str in ports_to_release:
-                      if port_str in self.allocated_ports:
-                          del self.allocated_ports[port_str]
-                          try:
-                              released_ports.append(int(port_str))
-                              ports_were_released = True
-                          except ValueError:
-                               print(f"[PortManager Warning] 分配中发现无效端口格式: {port_str}")
-                 if ports_were_released:
-                     print(f"[PortManager] 服务 {service_name} 的端口已释放: {released_ports}")
-                     self.save_allocated_ports()
+            released_ports = sorted(self._by_service.pop(service_name, ()))
+            for port in released_ports:
+                info = self.allocated_ports.pop(port)
+                self._index_remove(port, info)
+                self._available_add(port)
+        if released_ports:
+            logger.info("服务 %s 的端口已释放: %s", service_name, released_ports)
+            self._schedule_save()
         return released_ports 
     
     def release_ports_by_client(self, client_id: int) -> List[int]:
@@ -286,26 +555,16 @@ class PortManager:
         返回:
             释放的端口列表
         """
-        print(f"[PortManager] 请求释放客户端 ID {client_id} 的所有端口")
-        released_ports = []
+        logger.debug("请求释放客户端 ID %s 的所有端口", client_id)
         with self.port_lock:
-            ports_to_release = []
-            for port_str, info in self.allocated_ports.items():
-                if isinstance(info, dict) and info.get("client_id") == client_id:
-                    ports_to_release.append(port_str)
-            if ports_to_release:
-                 ports_were_released = False
-                 for port_str in ports_to_release:
-                      if port_str in self.allocated_ports:
-                          del self.allocated_ports[port_str]
-                          try:
-                              released_ports.append(int(port_str))
-                              ports_were_released = True
-                          except ValueError:
-                               print(f"[PortManager Warning] 分配中发现无效端口格式: {port_str}")
-                 if ports_were_released:
-                     print(f"[PortManager] 客户端 {client_id} 的端口已释放: {released_ports}")
-                     self.save_allocated_ports()
+            released_ports = sorted(self._by_client.pop(client_id, ()))
+            for port in released_ports:
+                info = self.allocated_ports.pop(port)
+                self._index_remove(port, info)
+                self._available_add(port)
+        if released_ports:
+            logger.info("客户端 %s 的端口已释放: %s", client_id, released_ports)
+            self._schedule_save()
         return released_ports 
     
     def get_port_info(self, port: int) -> Optional[Dict]:
@@ -318,10 +577,9 @@ class PortManager:
         返回:
             端口信息字典，如果端口未分配则返回None
         """
-        with self.port_lock:
-            info = self.allocated_ports.get(str(port))
-            copied_info = json.loads(json.dumps(info)) if info else None
-            return copied_info
+        with self.port_lock.reader:
+            info = self.allocated_ports.get(port)
+            return dict(info) if info else None
     
     def get_port_usage_summary(self) -> Dict[str, Dict]:
         """
@@ -330,26 +588,19 @@ class PortManager:
             一个字典，包含按服务和客户端 ID 分组的端口数量统计。
             例如: {'services': {'service_a': 10, 'service_b': 5}, 'clients': {1: 8, 2: 7}}
         """
-        service_counts = {}
         client_counts = {}
-        with self.port_lock:
-            for port_str, info in self.allocated_ports.items():
-                if isinstance(info, dict):
-                    service = info.get("service")
-                    client_id = info.get("client_id")
-
-                    if service:
-                        service_counts[service] = service_counts.get(service, 0) + 1
-                    
-                    if client_id is not None:
-                        try:
-                            # 确保 client_id 可以作为字典的键 (通常是整数或字符串)
-                            client_key = int(client_id) if isinstance(client_id, (int, str)) and str(client_id).isdigit() else str(client_id)
-                            client_counts[client_key] = client_counts.get(client_key, 0) + 1
-                        except (ValueError, TypeError):
-                             # 保留: 客户端ID格式错误警告
-                             print(f"[PortManager Warning] 处理端口 {port_str} 的客户端 ID 时遇到无效格式: {client_id}")
-
+        with self.port_lock.reader:
+            # 直接使用索引中的集合大小计数
+            service_counts = {service: len(ports) for service, ports in self._by_service.items() if service}
+            for client_id, ports in self._by_client.items():
+                if client_id is not None:
+                    try:
+                        # 确保 client_id 可以作为字典的键 (通常是整数或字符串)
+                        client_key = int(client_id) if isinstance(client_id, (int, str)) and str(client_id).isdigit() else str(client_id)
+                        client_counts[client_key] = client_counts.get(client_key, 0) + len(ports)
+                    except (ValueError, TypeError):
+                         # 保留: 客户端ID格式错误警告
+                         logger.warning("处理客户端 ID 时遇到无效格式: %s", client_id)
 
         return {"services": service_counts, "clients": client_counts}
     
@@ -363,8 +614,8 @@ class PortManager:
         返回:
             如果端口已分配则返回True，否则返回False
         """
-        with self.port_lock:
-            allocated = str(port) in self.allocated_ports
+        with self.port_lock.reader:
+            allocated = port in self.allocated_ports
             return allocated
     
     def _is_port_available(self, port: int) -> bool:
@@ -378,35 +629,42 @@ class PortManager:
             如果端口可用则返回True，否则返回False
         """
         if not isinstance(port, int):
-             print(f"[PortManager Warning] _is_port_available called with non-integer port: {port}")
+             logger.warning("_is_port_available called with non-integer port: %r", port)
              return False
              
-        if not (self.config["port_range"]["start"] <= port <= self.config["port_range"]["end"]):
+        if not (self._range_start <= port <= self._range_end):
             return False
         
-        if port in self.config["reserved_ports"]:
+        if port in self._reserved:
             return False
         
-        if str(port) in self.allocated_ports:
+        if port in self.allocated_ports:
             return False
         
         return True
     
     def _mark_port_allocated(self, port: int, service_name: str, client_id: int = None):
         """
-        标记端口为已分配 (需要在持有锁的情况下调用)
+        标记端口为已分配 (获取写锁，持有写锁时调用也安全)
         
         参数:
             port: 端口号
             service_name: 服务名称
             client_id: 客户端ID，可选
         """
-        self.allocated_ports[str(port)] = {
-            "service": service_name,
-            "allocated_time": int(time.time()),
-            "client_id": client_id
-        }
-        print(f"[PortManager] 端口 {port} 已分配给服务 {service_name}" + (f" (客户端 {client_id})" if client_id else ""))
+        with self.port_lock:
+            old_info = self.allocated_ports.get(port)
+            if old_info is not None:
+                self._index_remove(port, old_info)
+            info = self.allocated_ports[port] = {
+                "service": service_name,
+                "allocated_time": int(time.time()),
+                "client_id": client_id
+            }
+            self._index_add(port, info)
+            self._available_discard(port)
+            self._dirty.set()
+        logger.debug("端口 %s 已分配给服务 %s (客户端 %s)", port, service_name, client_id)
 
     @classmethod
     def create_default_config(cls, config_path="config/port_config.json", overwrite=False):
@@ -421,7 +679,7 @@ class PortManager:
             成功返回True，失败返回False
         """
         if os.path.exists(config_path) and not overwrite:
-            print(f"配置文件 {config_path} 已存在，不覆盖")
+            logger.info("配置文件 %s 已存在，不覆盖", config_path)
             return False
             
         # 确保目录存在
@@ -441,22 +699,26 @@ class PortManager:
             "persistence": {
                 "file": "state/port_allocation.json",
                 "auto_save": True,
-                "save_interval": 300
+                "save_interval": 300,
+                "flush_delay": 1.0,
+                "sync_on_release": False,
+                "fsync": False
             }
         }
         
         try:
-            with open(config_path, 'w', encoding='utf-8') as f:
-                json.dump(default_config, f, indent=4, ensure_ascii=False)
-            print(f"默认端口配置文件已创建: {config_path}")
+            with open(config_path, 'wb') as f:
+                f.write(orjson.dumps(default_config, option=orjson.OPT_INDENT_2))
+            logger.info("默认端口配置文件已创建: %s", config_path)
             return True
         except Exception as e:
-            print(f"创建端口配置文件失败: {e}")
+            logger.error("创建端口配置文件失败: %s", e)
             return False
 
 
 # 测试代码
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG, format="%(asctime)s [%(name)s] %(levelname)s: %(message)s")
     # 检查是否存在配置文件，不存在则创建
     if not os.path.exists("config/port_config.json"):
         print("未找到端口配置文件，创建默认配置...")
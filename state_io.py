@@ -0,0 +1,38 @@
+"""
+State IO - 状态文件读写工具
+
+各管理器共用的状态文件写入函数，不依赖 Docker/NPS 等其他模块。
+"""
+
+import os
+import tempfile
+
+
+def atomic_write(path: str, data: bytes, fsync: bool = False):
+    """
+    先写入同目录下的临时文件再 os.replace，避免写入中途崩溃留下残缺的状态文件
+
+    参数:
+        path: 目标文件路径
+        data: 要写入的内容
+        fsync: 替换前是否 fsync 临时文件，断电时也不丢失本次写入
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        # mkstemp 创建的文件权限为 0600，保持与原文件一致
+        try:
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+        except FileNotFoundError:
+            os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
@@ -1,14 +1,349 @@
 #!/usr/bin/env python3
 
+import codecs
+import os
 import sys
 import json
+import re
 import requests
+from html.parser import HTMLParser
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from nps_manager import NPSManager
 
 # 默认配置
 SERVER_ADDR = "121.199.18.76"
 SERVER_PORT = 8081
 AUTH_KEY = "55ee6338f59c89d6ec04c9dc04a6bf0abJHSA"  # 替换为你的 AUTH_KEY
+# 设置环境变量 NPS_DEBUG=1 时保存抓取到的隧道页面 HTML，便于排查
+_DEBUG = bool(os.environ.get("NPS_DEBUG"))
+
+# 从开始/停止/编辑按钮的链接中提取隧道ID
+_ACTION_URL_RE = re.compile(r'/index/(?:stop|start|edit)/(\d+)')
+
+class _TableRowParser(HTMLParser):
+    """单次遍历 HTML，收集每个表格行的单元格文本和链接地址"""
+
+    def __init__(self):
+        super().__init__()
+        self.rows = []  # [(单元格文本列表, 链接列表)]，_iter_rows 取走后清空
+        self._cells = None
+        self._hrefs = None
+        self._text = None
+
+    def _end_cell(self):
+        if self._text is not None:
+            self._cells.append(''.join(self._text).strip())
+            self._text = None
+
+    def _end_row(self):
+        if self._cells is not None:
+            self._end_cell()
+            self.rows.append((self._cells, self._hrefs))
+            self._cells = self._hrefs = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'tr':
+            # 容忍未闭合的 <tr>
+            self._end_row()
+            self._cells, self._hrefs = [], []
+        elif self._cells is None:
+            return
+        elif tag == 'td':
+            self._end_cell()
+            self._text = []
+        elif tag == 'a':
+            href = dict(attrs).get('href')
+            if href:
+                self._hrefs.append(href)
+
+    def handle_endtag(self, tag):
+        if self._cells is None:
+            return
+        if tag == 'td':
+            self._end_cell()
+        elif tag in ('tr', 'table'):
+            self._end_row()
+
+    def handle_data(self, data):
+        if self._text is not None:
+            self._text.append(data)
+
+class _NpsWebClient:
+    """NPS 管理面板客户端：同一进程内复用连接和登录 cookie，并缓存解析后的隧道列表"""
+
+    def __init__(self, base_url, username, password):
+        self.base_url = base_url
+        self._login_data = {
+            "username": username,
+            "password": password
+        }
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/x-www-form-urlencoded"})
+        self.session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=Retry(total=2, backoff_factor=0.2)))
+        # 单元格文本 -> (单元格文本列表, 链接列表)，隧道增删后需调用 invalidate()
+        self._rows = None
+
+    def login(self):
+        """登录 NPS 管理面板，已持有登录 cookie 时直接返回 True"""
+        if self.session.cookies:
+            return True
+        
+        login_response = self.session.post(f"{self.base_url}/login/verify", data=self._login_data)
+        if login_response.status_code != 200:
+            print(f"登录失败: {login_response.status_code}")
+            return False
+        print("登录成功")
+        return True
+
+    def fetch_tcp_page(self):
+        """获取 TCP 隧道列表页面的 HTML，失败时返回 None"""
+        if not self.login():
+            return None
+        
+        tcp_response = self.session.get(f"{self.base_url}/index/tcp")
+        if tcp_response.status_code != 200:
+            print(f"获取隧道列表失败: {tcp_response.status_code}")
+            return None
+        # NPS 管理页面固定为 UTF-8，直接解码，跳过 requests 的编码推断
+        return tcp_response.content.decode("utf-8", errors="replace")
+
+    def stream_port_row(self, port):
+        """流式读取 TCP 隧道列表页面，解析到端口所在行后立即停止下载；
+        返回 (单元格文本列表, 链接列表)，未找到或获取失败返回 None"""
+        if not self.login():
+            return None
+        
+        with self.session.get(f"{self.base_url}/index/tcp", stream=True) as tcp_response:
+            if tcp_response.status_code != 200:
+                print(f"获取隧道列表失败: {tcp_response.status_code}")
+                return None
+            for cells, hrefs in _iter_rows(_decode_chunks(tcp_response.iter_content(chunk_size=8192))):
+                if port in cells:
+                    return cells, hrefs
+        return None
+
+    def tunnel_rows(self, html_file=None):
+        """返回 单元格文本 -> 所在行 的索引；同一进程内只获取和解析一次页面，失败时返回 None"""
+        if self._rows is None:
+            html = self.fetch_tcp_page()
+            if html is None:
+                return None
+            if html_file:
+                _save_html(html, html_file)
+            self._rows = _index_port_rows(html)
+        return self._rows
+
+    def invalidate(self):
+        """隧道增删后丢弃缓存的隧道列表"""
+        self._rows = None
+
+_WEB = _NpsWebClient(f"http://{SERVER_ADDR}:{SERVER_PORT}", "admin", "oritime123")
+
+def _decode_chunks(chunks):
+    """增量 UTF-8 解码字节块，避免多字节字符被切在两个块之间"""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    for chunk in chunks:
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+def cmd_list_clients(nps, argv):
+    result = nps.list_clients()
+    print_json(result)
+    if result and "rows" in result and result["rows"]:
+        print("\n客户端ID列表:")
+        for client in result["rows"]:
+            print(f"ID: {client['Id']}, 备注: {client['Remark']}, 状态: {'在线' if client['IsConnect'] else '离线'}")
+
+def cmd_list_tunnels(nps, argv):
+    client_id = ""
+    if len(argv) > 2:
+        client_id = argv[2]
+    
+    result = nps.list_tunnels(client_id=client_id)
+    print_json(result)
+
+def cmd_check_tunnel(nps, argv):
+    if len(argv) < 3:
+        print("用法: python test_nps.py check_tunnel [端口]")
+        sys.exit(1)
+        
+    port = argv[2]
+    print(f"检查端口 {port} 的隧道...")
+    
+    if _verify_port_in_tunnels(port, f"nps_check_tunnel_{port}.html") is None:
+        print(f"❌ 端口 {port} 的隧道不存在。")
+
+def cmd_check_tunnels(nps, argv):
+    if len(argv) < 3:
+        print("用法: python test_nps.py check_tunnels [端口...]")
+        sys.exit(1)
+    
+    ports = argv[2:]
+    print(f"批量检查 {len(ports)} 个端口的隧道...")
+    
+    # 页面只获取和解析一次，之后每个端口都是一次字典查找
+    rows = _WEB.tunnel_rows("nps_check_tunnels.html")
+    if rows is not None:
+        for port in ports:
+            row = rows.get(port)
+            if row:
+                print(f"✅ 端口 {port}: {' | '.join(row[0])}")
+            else:
+                print(f"❌ 端口 {port} 的隧道不存在。")
+
+def cmd_get_tunnel_id(nps, argv):
+    if len(argv) < 3:
+        print("用法: python test_nps.py get_tunnel_id [端口]")
+        sys.exit(1)
+        
+    port = argv[2]
+    print(f"查找端口 {port} 对应的隧道ID...")
+    
+    rows = _WEB.tunnel_rows(f"nps_get_tunnel_id_{port}.html")
+    if rows is not None:
+        # 尝试提取隧道ID
+        tunnel_id = None
+        row = rows.get(port)
+        if row:
+            cells, hrefs = row
+            # 优先取第一列的数字ID，否则从开始/停止/编辑按钮的URL中提取
+            if cells[0].isdigit():
+                tunnel_id = cells[0]
+                print(f"✅ 找到端口 {port} 对应的隧道ID: {tunnel_id}")
+            else:
+                for href in hrefs:
+                    action_url = _ACTION_URL_RE.search(href)
+                    if action_url:
+                        tunnel_id = action_url.group(1)
+                        print(f"✅ 通过操作按钮找到端口 {port} 对应的隧道ID: {tunnel_id}")
+                        break
+        
+        if tunnel_id is None:
+            print(f"❌ 未能找到端口 {port} 对应的隧道ID")
+            print("请尝试手动查看网页或设置 NPS_DEBUG=1 保存HTML文件确认隧道ID")
+
+def cmd_add_client(nps, argv):
+    if len(argv) < 4:
+        print("用法: python test_nps.py add_client [备注] [vkey]")
+        sys.exit(1)
+    
+    remark = argv[2]
+    vkey = argv[3]
+    
+    result = nps.add_client(remark=remark, vkey=vkey)
+    print(f"添加客户端结果: {result}")
+    
+    # 如果添加成功，立即列出客户端以查看新客户端的ID
+    if result:
+        print("\n刚添加的客户端应该在下面的列表中:")
+        clients = nps.list_clients()
+        if clients and "rows" in clients:
+            for client in clients["rows"]:
+                if client["Remark"] == remark:
+                    print(f"新客户端 ID: {client['Id']}, 备注: {client['Remark']}")
+
+def cmd_delete_client(nps, argv):
+    if len(argv) < 3:
+        print("用法: python test_nps.py delete_client [客户端ID]")
+        sys.exit(1)
+    
+    client_id = argv[2]
+    
+    result = nps.delete_client(client_id)
+    print(f"删除客户端结果: {result}")
+
+def cmd_add_tunnel(nps, argv):
+    if len(argv) < 6:
+        print("用法: python test_nps.py add_tunnel [客户端ID] [端口] [目标地址] [备注]")
+        sys.exit(1)
+    
+    client_id = argv[2]
+    port = argv[3]
+    target = argv[4]
+    remark = argv[5]
+    
+    # 确保客户端 ID 是数字
+    try:
+        client_id = int(client_id)
+    except ValueError:
+        print(f"警告：客户端ID应该是数字，当前值: {client_id}")
+    
+    result = nps.add_tunnel(
+        client_id=client_id,
+        tunnel_type="tcp",  # 默认使用 TCP 类型
+        port=port,
+        target=target,
+        remark=remark
+    )
+    print(f"添加隧道结果: {result}")
+    _WEB.invalidate()
+    
+    # 添加成功后，检查这个端口的隧道是否存在
+    if result:
+        print(f"\n检查端口 {port} 的隧道是否添加成功...")
+        
+        if _verify_port_in_tunnels(port, f"nps_add_tunnel_{port}.html") is None:
+            print(f"❌ 端口 {port} 的隧道未找到，添加可能失败或需要刷新页面。")
+            
+            # 提供建议
+            print("\n可能的原因:")
+            print("1. 添加成功但网页需要刷新才能显示")
+            print("2. 客户端不在线，隧道未显示")
+            print("3. 添加成功但隧道ID尚未分配")
+            print("4. 添加操作实际失败，尽管API返回成功")
+            
+            print("\n建议操作:")
+            print("- 手动刷新NPS管理面板查看")
+            print("- 确保客户端处于在线状态")
+            print("- 等待几秒后再次检查")
+            print("- 使用 check_tunnel 命令再次检查: python test_nps.py check_tunnel " + port)
+
+def cmd_delete_tunnel(nps, argv):
+    if len(argv) < 3:
+        print("用法: python test_nps.py delete_tunnel [隧道ID]")
+        sys.exit(1)
+    
+    tunnel_id = argv[2]
+    
+    result = nps.delete_tunnel(tunnel_id)
+    print(f"删除隧道结果: {result}")
+    _WEB.invalidate()
+
+def cmd_start_tunnel(nps, argv):
+    if len(argv) < 3:
+        print("用法: python test_nps.py start_tunnel [隧道ID]")
+        sys.exit(1)
+    
+    tunnel_id = argv[2]
+    
+    result = nps.start_tunnel(tunnel_id)
+    print(f"启动隧道结果: {result}")
+
+def cmd_stop_tunnel(nps, argv):
+    if len(argv) < 3:
+        print("用法: python test_nps.py stop_tunnel [隧道ID]")
+        sys.exit(1)
+    
+    tunnel_id = argv[2]
+    
+    result = nps.stop_tunnel(tunnel_id)
+    print(f"停止隧道结果: {result}")
+
+# 命令名 -> 处理函数
+COMMANDS = {
+    "list_clients": cmd_list_clients,
+    "list_tunnels": cmd_list_tunnels,
+    "check_tunnel": cmd_check_tunnel,
+    "check_tunnels": cmd_check_tunnels,
+    "get_tunnel_id": cmd_get_tunnel_id,
+    "add_client": cmd_add_client,
+    "delete_client": cmd_delete_client,
+    "add_tunnel": cmd_add_tunnel,
+    "delete_tunnel": cmd_delete_tunnel,
+    "start_tunnel": cmd_start_tunnel,
+    "stop_tunnel": cmd_stop_tunnel,
+}
 
 def main():
     # 初始化 NPS 管理器
@@ -24,6 +359,7 @@ def main():
         print("  list_clients - 列出所有客户端")
         print("  list_tunnels [客户端ID] - 列出所有隧道，可选指定客户端ID")
         print("  check_tunnel [端口] - 检查指定端口的隧道是否存在")
+        print("  check_tunnels [端口...] - 只获取一次页面，批量检查多个端口的隧道")
         print("  get_tunnel_id [端口] - 通过端口查找隧道ID")
         print("  add_client [备注] [vkey] - 添加客户端")
         print("  delete_client [客户端ID] - 删除客户端")
@@ -35,377 +371,87 @@ def main():
     
     command = sys.argv[1]
     
-    if command == "list_clients":
-        result = nps.list_clients()
-        print_json(result)
-        if result and "rows" in result and result["rows"]:
-            print("\n客户端ID列表:")
-            for client in result["rows"]:
-                print(f"ID: {client['Id']}, 备注: {client['Remark']}, 状态: {'在线' if client['IsConnect'] else '离线'}")
-    
-    elif command == "list_tunnels":
-        client_id = ""
-        if len(sys.argv) > 2:
-            client_id = sys.argv[2]
-        
-        result = nps.list_tunnels(client_id=client_id)
-        print_json(result)
-    
-    elif command == "check_tunnel":
-        if len(sys.argv) < 3:
-            print("用法: python test_nps.py check_tunnel [端口]")
-            sys.exit(1)
-            
-        port = sys.argv[2]
-        print(f"检查端口 {port} 的隧道...")
-        
-        # 创建 session 并登录
-        session = requests.Session()
-        login_data = {
-            "username": "admin",
-            "password": "oritime123"
-        }
-        
-        login_response = session.post(
-            f"http://{SERVER_ADDR}:{SERVER_PORT}/login/verify",
-            data=login_data,
-            headers={"Content-Type": "application/x-www-form-urlencoded"}
-        )
-        
-        if login_response.status_code == 200:
-            print("登录成功，检查隧道...")
-            
-            # 获取TCP隧道页面
-            tcp_response = session.get(f"http://{SERVER_ADDR}:{SERVER_PORT}/index/tcp")
-            
-            if tcp_response.status_code == 200:
-                html = tcp_response.text
-                
-                # 保存 HTML 以便查看
-                with open(f"nps_check_tunnel_{port}.html", "w") as f:
-                    f.write(html)
-                print(f"已保存 HTML 到 nps_check_tunnel_{port}.html 文件中")
-                
-                # 检查 HTML 中是否包含指定端口
-                import re
-                
-                # 尝试多种正则表达式找端口
-                found = False
-                patterns = [
-                    f'<td[^>]*>{port}</td>',  # 标准表格单元格
-                    f'>{port}<',               # 端口在标签之间
-                    f'端口[：:]\s*{port}',      # 中文描述
-                    f'port[：:]\s*{port}',     # 英文描述
-                ]
-                
-                for pattern in patterns:
-                    if re.search(pattern, html):
-                        found = True
-                        print(f"✅ 使用模式 '{pattern}' 找到端口 {port}!")
-                        break
-                        
-                if found:
-                    # 尝试查找该端口的相关信息
-                    # 更强大的行匹配模式，尝试查找包含该端口的表格行
-                    row_patterns = [
-                        r'<tr[^>]*>.*?' + port + r'.*?</tr>',  # 宽松模式
-                        r'<tr[^>]*>(.*?<td[^>]*>' + port + r'</td>.*?)</tr>',  # 更具体的匹配
-                    ]
-                    
-                    for pattern in row_patterns:
-                        port_row = re.search(pattern, html, re.DOTALL)
-                        if port_row:
-                            # 提取所有单元格
-                            cells = re.findall(r'<td[^>]*>(.*?)</td>', port_row.group(0), re.DOTALL)
-                            if cells:
-                                print("找到包含该端口的行，单元格内容：")
-                                for i, cell in enumerate(cells):
-                                    # 移除 HTML 标签
-                                    cell_content = re.sub(r'<[^>]*>', '', cell).strip()
-                                    print(f"  单元格 {i}: {cell_content}")
-                                break
-                else:
-                    print(f"❌ 端口 {port} 的隧道不存在，尝试了所有匹配模式。")
-            else:
-                print(f"获取隧道列表失败: {tcp_response.status_code}")
-        else:
-            print(f"登录失败: {login_response.status_code}")
+    handler = COMMANDS.get(command)
+    if handler is None:
+        print(f"未知命令: {command}")
+        sys.exit(1)
+    handler(nps, sys.argv)
 
-    elif command == "get_tunnel_id":
-        if len(sys.argv) < 3:
-            print("用法: python test_nps.py get_tunnel_id [端口]")
-            sys.exit(1)
-            
-        port = sys.argv[2]
-        print(f"查找端口 {port} 对应的隧道ID...")
-        
-        # 创建 session 并登录
-        session = requests.Session()
-        login_data = {
-            "username": "admin",
-            "password": "oritime123"
-        }
-        
-        login_response = session.post(
-            f"http://{SERVER_ADDR}:{SERVER_PORT}/login/verify",
-            data=login_data,
-            headers={"Content-Type": "application/x-www-form-urlencoded"}
-        )
-        
-        if login_response.status_code == 200:
-            print("登录成功，查找隧道ID...")
-            
-            # 获取TCP隧道页面
-            tcp_response = session.get(f"http://{SERVER_ADDR}:{SERVER_PORT}/index/tcp")
-            
-            if tcp_response.status_code == 200:
-                html = tcp_response.text
-                
-                # 保存 HTML 以便查看
-                with open(f"nps_get_tunnel_id_{port}.html", "w") as f:
-                    f.write(html)
-                print(f"已保存 HTML 到 nps_get_tunnel_id_{port}.html 文件中")
-                
-                # 尝试提取隧道ID
-                import re
-                
-                # 适应各种不同的 HTML 结构
-                tunnel_id_found = False
-                
-                # 尝试方法1: 查找包含端口的行，提取ID
-                port_row = re.search(r'<tr[^>]*>.*?<td[^>]*>(\d+)</td>.*?' + port + r'.*?</tr>', html, re.DOTALL)
-                if port_row:
-                    tunnel_id = port_row.group(1)
-                    print(f"✅ 找到端口 {port} 对应的隧道ID: {tunnel_id}")
-                    tunnel_id_found = True
-                
-                # 尝试方法2: 查找隧道ID通过开始/停止按钮的URL
-                if not tunnel_id_found:
-                    port_row = re.search(r'<tr[^>]*>.*?' + port + r'.*?</tr>', html, re.DOTALL)
-                    if port_row:
-                        # 查找停止按钮的URL，通常包含ID
-                        stop_url = re.search(r'href="[^"]*?/index/stop/(\d+)"', port_row.group(0))
-                        if stop_url:
-                            tunnel_id = stop_url.group(1)
-                            print(f"✅ 通过操作按钮找到端口 {port} 对应的隧道ID: {tunnel_id}")
-                            tunnel_id_found = True
-                
-                # 尝试方法3: 查找包含ID和端口的编辑按钮
-                if not tunnel_id_found:
-                    edit_url = re.search(r'href="[^"]*?/index/edit/(\d+)"[^>]*>.*?<tr[^>]*>.*?' + port + r'.*?</tr>', html, re.DOTALL)
-                    if edit_url:
-                        tunnel_id = edit_url.group(1)
-                        print(f"✅ 通过编辑按钮找到端口 {port} 对应的隧道ID: {tunnel_id}")
-                        tunnel_id_found = True
-                
-                # 如果都没找到，尝试解析整个页面找ID和端口的关联
-                if not tunnel_id_found:
-                    # 提取所有隧道行
-                    rows = re.findall(r'<tr[^>]*>(.*?)</tr>', html, re.DOTALL)
-                    for row in rows:
-                        # 检查这一行是否包含我们要找的端口
-                        if port in row:
-                            # 尝试提取ID（通常是第一列）
-                            id_match = re.search(r'<td[^>]*>(\d+)</td>', row)
-                            if id_match:
-                                tunnel_id = id_match.group(1)
-                                print(f"✅ 通过表格行分析找到端口 {port} 对应的隧道ID: {tunnel_id}")
-                                tunnel_id_found = True
-                                break
-                
-                if not tunnel_id_found:
-                    print(f"❌ 未能找到端口 {port} 对应的隧道ID")
-                    print("请尝试手动查看网页或HTML文件确认隧道ID")
-            else:
-                print(f"获取隧道列表失败: {tcp_response.status_code}")
-        else:
-            print(f"登录失败: {login_response.status_code}")
+def _save_html(html, html_file):
+    """调试模式下保存 HTML 以便查看"""
+    if not _DEBUG:
+        return
+    with open(html_file, "w", encoding="utf-8") as f:
+        f.write(html)
+    print(f"已保存 HTML 到 {html_file} 文件中")
 
-    elif command == "add_client":
-        if len(sys.argv) < 4:
-            print("用法: python test_nps.py add_client [备注] [vkey]")
-            sys.exit(1)
-        
-        remark = sys.argv[2]
-        vkey = sys.argv[3]
-        
-        result = nps.add_client(remark=remark, vkey=vkey)
-        print(f"添加客户端结果: {result}")
-        
-        # 如果添加成功，立即列出客户端以查看新客户端的ID
-        if result:
-            print("\n刚添加的客户端应该在下面的列表中:")
-            clients = nps.list_clients()
-            if clients and "rows" in clients:
-                for client in clients["rows"]:
-                    if client["Remark"] == remark:
-                        print(f"新客户端 ID: {client['Id']}, 备注: {client['Remark']}")
-    
-    elif command == "delete_client":
-        if len(sys.argv) < 3:
-            print("用法: python test_nps.py delete_client [客户端ID]")
-            sys.exit(1)
-        
-        client_id = sys.argv[2]
-        
-        result = nps.delete_client(client_id)
-        print(f"删除客户端结果: {result}")
-    
-    elif command == "add_tunnel":
-        if len(sys.argv) < 6:
-            print("用法: python test_nps.py add_tunnel [客户端ID] [端口] [目标地址] [备注]")
-            sys.exit(1)
-        
-        client_id = sys.argv[2]
-        port = sys.argv[3]
-        target = sys.argv[4]
-        remark = sys.argv[5]
-        
-        # 确保客户端 ID 是数字
-        try:
-            client_id = int(client_id)
-        except ValueError:
-            print(f"警告：客户端ID应该是数字，当前值: {client_id}")
-        
-        result = nps.add_tunnel(
-            client_id=client_id,
-            tunnel_type="tcp",  # 默认使用 TCP 类型
-            port=port,
-            target=target,
-            remark=remark
-        )
-        print(f"添加隧道结果: {result}")
-        
-        # 添加成功后，检查这个端口的隧道是否存在
-        if result:
-            print(f"\n检查端口 {port} 的隧道是否添加成功...")
-            
-            # 创建 session 并登录
-            session = requests.Session()
-            login_data = {
-                "username": "admin",
-                "password": "oritime123"
-            }
-            
-            login_response = session.post(
-                f"http://{SERVER_ADDR}:{SERVER_PORT}/login/verify",
-                data=login_data,
-                headers={"Content-Type": "application/x-www-form-urlencoded"}
-            )
-            
-            if login_response.status_code == 200:
-                print("登录成功，检查隧道...")
-                
-                # 获取TCP隧道页面
-                tcp_response = session.get(f"http://{SERVER_ADDR}:{SERVER_PORT}/index/tcp")
-                
-                if tcp_response.status_code == 200:
-                    html = tcp_response.text
-                    
-                    # 保存 HTML 以便查看
-                    with open(f"nps_add_tunnel_{port}.html", "w") as f:
-                        f.write(html)
-                    print(f"已保存 HTML 到 nps_add_tunnel_{port}.html 文件中")
-                    
-                    # 检查 HTML 中是否包含指定端口
-                    import re
-                    
-                    # 尝试多种正则表达式找端口
-                    found = False
-                    patterns = [
-                        f'<td[^>]*>{port}</td>',  # 标准表格单元格
-                        f'>{port}<',               # 端口在标签之间
-                        f'端口[：:]\s*{port}',      # 中文描述
-                        f'port[：:]\s*{port}',     # 英文描述
-                    ]
-                    
-                    for pattern in patterns:
-                        if re.search(pattern, html):
-                            found = True
-                            print(f"✅ 使用模式 '{pattern}' 找到端口 {port}!")
-                            break
-                            
-                    if found:
-                        # 尝试查找该端口的相关信息
-                        # 更强大的行匹配模式，尝试查找包含该端口的表格行
-                        row_patterns = [
-                            r'<tr[^>]*>.*?' + port + r'.*?</tr>',  # 宽松模式
-                            r'<tr[^>]*>(.*?<td[^>]*>' + port + r'</td>.*?)</tr>',  # 更具体的匹配
-                        ]
-                        
-                        for pattern in row_patterns:
-                            port_row = re.search(pattern, html, re.DOTALL)
-                            if port_row:
-                                # 提取所有单元格
-                                cells = re.findall(r'<td[^>]*>(.*?)</td>', port_row.group(0), re.DOTALL)
-                                if cells:
-                                    print("找到包含该端口的行，单元格内容：")
-                                    for i, cell in enumerate(cells):
-                                        # 移除 HTML 标签
-                                        cell_content = re.sub(r'<[^>]*>', '', cell).strip()
-                                        print(f"  单元格 {i}: {cell_content}")
-                                    break
-                    else:
-                        print(f"❌ 端口 {port} 的隧道未找到，添加可能失败或需要刷新页面。")
-                        
-                        # 提供建议
-                        print("\n可能的原因:")
-                        print("1. 添加成功但网页需要刷新才能显示")
-                        print("2. 客户端不在线，隧道未显示")
-                        print("3. 添加成功但隧道ID尚未分配")
-                        print("4. 添加操作实际失败，尽管API返回成功")
-                        
-                        print("\n建议操作:")
-                        print("- 手动刷新NPS管理面板查看")
-                        print("- 确保客户端处于在线状态")
-                        print("- 等待几秒后再次检查")
-                        print("- 使用 check_tunnel 命令再次检查: python test_nps.py check_tunnel " + port)
-                else:
-                    print(f"获取隧道列表失败: {tcp_response.status_code}")
-            else:
-                print(f"登录失败: {login_response.status_code}")
-    
-    elif command == "delete_tunnel":
-        if len(sys.argv) < 3:
-            print("用法: python test_nps.py delete_tunnel [隧道ID]")
-            sys.exit(1)
-        
-        tunnel_id = sys.argv[2]
-        
-        result = nps.delete_tunnel(tunnel_id)
-        print(f"删除隧道结果: {result}")
-    
-    elif command == "start_tunnel":
-        if len(sys.argv) < 3:
-            print("用法: python test_nps.py start_tunnel [隧道ID]")
-            sys.exit(1)
-        
-        tunnel_id = sys.argv[2]
-        
-        result = nps.start_tunnel(tunnel_id)
-        print(f"启动隧道结果: {result}")
-    
-    elif command == "stop_tunnel":
-        if len(sys.argv) < 3:
-            print("用法: python test_nps.py stop_tunnel [隧道ID]")
-            sys.exit(1)
-        
-        tunnel_id = sys.argv[2]
-        
-        result = nps.stop_tunnel(tunnel_id)
-        print(f"停止隧道结果: {result}")
-    
+# 解析整页文本时每次喂给解析器的字符数
+_PARSE_CHUNK = 65536
+
+def _iter_rows(chunks):
+    """增量解析 HTML 文本块，逐行产出 (单元格文本列表, 链接列表)，已产出的行不再保留"""
+    parser = _TableRowParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+        yield from parser.rows
+        parser.rows.clear()
+    parser.close()
+    yield from parser.rows
+
+def _parse_rows(html):
+    """分块解析整页 HTML，逐行产出 (单元格文本列表, 链接列表)"""
+    return _iter_rows(html[i:i + _PARSE_CHUNK] for i in range(0, len(html), _PARSE_CHUNK))
+
+def _find_port_row(html, port):
+    """解析一次页面，返回端口所在行的 (单元格文本列表, 链接列表)，未找到返回 None"""
+    # 页面中根本没有该端口时直接返回，省去整页解析
+    if port not in html:
+        return None
+    for cells, hrefs in _parse_rows(html):
+        if port in cells:
+            return cells, hrefs
+    return None
+
+def _index_port_rows(html):
+    """解析一次页面，建立 单元格文本 -> 所在行 的索引，用于批量查询多个端口 (同一文本取第一行)"""
+    index = {}
+    for row in _parse_rows(html):
+        for cell in row[0]:
+            index.setdefault(cell, row)
+    return index
+
+def _verify_port_in_tunnels(port, html_file):
+    """获取隧道列表页面并打印端口所在行，返回该行的单元格内容，未找到或获取失败返回 None"""
+    if _DEBUG:
+        # 调试模式需要保存完整页面
+        html = _WEB.fetch_tcp_page()
+        if html is None:
+            return None
+        _save_html(html, html_file)
+        row = _find_port_row(html, port)
     else:
-        print(f"未知命令: {command}")
-        sys.exit(1)
+        row = _WEB.stream_port_row(port)
+    if row is None:
+        return None
+    cells = row[0]
+    print(f"✅ 找到端口 {port}!")
+    print("找到包含该端口的行，单元格内容：")
+    for i, cell_content in enumerate(cells):
+        print(f"  单元格 {i}: {cell_content}")
+    return cells
 
 def print_json(data):
-    """美化打印 JSON 数据"""
+    """打印 JSON 数据，输出到终端时美化缩进"""
     if data is None:
         print("请求失败，无数据返回")
         return
     
-    print(json.dumps(data, indent=2, ensure_ascii=False))
+    # 输出到终端时美化缩进；被管道/重定向时输出紧凑 JSON，便于其他程序处理
+    if sys.stdout.isatty():
+        print(json.dumps(data, indent=2, ensure_ascii=False))
+    else:
+        json.dump(data, sys.stdout, ensure_ascii=False, separators=(",", ":"))
+        print()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -1,63 +1,76 @@
 #!/usr/bin/env python3
 from container_manager import DockerContainerManager
+from dynamic_tunnel_manager import DynamicTunnelManager
+import pytest
 import time
+import uuid
 
-def test_port_management():
-    """测试端口管理功能"""
-    manager = DockerContainerManager()
-    
-    # 测试容器名称
-    container_name = "test_container"
-    
-    print("\n1. 创建容器")
-    success = manager.create_container(
-        image="ubuntu20.04-cuda12.1-jupyter-v0.1",
+TEST_IMAGE = "ubuntu20.04-cuda12.1-jupyter-v0.1"
+
+def _wait_until(pred, timeout=10.0, interval=0.1):
+    """轮询等待条件成立，超时返回 False"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if pred():
+            return True
+        time.sleep(interval)
+    return pred()
+
+def _unique_container_name():
+    """每次测试使用唯一的容器名，并行运行 (pytest -n auto) 时互不冲突"""
+    return f"test_{uuid.uuid4().hex[:8]}"
+
+@pytest.fixture(scope="module")
+def manager():
+    # 依赖真实的 Docker 守护进程和 NPS 服务，连接不上时跳过而不是报错
+    try:
+        return DockerContainerManager(tunnel_manager=DynamicTunnelManager())
+    except Exception as e:
+        pytest.skip(f"Docker/NPS 不可用: {e}")
+
+@pytest.fixture
+def container_name(manager):
+    name = _unique_container_name()
+    yield name
+    # 测试中途失败时也清理容器和隧道
+    manager.remove_container(name)
+
+def test_port_management(manager, container_name):
+    """测试端口管理功能：创建/停止/重启/删除容器时端口的分配与释放"""
+    # 1. 创建容器
+    ports = manager.create_container(
+        image=TEST_IMAGE,
         name=container_name,
         container_config={
             'root_password': '123456',
             'jupyter_token': '123456'
         }
     )
-    
-    if success:
-        print("容器创建成功，等待5秒...")
-        time.sleep(5)
-        
-        # 获取分配的端口
-        ports = manager.port_pool.get_ports(container_name)
-        print(f"分配的端口: {ports}")
-        
-        print("\n2. 停止容器")
-        manager.stop_container(container_name)
-        print("等待5秒检查端口释放情况...")
-        time.sleep(5)
-        
-        # 检查端口是否已释放
-        ports_after_stop = manager.port_pool.get_ports(container_name)
-        print(f"停止后端口状态: {'已释放' if ports_after_stop is None else '未释放'}")
-        
-        print("\n3. 重新启动容器")
-        manager.start_container(container_name)
-        print("等待5秒...")
-        time.sleep(5)
-        
-        # 检查新分配的端口
-        new_ports = manager.port_pool.get_ports(container_name)
-        print(f"重新分配的端口: {new_ports}")
-        
-        print("\n4. 删除容器")
-        manager.remove_container(container_name)
-        print("等待5秒检查最终端口释放情况...")
-        time.sleep(5)
-        
-        # 最终检查端口状态
-        final_ports = manager.port_pool.get_ports(container_name)
-        print(f"最终端口状态: {'已释放' if final_ports is None else '未释放'}")
-        
-        # 检查端口分配文件
-        print("\n5. 检查端口分配文件内容:")
-        manager.port_pool._load_allocations()
-        print(f"当前分配的端口: {manager.port_pool.allocated_ports}")
+    assert ports, "容器创建失败"
+    assert _wait_until(lambda: manager.get_container_ports(container_name) is not None)
+    assert manager.get_container_ports(container_name) == ports
+
+    # 2. 停止容器后端口应被释放
+    assert manager.stop_container(container_name)
+    assert _wait_until(lambda: manager.get_container_ports(container_name) is None), "停止后端口未释放"
+
+    # 3. 重新启动容器后重新分配端口
+    new_ports = manager.start_container(container_name)
+    assert new_ports, "重新启动容器失败"
+    assert _wait_until(lambda: manager.get_container_ports(container_name) is not None)
+    assert set(new_ports) == set(ports)
+
+    # 4. 删除容器后端口应被释放，且不再出现在端口分配记录中
+    assert manager.remove_container(container_name)
+    assert _wait_until(lambda: manager.get_container_ports(container_name) is None), "删除后端口未释放"
+    used_ports = manager.tunnel_manager.port_manager.get_used_ports()
+    assert not set(new_ports.values()) & set(used_ports)
 
 if __name__ == "__main__":
-    test_port_management() 
\ No newline at end of file
+    test_manager = DockerContainerManager(tunnel_manager=DynamicTunnelManager())
+    name = _unique_container_name()
+    try:
+        test_port_management(test_manager, name)
+        print("测试通过")
+    finally:
+        test_manager.remove_container(name)